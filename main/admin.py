@@ -1,9 +1,9 @@
-import os
-from textwrap import dedent
 from django.contrib import admin
 from django import forms
 from django.db import models
 from django.forms import Textarea
+from django.http import StreamingHttpResponse
+from django.utils.timezone import now
 from main.models import (
     Order, 
     ExampleOrder, 
@@ -15,13 +15,42 @@ from main.models import (
     Owner, 
     Manager, 
     Person,
-    Complaint
+    Complaint,
+    ContractorMonthlyEarnings,
+    DataExport,
+    PaymentEvent,
+    ReportJob
 )
-from telegram import Bot
-
 
 import nested_admin
 
+import main.management.commands.db_processing as db
+import main.management.commands.exports as exports
+import main.management.commands.reports as reports
+
+
+def enqueue_report(model_admin: admin.ModelAdmin, request, report: str, queryset) -> None:
+    """Ставит отчет в очередь: он соберется и уйдет менеджерам в фоне, не задерживая админку"""
+    job = reports.enqueue_report(report, queryset)
+    model_admin.message_user(request, f'Отчет №{job.id} поставлен в очередь, статус — в разделе «Отчеты»')
+
+
+def make_export_action(dataset: str, fmt: str):
+    """Действие админки: выбранные записи потоком в CSV или JSONL, без загрузки в память"""
+    def export(model_admin, request, queryset):
+        rows = exports.get_rows(dataset, ids=queryset.order_by().values('id'))
+        response = StreamingHttpResponse(
+            exports.iter_lines(rows, fmt),
+            content_type=exports.CONTENT_TYPES[fmt]
+        )
+        filename = f'{dataset}_{now():%Y%m%d_%H%M%S}.{fmt}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    export.__name__ = f'export_{dataset}_{fmt}'
+    export.short_description = f'Export {dataset} to {fmt.upper()}'
+    return export
+
 
 class OrderCommentsInline(admin.TabularInline):
     model = OrderComments
@@ -101,29 +130,15 @@ class OrderAdmin(admin.ModelAdmin):
         return obj.subscription.client
 
     def get_avg_orders_count(self, request, queryset):
-        summary = dedent(
-            '''
-            Отчет по числу заказов:
-            
-            '''
-        )
-        
-        orders_count = queryset.count()
-        summary += dedent(
-            f'''
-            Всего заказов: {orders_count}
-            '''
-        )
-        managers = Manager.objects.filter(active=True)
-        bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'))
-        for manager in managers:
-            bot.send_message(
-                manager.person.telegram_id,
-                summary
-            )
+        enqueue_report(self, request, ReportJob.ORDERS_COUNT, queryset)
     
     get_avg_orders_count.short_description = "Get orders count"
-    actions = ['get_avg_orders_count']  
+    actions = [
+        'get_avg_orders_count',
+        make_export_action('orders', 'csv'),
+        make_export_action('orders', 'jsonl'),
+        make_export_action('payouts', 'csv'),
+    ]
 
 
 @admin.register(Person)
@@ -176,29 +191,7 @@ class ContractorAdmin(admin.ModelAdmin):
     )
 
     def get_salary(self, request, queryset):
-        summary = dedent(
-            '''
-            Отчет по зарплатам:
-            
-            '''
-        )
-        for contractor in queryset.prefetch_related('orders'):
-            finished_orders = [order for order in contractor.orders.exclude(finished_at=None)]
-            salary = sum([order.salary for order in finished_orders])
-            summary += dedent(
-                f'''
-                Исполнитель: {contractor}
-                Выполнено заказов: {len(finished_orders)}
-                Заработано: {salary}
-                '''
-            )
-        managers = Manager.objects.filter(active=True)
-        bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'))
-        for manager in managers:
-            bot.send_message(
-                manager.person.telegram_id,
-                summary
-            )
+        enqueue_report(self, request, ReportJob.SALARY, queryset)
 
     get_salary.short_description = "Get salary"
     actions = [get_salary]
@@ -208,6 +201,71 @@ class ContractorAdmin(admin.ModelAdmin):
         return obj.person.telegram_id
 
 
+@admin.register(ContractorMonthlyEarnings)
+class ContractorMonthlyEarningsAdmin(admin.ModelAdmin):
+    list_display = ('contractor', 'month', 'orders_count', 'salary')
+    list_filter = ('month',)
+    search_fields = ('contractor__person__name', 'contractor__person__telegram_id')
+    list_select_related = ('contractor__person',)
+    readonly_fields = ('contractor', 'month', 'orders_count', 'salary')
+
+    def rebuild_earnings(self, request, queryset):
+        rows = db.rebuild_contractor_earnings()
+        self.message_user(request, f'Заработок пересчитан по заказам, записей: {rows}')
+
+    rebuild_earnings.short_description = "Пересчитать по заказам"
+    actions = [rebuild_earnings]
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'report', 'status', 'progress', 'messages_sent', 'created_at', 'finished_at')
+    list_filter = ('status', 'report')
+    readonly_fields = (
+        'report',
+        'status',
+        'progress',
+        'messages_sent',
+        'error',
+        'created_at',
+        'started_at',
+        'finished_at'
+    )
+    exclude = ('object_ids',)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ('payment_id', 'event', 'status', 'state', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('state', 'event')
+    search_fields = ('payment_id',)
+    readonly_fields = (
+        'payment_id',
+        'event',
+        'status',
+        'state',
+        'attempts',
+        'error',
+        'subscription',
+        'payload',
+        'received_at',
+        'started_at',
+        'processed_at'
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(DataExport)
+class DataExportAdmin(admin.ModelAdmin):
+    list_display = ('dataset', 'format', 'date_from', 'date_to', 'rows', 'created_at')
+    list_filter = ('dataset',)
+
+
 @admin.register(ClientSubscription)
 class ClientSubscriptionAdmin(admin.ModelAdmin):
     inlines = [
@@ -224,33 +282,15 @@ class ClientSubscriptionAdmin(admin.ModelAdmin):
     )
 
     def get_client_orders(self, request, queryset):
-        summary = dedent(
-            '''
-            Отчет по заказам:
-            
-            '''
-        )
-        for client in queryset.prefetch_related('orders'):
-            created_orders = len([order for order in client.orders.all()])
-            declined_orders = len([order for order in client.orders.filter(declined=True)])
-            summary += dedent(
-                f'''
-                Клиент: {client}
-                Размещено заказов: {created_orders}
-                Отклонено заказов: {declined_orders}
-                '''
-            )
-        managers = Manager.objects.filter(active=True)
-        bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'))
-        for manager in managers:
-            bot.send_message(
-                manager.person.telegram_id,
-                summary
-            )
+        enqueue_report(self, request, ReportJob.CLIENT_ORDERS, queryset)
 
     get_client_orders.short_description = "Get clients orders"
 
-    actions = [get_client_orders]
+    actions = [
+        get_client_orders,
+        make_export_action('subscriptions', 'csv'),
+        make_export_action('subscriptions', 'jsonl'),
+    ]
 
 
 @admin.register(Complaint)
@@ -258,3 +298,7 @@ class ComplaintAdmin(admin.ModelAdmin):
     list_display = ('order', 'complaint', 'created_at', 'closed_at')
     search_fields = ('order', )
     list_filter = ('created_at', )
+    actions = [
+        make_export_action('complaints', 'csv'),
+        make_export_action('complaints', 'jsonl'),
+    ]
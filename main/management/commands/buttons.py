@@ -28,9 +28,9 @@ CURRENT_ORDER = {'text': 'Заказ', 'callback_data': 'show_current_order'}
 
 FINISH_ORDER = {'text': 'Сдать заказ', 'callback_data': 'finish_order'}
 
-I_AM_CONTACTOR = {'text': 'Я подрядчик', 'callback_data': f'{CHECK_ACCESS_CALLBACK}:::contractor'}
+I_AM_CONTACTOR = {'text': 'Я подрядчик', 'role': 'contractor'}
 
-I_AM_CLIENT = {'text': 'Я заказчик', 'callback_data': f'{CHECK_ACCESS_CALLBACK}:::client'}
+I_AM_CLIENT = {'text': 'Я заказчик', 'role': 'client'}
 
 NEW_CONTRACTOR = {'text': 'Стать подрядчиком', 'callback_data': 'new_contractor'}
 
@@ -50,6 +50,7 @@ TAKE_ORDER = {'text': 'Взять заказ в работу', 'callback_data':
 
 # Кнопки для работы с категориями и услугами
 SELECT_CATEGORY = {'text': 'Выбрать категорию', 'callback_data': 'select_category'}
+SEARCH_SERVICES = {'text': 'Поиск услуг', 'callback_data': 'search_services'}
 ADD_SERVICE = {'text': 'Добавить услугу', 'callback_data': 'add_service'}
 EDIT_SERVICE = {'text': 'Изменить карточку', 'callback_data': 'edit_service'}
 DELETE_SERVICE = {'text': 'Удалить карточку', 'callback_data': 'delete_service'}
@@ -60,10 +61,29 @@ MY_CART = {'text': 'Моя корзина', 'callback_data': 'my_cart'}
 CLEAR_CART = {'text': 'Очистить корзину', 'callback_data': 'clear_cart'}
 CHECKOUT = {'text': 'Оформить заказ', 'callback_data': 'checkout'}
 
-# Шаблоны для динамических кнопок
-CATEGORY_CALLBACK = 'category:{}'
-SERVICE_CALLBACK = 'service:{}'
-ADD_TO_CART_CALLBACK = 'add_to_cart:{}'
-REMOVE_FROM_CART_CALLBACK = 'remove_from_cart:{}'
-EDIT_SERVICE_CALLBACK = 'edit_service:{}'
-DELETE_SERVICE_CALLBACK = 'delete_service:{}'
\ No newline at end of file
+# Действия кнопок с аргументами, callback_data собирается callbacks.encode(действие, *аргументы)
+# Аргумент: id категории
+CATEGORY_CALLBACK = 'category'
+# Аргумент: id услуги
+SERVICE_CALLBACK = 'service'
+ADD_TO_CART_CALLBACK = 'add_to_cart'
+REMOVE_FROM_CART_CALLBACK = 'remove_from_cart'
+EDIT_SERVICE_CALLBACK = 'edit_service'
+DELETE_SERVICE_CALLBACK = 'delete_service'
+EDIT_SERVICE_TITLE_CALLBACK = 'edit_service_title'
+EDIT_SERVICE_DESCRIPTION_CALLBACK = 'edit_service_description'
+EDIT_SERVICE_PRICE_CALLBACK = 'edit_service_price'
+EDIT_SERVICE_CATEGORY_CALLBACK = 'edit_service_category'
+EDIT_SERVICE_PHOTO_CALLBACK = 'edit_service_photo'
+# Аргумент: id тарифа
+ACTIVATE_SUBSCRIPTION_CALLBACK = 'activate_subscription'
+# Аргумент: UUID платежа YooKassa
+CHECK_PAYMENT_CALLBACK = 'check_payment'
+# Страницы услуг: id категории, направление 'next' или 'prev' и id крайней услуги текущей страницы
+SERVICES_PAGE_CALLBACK = 'services_page'
+# Страницы услуг исполнителя: направление и id крайней услуги
+CONTRACTOR_SERVICES_PAGE_CALLBACK = 'my_services_page'
+# Страница результатов поиска: смещение от начала выдачи
+SEARCH_PAGE_CALLBACK = 'search_page'
+PREV_PAGE_TEXT = '◀️'
+NEXT_PAGE_TEXT = '▶️'
@@ -0,0 +1,87 @@
+import re
+
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from telegram import CallbackQuery, Update, User
+from telegram.ext import CallbackQueryHandler
+
+import main.management.commands.callbacks as callbacks
+
+from main.management.commands.callback_router import CallbackRouter
+from main.management.commands.runbot import create_conversation_handler
+
+
+def build_callback_update(data: str) -> Update:
+    user = User(id=100000, first_name='Bench', is_bot=False)
+    return Update(
+        update_id=1,
+        callback_query=CallbackQuery(id='1', from_user=user, chat_instance='1', data=data)
+    )
+
+
+def expand_router(handlers: list) -> list:
+    """Список обработчиков состояния в прежнем виде: по CallbackQueryHandler с регулярным выражением на кнопку"""
+    expanded = []
+    for handler in handlers:
+        if isinstance(handler, CallbackRouter):
+            expanded.extend(
+                CallbackQueryHandler(callback, pattern=f'^{re.escape(action)}')
+                for action, callback in handler.routes.items()
+            )
+        else:
+            expanded.append(handler)
+    return expanded
+
+
+def find_handler(handlers: list, update: Update):
+    """Первый подходящий обработчик, как его ищет ConversationHandler"""
+    for handler in handlers:
+        if handler.check_update(update):
+            return handler
+    return None
+
+
+def measure(handlers: list, updates: list[Update], rounds: int) -> float:
+    """Среднее время выбора обработчика на одно обновление, нс"""
+    started_at = perf_counter()
+    for _ in range(rounds):
+        for update in updates:
+            find_handler(handlers, update)
+    return (perf_counter() - started_at) / (rounds * len(updates)) * 1e9
+
+
+class Command(BaseCommand):
+    help = "Микробенчмарк выбора обработчика нажатия кнопки: словарь действий против списка регулярных выражений"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=2000, help='Сколько раз прогнать каждое нажатие')
+
+    def handle(self, *args, **options):
+        conversation = create_conversation_handler(redis=None)
+        totals = {'legacy': 0, 'router': 0}
+        count = 0
+        for state, handlers in conversation.states.items():
+            routers = [handler for handler in handlers if isinstance(handler, CallbackRouter)]
+            if not routers:
+                continue
+            # Нажатия всех кнопок состояния плюс кнопка из другого состояния, которую никто не обработает
+            updates = [
+                build_callback_update(callbacks.encode(action, 1))
+                for router in routers
+                for action in router.routes
+            ] + [build_callback_update(callbacks.encode('unknown_action', 1))]
+            legacy = measure(expand_router(handlers), updates, options['rounds'])
+            router = measure(handlers, updates, options['rounds'])
+            totals['legacy'] += legacy * len(updates)
+            totals['router'] += router * len(updates)
+            count += len(updates)
+            self.stdout.write(
+                f'{state:<36} кнопок: {len(updates) - 1:>2}  '
+                f'regex: {legacy:>7.0f} нс  router: {router:>7.0f} нс  x{legacy / router:.1f}'
+            )
+        self.stdout.write(
+            f'Среднее на нажатие: regex {totals["legacy"] / count:.0f} нс, '
+            f'router {totals["router"] / count:.0f} нс, '
+            f'x{totals["legacy"] / totals["router"]:.1f}'
+        )
@@ -0,0 +1,56 @@
+import logging
+
+from typing import Callable, Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext, Handler
+
+import main.management.commands.callbacks as callbacks
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackRouter(Handler):
+    """Обработчик нажатий inline кнопок одного состояния диалога.
+
+    Вместо списка CallbackQueryHandler с регулярными выражениями, которые
+    проверяются по очереди, действие из callback_data ищется в словаре.
+    Аргументы кнопки передаются в context.args.
+    """
+
+    def __init__(self, state: str, routes: list[tuple[str, Callable]]):
+        super().__init__(callback=None)
+        self.state = state
+        self.routes = {}
+        for callback_data, callback in routes:
+            action = callbacks.get_action(callback_data)
+            if action in self.routes and self.routes[action] is not callback:
+                raise ValueError(
+                    f'Кнопки состояния {state} конфликтуют: действие {action!r} '
+                    f'ведет в {self.routes[action]} и в {callback}'
+                )
+            self.routes[action] = callback
+
+    def check_update(self, update: object) -> Optional[tuple[str, tuple]]:
+        if not isinstance(update, Update) or not update.callback_query:
+            return None
+        data = update.callback_query.data
+        if not data:
+            return None
+        try:
+            action, args = callbacks.decode(data)
+        except callbacks.CallbackDataError as error:
+            logger.warning(f'Skip button in state {self.state}: {error}')
+            return None
+        if action not in self.routes:
+            return None
+        return action, args
+
+    def handle_update(self,
+                      update: Update,
+                      dispatcher,
+                      check_result: tuple[str, tuple],
+                      context: CallbackContext = None):
+        action, args = check_result
+        context.args = list(args)
+        return self.routes[action](update, context)
@@ -0,0 +1,195 @@
+"""Компактная запись callback_data inline кнопок.
+
+Кнопка без аргументов — просто действие: 'cancel'. Аргументы упаковываются
+в байты с типом каждого значения и записываются в base64 после точки
+и версии формата: 'category.1AgU'. Если запись не помещается в лимит
+Telegram, байты кладутся в Redis, а в кнопку идет короткий ключ: 'action.1~ключ'.
+
+Старые кнопки вида 'show_order:::15' и 'category:5' из уже отправленных
+сообщений по-прежнему разбираются.
+"""
+import re
+
+from base64 import b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from functools import lru_cache
+from hashlib import sha256
+from uuid import UUID
+
+import main.management.commands.redis_pool as redis_pool
+
+VERSION = '1'
+# Лимит Telegram на callback_data, байт
+MAX_CALLBACK_DATA = 64
+PAYLOAD_KEY = 'callback_payload:{}'
+# Кнопки живут в истории чата, поэтому аргументы хранятся долго
+PAYLOAD_TTL = 30 * 24 * 60 * 60
+PAYLOAD_KEY_LENGTH = 12
+
+ARGS_MARK = '.'
+STORED_MARK = '~'
+LEGACY_SEPARATOR = ':'
+
+# Типы аргументов
+INT = ord('i')
+STR = ord('s')
+UUID_TYPE = ord('u')
+TRUE = ord('t')
+FALSE = ord('f')
+NONE = ord('n')
+
+ACTION_RE = re.compile(r'([a-z_]+)(?:([.:])(.*))?', re.DOTALL)
+
+
+class CallbackDataError(ValueError):
+    pass
+
+
+def write_varint(value: int, result: bytearray) -> None:
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            result.append(byte | 0x80)
+        else:
+            result.append(byte)
+            return
+
+
+def read_varint(packed: bytes, position: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        if position >= len(packed) or shift > 63:
+            raise CallbackDataError('Обрезанное число')
+        byte = packed[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def pack(args: tuple) -> bytes:
+    result = bytearray()
+    for arg in args:
+        if arg is None:
+            result.append(NONE)
+        elif isinstance(arg, bool):
+            result.append(TRUE if arg else FALSE)
+        elif isinstance(arg, int):
+            result.append(INT)
+            # zigzag: отрицательные числа тоже занимают мало байт
+            write_varint(arg << 1 if arg >= 0 else (-arg << 1) - 1, result)
+        elif isinstance(arg, UUID):
+            result.append(UUID_TYPE)
+            result += arg.bytes
+        elif isinstance(arg, str):
+            encoded = arg.encode()
+            result.append(STR)
+            write_varint(len(encoded), result)
+            result += encoded
+        else:
+            raise TypeError(f'Неподдерживаемый аргумент кнопки: {arg!r}')
+    return bytes(result)
+
+
+def unpack(packed: bytes) -> tuple:
+    args = []
+    position = 0
+    while position < len(packed):
+        kind = packed[position]
+        position += 1
+        if kind == NONE:
+            args.append(None)
+        elif kind in (TRUE, FALSE):
+            args.append(kind == TRUE)
+        elif kind == INT:
+            value, position = read_varint(packed, position)
+            args.append(value >> 1 if not value & 1 else -((value + 1) >> 1))
+        elif kind == UUID_TYPE:
+            if position + 16 > len(packed):
+                raise CallbackDataError('Обрезанный UUID')
+            args.append(UUID(bytes=packed[position:position + 16]))
+            position += 16
+        elif kind == STR:
+            length, position = read_varint(packed, position)
+            if position + length > len(packed):
+                raise CallbackDataError('Обрезанная строка')
+            try:
+                args.append(packed[position:position + length].decode())
+            except UnicodeDecodeError as error:
+                raise CallbackDataError(f'Битая строка: {error}')
+            position += length
+        else:
+            raise CallbackDataError(f'Неизвестный тип аргумента: {kind}')
+    return tuple(args)
+
+
+def to_base64(packed: bytes) -> str:
+    return urlsafe_b64encode(packed).rstrip(b'=').decode()
+
+
+def from_base64(text: str) -> bytes:
+    try:
+        return b64decode(text + '=' * (-len(text) % 4), altchars=b'-_', validate=True)
+    except Base64Error as error:
+        raise CallbackDataError(f'Битый base64: {error}')
+
+
+def encode(action: str, *args) -> str:
+    """callback_data кнопки: действие и типизированные аргументы (int, str, UUID, bool, None)"""
+    if not args:
+        return action
+    packed = pack(args)
+    data = f'{action}{ARGS_MARK}{VERSION}{to_base64(packed)}'
+    if len(data.encode()) <= MAX_CALLBACK_DATA:
+        return data
+
+    # Одинаковые аргументы дают один ключ, поэтому повторная отрисовка кнопок не плодит записи
+    key = to_base64(sha256(packed).digest())[:PAYLOAD_KEY_LENGTH]
+    redis_pool.get_redis().set(PAYLOAD_KEY.format(key), to_base64(packed), ex=PAYLOAD_TTL)
+    data = f'{action}{ARGS_MARK}{VERSION}{STORED_MARK}{key}'
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise CallbackDataError(f'Слишком длинное действие: {action}')
+    return data
+
+
+def parse_legacy_args(rest: str) -> tuple:
+    """Аргументы старых кнопок: 'show_order:::15', 'services_page:3:next:40'"""
+    if not rest:
+        return ()
+    if rest.startswith(LEGACY_SEPARATOR * 2):
+        rest = rest[2:]
+    return tuple(int(arg) if arg.isdigit() else arg for arg in rest.split(LEGACY_SEPARATOR))
+
+
+@lru_cache(maxsize=4096)
+def decode(data: str) -> tuple[str, tuple]:
+    """Действие и аргументы из callback_data. Неверные данные — CallbackDataError"""
+    match = ACTION_RE.fullmatch(data or '')
+    if not match:
+        raise CallbackDataError(f'Неизвестный формат callback_data: {data!r}')
+    action, mark, rest = match.groups()
+    if mark != ARGS_MARK:
+        return action, parse_legacy_args(rest)
+
+    if not rest.startswith(VERSION):
+        raise CallbackDataError(f'Неподдерживаемая версия callback_data: {data!r}')
+    payload = rest[len(VERSION):]
+    if payload.startswith(STORED_MARK):
+        stored = redis_pool.get_redis().get(PAYLOAD_KEY.format(payload[1:]))
+        if stored is None:
+            raise CallbackDataError(f'Аргументы кнопки устарели: {data!r}')
+        payload = stored
+    return action, unpack(from_base64(payload))
+
+
+def get_action(callback_data: str) -> str:
+    """Действие кнопки без разбора аргументов"""
+    match = ACTION_RE.fullmatch(callback_data)
+    return match.group(1) if match else callback_data
+
+
+def get_args(update) -> tuple:
+    """Аргументы нажатой кнопки"""
+    return decode(update.callback_query.data)[1]
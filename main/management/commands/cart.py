@@ -0,0 +1,113 @@
+from decimal import Decimal
+from typing import Optional
+
+from redis import Redis
+
+import main.management.commands.db_processing as db
+import main.management.commands.redis_pool as redis_pool
+
+from main.management.commands.catalog import get_catalog
+
+from main import models as main_models
+
+# Корзина клиента: hash id услуги -> цена на момент добавления
+CART_KEY = 'cart:{}'
+# Брошенная корзина удаляется через месяц после последнего изменения
+CART_TTL = 30 * 24 * 60 * 60
+
+
+class CartSummary:
+    """Состав и стоимость корзины, посчитанные один раз.
+
+    Из него рисуются и текст сообщения, и клавиатура, поэтому показ корзины
+    не пересчитывает суммы и не ходит за услугами повторно. Скидка считается
+    по тому же правилу, что и ServiceSet.get_total_price.
+    """
+
+    def __init__(self, items: list[dict]):
+        self.items = items
+        self.subtotal = sum((item['price'] for item in items), Decimal(0))
+        self.discount_percent = main_models.ServiceSet.get_discount_percent(len(items))
+        self.total = main_models.ServiceSet.apply_discount(self.subtotal, len(items))
+
+    @classmethod
+    def from_service_set(cls, service_set: main_models.ServiceSet) -> 'CartSummary':
+        """Сводка по сохраненному набору, услуги лучше получить через prefetch_related('services')"""
+        return cls([
+            {'id': service.id, 'title': service.title, 'price': service.get_final_price()}
+            for service in sorted(service_set.services.all(), key=lambda service: service.id)
+        ])
+
+    @property
+    def has_discount(self) -> bool:
+        return self.discount_percent > 0
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def add_service(telegram_id: int, service_id: int, redis: Redis = None) -> bool:
+    """Кладет услугу в корзину с текущей ценой. False, если услуга уже неактивна"""
+    service = get_catalog().get_service(service_id)
+    if service is None:
+        return False
+    redis = redis or redis_pool.get_redis()
+    key = CART_KEY.format(telegram_id)
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.hset(key, service_id, service['price'])
+        pipe.expire(key, CART_TTL)
+        pipe.execute()
+    return True
+
+
+def remove_service(telegram_id: int, service_id: int, redis: Redis = None) -> bool:
+    redis = redis or redis_pool.get_redis()
+    return bool(redis.hdel(CART_KEY.format(telegram_id), service_id))
+
+
+def clear(telegram_id: int, redis: Redis = None) -> None:
+    redis = redis or redis_pool.get_redis()
+    redis.delete(CART_KEY.format(telegram_id))
+
+
+def get_items(telegram_id: int, redis: Redis = None) -> list[dict]:
+    """Услуги корзины: названия из кэша каталога, цены — сохраненные при добавлении.
+
+    Услуги, снятые с продажи после добавления, из корзины убираются.
+    """
+    redis = redis or redis_pool.get_redis()
+    key = CART_KEY.format(telegram_id)
+    prices = redis.hgetall(key)
+    catalog = get_catalog()
+    items = []
+    gone = []
+    for service_id, price in sorted(prices.items(), key=lambda item: int(item[0])):
+        service = catalog.get_service(int(service_id))
+        if service is None:
+            gone.append(service_id)
+            continue
+        items.append({'id': service['id'], 'title': service['title'], 'price': Decimal(price)})
+    if gone:
+        redis.hdel(key, *gone)
+    return items
+
+
+def get_summary(telegram_id: int, redis: Redis = None) -> CartSummary:
+    return CartSummary(get_items(telegram_id, redis))
+
+
+def checkout(telegram_id: int, redis: Redis = None) -> Optional[tuple[main_models.ServiceSet, CartSummary]]:
+    """Сохраняет корзину в ServiceSet, отправленный на оплату, и очищает ее.
+
+    Это единственный момент, когда корзина попадает в БД.
+    """
+    redis = redis or redis_pool.get_redis()
+    summary = get_summary(telegram_id, redis)
+    if not summary:
+        return None
+    service_set = db.save_service_set(telegram_id, [item['id'] for item in summary.items])
+    clear(telegram_id, redis)
+    return service_set, summary
@@ -0,0 +1,174 @@
+import json
+import logging
+
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+from django.conf import settings
+from redis import Redis, RedisError
+
+import main.management.commands.db_processing as db
+import main.management.commands.redis_pool as redis_pool
+
+from main import models as main_models
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PREFIX = 'catalog'
+VERSION_KEY = f'{CATALOG_PREFIX}:version'
+
+# Как часто сверять версию каталога с Redis, секунд
+VERSION_CHECK_INTERVAL = 5
+
+DEFAULT_PAGE_SIZE = 10
+
+
+class CatalogCache:
+    """Кэш каталога услуг: категории, активные услуги категорий и готовые клавиатуры.
+
+    Первый уровень — память процесса, второй (необязательный) — Redis.
+    Любое изменение Service или ServiceCategory увеличивает версию каталога,
+    и все процессы перечитывают данные при следующей сверке версии.
+    Без Redis другие процессы увидят изменения не позже чем через ttl секунд.
+    """
+
+    def __init__(self, redis: Redis = None, ttl: int = 300):
+        self.redis = redis
+        self.ttl = ttl
+        self._local = {}
+        self._version = None
+        self._synced_at = None
+        self._loaded_at = monotonic()
+        self._lock = Lock()
+
+    def _sync(self) -> None:
+        with self._lock:
+            if self.redis is None:
+                if monotonic() - self._loaded_at > self.ttl:
+                    self._reset(self._version)
+                return
+            if self._synced_at and monotonic() - self._synced_at < VERSION_CHECK_INTERVAL:
+                return
+            try:
+                version = self.redis.get(VERSION_KEY) or '0'
+            except RedisError as error:
+                logger.warning(f'Catalog version check failed: {error}')
+                version = self._version
+            self._synced_at = monotonic()
+            if version != self._version:
+                self._reset(version)
+
+    def _reset(self, version: Optional[str]) -> None:
+        self._local = {}
+        self._version = version
+        self._loaded_at = monotonic()
+
+    def _get(self, key: str, load):
+        self._sync()
+        local = self._local
+        if key in local:
+            return local[key]
+
+        redis_key = f'{CATALOG_PREFIX}:{self._version}:{key}'
+        value = None
+        if self.redis is not None:
+            try:
+                payload = self.redis.get(redis_key)
+                value = json.loads(payload) if payload else None
+            except RedisError as error:
+                logger.warning(f'Catalog read from Redis failed: {error}')
+        if value is None:
+            value = load()
+            if self.redis is not None:
+                try:
+                    self.redis.set(redis_key, json.dumps(value), ex=self.ttl)
+                except RedisError as error:
+                    logger.warning(f'Catalog write to Redis failed: {error}')
+        local[key] = value
+        return value
+
+    def get_categories(self) -> list[dict]:
+        return self._get('categories', lambda: [
+            {'id': category.id, 'name': category.name, 'page_size': category.page_size}
+            for category in main_models.ServiceCategory.objects.only('id', 'name', 'page_size')
+        ])
+
+    def get_category(self, category_id: int) -> Optional[dict]:
+        categories = self._get('categories_by_id', lambda: {
+            str(category['id']): category for category in self.get_categories()
+        })
+        return categories.get(str(category_id))
+
+    def get_services_page(self,
+                          category_id: int,
+                          after_id: int = None,
+                          before_id: int = None) -> dict:
+        """Страница активных услуг категории, см. db.get_services_page"""
+        def load() -> dict:
+            category = self.get_category(category_id)
+            services, has_prev, has_next = db.get_services_page(
+                main_models.Service.objects
+                .filter(category_id=category_id, is_active=True)
+                .only('id', 'title', 'price'),
+                page_size=category['page_size'] if category else DEFAULT_PAGE_SIZE,
+                after_id=after_id,
+                before_id=before_id
+            )
+            return {
+                'services': [
+                    {'id': service.id, 'title': service.title, 'price': str(service.price)}
+                    for service in services
+                ],
+                'has_prev': has_prev,
+                'has_next': has_next,
+            }
+        return self._get(f'services:{category_id}:{after_id}:{before_id}', load)
+
+    def get_service(self, service_id: int) -> Optional[dict]:
+        """Активная услуга с ценой после скидки или None"""
+        def load() -> dict:
+            service = main_models.Service.objects \
+                .filter(id=service_id, is_active=True) \
+                .only('id', 'title', 'price', 'discount') \
+                .first()
+            if service is None:
+                return {}
+            return {'id': service.id, 'title': service.title, 'price': str(service.get_final_price())}
+        return self._get(f'service:{service_id}', load) or None
+
+    def get_keyboard(self, key: str, build):
+        """Готовая клавиатура хранится только в памяти процесса"""
+        self._sync()
+        local = self._local
+        keyboard_key = ('keyboard', key)
+        if keyboard_key not in local:
+            local[keyboard_key] = build()
+        return local[keyboard_key]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._reset(self._version)
+            if self.redis is None:
+                return
+            try:
+                self._version = str(self.redis.incr(VERSION_KEY))
+                self._synced_at = monotonic()
+            except RedisError as error:
+                logger.warning(f'Catalog invalidation in Redis failed: {error}')
+
+
+catalog = None
+catalog_lock = Lock()
+
+
+def get_catalog() -> CatalogCache:
+    """Общий на процесс кэш каталога"""
+    global catalog
+    with catalog_lock:
+        if catalog is None:
+            catalog = CatalogCache(
+                redis=redis_pool.get_redis() if settings.CATALOG_CACHE_REDIS else None,
+                ttl=settings.CATALOG_CACHE_TTL
+            )
+    return catalog
@@ -0,0 +1,121 @@
+import logging
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений одного чата обработать подряд, прежде чем уступить поток другим чатам
+CHAT_BATCH_SIZE = 8
+
+
+def get_chat_key(update: object) -> Optional[int]:
+    """Ключ очереди: обновления с одним ключом обрабатываются строго по порядку"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedExecutor:
+    """Пул потоков: разные чаты обрабатываются параллельно, обновления одного чата — по очереди"""
+
+    def __init__(self, workers: int = 8):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-worker')
+        self._lock = Lock()
+        self._chats = {}
+        self._queue_depth = 0
+        self._processed = 0
+        self._waits = deque(maxlen=1000)
+
+    def submit(self, key: Optional[int], func, *args) -> None:
+        item = (monotonic(), func, args)
+        with self._lock:
+            self._queue_depth += 1
+            if key is None:
+                self._pool.submit(self._run, item)
+                return
+            if key in self._chats:
+                self._chats[key].append(item)
+                return
+            self._chats[key] = deque([item])
+        self._pool.submit(self._drain, key)
+
+    def _drain(self, key: int) -> None:
+        processed = 0
+        while True:
+            with self._lock:
+                chat_queue = self._chats[key]
+                if not chat_queue:
+                    del self._chats[key]
+                    return
+                item = chat_queue.popleft()
+            self._run(item)
+            processed += 1
+            if processed < CHAT_BATCH_SIZE:
+                continue
+            try:
+                # Продолжим очередь чата после задач других чатов
+                self._pool.submit(self._drain, key)
+                return
+            except RuntimeError:
+                # Пул останавливается: дорабатываем очередь в текущем потоке
+                processed = 0
+
+    def _run(self, item: tuple) -> None:
+        enqueued_at, func, args = item
+        with self._lock:
+            self._queue_depth -= 1
+            self._waits.append(monotonic() - enqueued_at)
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('Unhandled error in chat worker')
+        finally:
+            with self._lock:
+                self._processed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                'workers': self.workers,
+                'queue_depth': self._queue_depth,
+                'active_chats': len(self._chats),
+                'processed': self._processed,
+                'avg_wait_ms': round(sum(waits) / len(waits) * 1000, 1) if waits else 0,
+                'p95_wait_ms': round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0,
+                'max_wait_ms': round(waits[-1] * 1000, 1) if waits else 0,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+class ChatOrderedDispatcher(Dispatcher):
+    """Диспетчер, передающий обработку обновлений в ChatOrderedExecutor.
+
+    Обновление целиком (включая переход состояния ConversationHandler)
+    обрабатывается в потоке пула, поэтому порядок внутри чата сохраняется.
+    """
+
+    def __init__(self, *args, executor: ChatOrderedExecutor, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = executor
+
+    def process_update(self, update: object) -> None:
+        self.executor.submit(get_chat_key(update), super().process_update, update)
+
+    def stop(self) -> None:
+        super().stop()
+        self.executor.shutdown()
@@ -1,8 +1,13 @@
-from django.db.models import QuerySet
-from django.utils.timezone import datetime, timedelta, now
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DateField, F, QuerySet, Sum
+from django.db.models.functions import TruncMonth
+from django.utils.timezone import datetime, timedelta, now, localtime
 from django.db.utils import IntegrityError
 import logging
 
+from typing import Optional
+
 import main.management.commands.messages as messages
 
 from main import models as main_models
@@ -10,6 +15,12 @@ from main import models as main_models
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+# Сколько последних месяцев показывать в отчете о заработке
+CONTRACTOR_EARNINGS_MONTHS = 3
+
+# Поля заказа, которые нужны Order.display() и кнопкам списка заказов
+ORDER_DISPLAY_FIELDS = ('id', 'created_at', 'description', 'estimated_time', 'contractor')
+
 
 class EntityNotFoundError(Exception):
     def __init__(self, message: str = 'Сущность не найдена'):
@@ -78,13 +89,10 @@ def get_contractor(telegram_id: int) -> main_models.Contractor:
 def is_actual_client_subscription(client_telegram_id: int) -> bool:
     logger.debug(f'Checking subscription for client {client_telegram_id}')
     try:
-        client = main_models.Client.objects.get(person__telegram_id=client_telegram_id)
-        has_subscription = client.has_actual_subscription()
+        subscription = main_models.ClientSubscription.objects.last_for_client(client_telegram_id)
+        has_subscription = bool(subscription and subscription.is_actual())
         logger.debug(f'Client {client_telegram_id} has active subscription: {has_subscription}')
         return has_subscription
-    except main_models.Client.DoesNotExist:
-        logger.error(f'Client {client_telegram_id} not found')
-        return False
     except Exception as e:
         logger.error(f'Error checking subscription: {e}')
         return False
@@ -117,6 +125,27 @@ def create_subscription(telegram_id: int,
     return subscription
 
 
+def activate_payment(telegram_id: int,
+                     tariff_id: int,
+                     payment_id: str) -> tuple[main_models.ClientSubscription, bool]:
+    """Подписка по оплаченному платежу, созданная ровно один раз.
+
+    Вебхук, кнопка «Проверить оплату» и сверка платежей могут прийти
+    с одним платежом одновременно: уникальность payment_id в БД оставляет
+    одну подписку. Возвращает подписку и признак, что она создана сейчас.
+    """
+    subscription = main_models.ClientSubscription.objects.select_related('tariff') \
+        .filter(payment_id=payment_id) \
+        .first()
+    if subscription:
+        return subscription, False
+    try:
+        with transaction.atomic():
+            return create_subscription(telegram_id, tariff_id, payment_id), True
+    except IntegrityError:
+        return main_models.ClientSubscription.objects.select_related('tariff').get(payment_id=payment_id), False
+
+
 def create_order(telegram_id: int, description: str) -> main_models.Order:
     subscription = main_models.Client.objects.get(person__telegram_id=telegram_id) \
         .subscriptions.last()
@@ -127,24 +156,37 @@ def create_order(telegram_id: int, description: str) -> main_models.Order:
     return order
 
 
+def get_orders_with_participants() -> QuerySet:
+    """Заказы вместе с клиентом и подрядчиком — для карточки заказа и уведомлений"""
+    return main_models.Order.objects.select_related(
+        'subscription__client__person',
+        'contractor__person'
+    )
+
+
 def get_current_client_orders(telegram_id: int) -> QuerySet:
-    return get_client(telegram_id=telegram_id).get_current_orders()
+    return main_models.Order.objects.filter(
+        subscription__client__person__telegram_id=telegram_id,
+        finished_at=None,
+        declined=False
+    ).only(*ORDER_DISPLAY_FIELDS)
 
 
 def is_available_client_request(client_telegram_id: int) -> bool:
-    return get_client(telegram_id=client_telegram_id).is_new_request_available()
+    subscription = main_models.ClientSubscription.objects.last_for_client(client_telegram_id)
+    return bool(subscription and subscription.orders_left() > 0)
 
 
 def get_order(order_id: int) -> main_models.Order:
-    return main_models.Order.objects.get(id=order_id)
+    return get_orders_with_participants().get(id=order_id)
 
 
 def get_client_subscription_info(telegram_id: int) -> str or None:
     logger.debug(f'Getting subscription info for client {telegram_id}')
     try:
-        subscription = get_client(telegram_id=telegram_id).subscriptions.last()
+        subscription = main_models.ClientSubscription.objects.last_for_client(telegram_id)
         if subscription and subscription.is_actual():
-            logger.debug(f'Found active subscription: {subscription}')
+            logger.debug(f'Found active subscription: {subscription.id}')
             return subscription.info_subscription()
         logger.debug('No active subscription found')
         return None
@@ -154,7 +196,7 @@ def get_client_subscription_info(telegram_id: int) -> str or None:
 
 
 def can_see_contractor_contacts(telegram_id: int) -> bool:
-    subscription = get_client(telegram_id=telegram_id).subscriptions.last()
+    subscription = main_models.ClientSubscription.objects.last_for_client(telegram_id)
     if subscription and subscription.is_actual():
         return subscription.tariff.contractor_contacts_availability
 
@@ -162,7 +204,7 @@ def can_see_contractor_contacts(telegram_id: int) -> bool:
 def create_comment_from_client(order_id: int,
                                comment: str) -> tuple[main_models.Order,
                                                       main_models.OrderComments]:
-    order = main_models.Order.objects.get(id=order_id)
+    order = get_orders_with_participants().get(id=order_id)
     comment = main_models.OrderComments.objects.create(
         order=order,
         author='client',
@@ -181,7 +223,7 @@ def create_comment_from_contractor(order_id: int, comment: str) -> None:
 
 
 def get_order_contractor_contact(order_id: int) -> dict:
-    order = main_models.Order.objects.get(id=order_id)
+    order = main_models.Order.objects.select_related('contractor__person').get(id=order_id)
     if not order.contractor:
         raise EntityNotFoundError(messages.CONTRACTOR_NOT_FOUND)
     return {
@@ -194,7 +236,7 @@ def get_order_contractor_contact(order_id: int) -> dict:
 def create_client_order_complaint(order_id: int,
                                   complaint: str) -> tuple[main_models.Order,
                                                            main_models.Complaint]:
-    order = main_models.Order.objects.get(id=order_id)
+    order = get_orders_with_participants().get(id=order_id)
     complaint = main_models.Complaint.objects.create(
         order=order,
         complaint=complaint
@@ -203,34 +245,90 @@ def create_client_order_complaint(order_id: int,
 
 
 def get_contractor_available_orders(telegram_id: int) -> QuerySet:
-    return main_models.Order.objects.get_availables().order_by('created_at')
+    return main_models.Order.objects.get_availables() \
+        .order_by('created_at') \
+        .only(*ORDER_DISPLAY_FIELDS)
 
 
 def set_estimate_datetime(order_id: int, estimate_datetime: datetime) -> main_models.Order:
-    order = main_models.Order.objects.get(id=order_id)
+    order = get_orders_with_participants().get(id=order_id)
     order.estimated_time = estimate_datetime
-    order.save()
+    order.save(update_fields=['estimated_time'])
     return order
 
 
 def close_order(order_id: int) -> main_models.Order:
-    order = main_models.Order.objects.get(id=order_id)
-    order.finished_at = now()
-    order.save()
+    """Закрывает заказ. Повторное закрытие не меняет дату и не учитывает заработок дважды"""
+    with transaction.atomic():
+        closed = main_models.Order.objects \
+            .filter(id=order_id, finished_at=None) \
+            .update(finished_at=now())
+        order = get_orders_with_participants().get(id=order_id)
+        if closed and order.contractor_id and settings.CONTRACTOR_EARNINGS_ROLLUP:
+            add_contractor_earnings(order)
     return order
 
 
-def set_order_contractor(telegram_id: int, order_id: int) -> main_models.Order:
-    order = main_models.Order.objects.get(id=order_id)
-    contractor = get_contractor(telegram_id=telegram_id)
-    order.contractor = contractor
-    order.save()
-    return order
+def get_month(moment: datetime):
+    return localtime(moment).date().replace(day=1)
+
+
+def add_contractor_earnings(order: main_models.Order) -> None:
+    earnings, _ = main_models.ContractorMonthlyEarnings.objects.get_or_create(
+        contractor_id=order.contractor_id,
+        month=get_month(order.finished_at)
+    )
+    main_models.ContractorMonthlyEarnings.objects.filter(id=earnings.id).update(
+        orders_count=F('orders_count') + 1,
+        salary=F('salary') + order.salary
+    )
+
+
+def rebuild_contractor_earnings() -> int:
+    """Пересчитывает заработок по месяцам из заказов, например после правки заказов в админке"""
+    rows = main_models.Order.objects.filter(finished_at__isnull=False, contractor__isnull=False) \
+        .annotate(month=TruncMonth('finished_at', output_field=DateField())) \
+        .values('contractor_id', 'month') \
+        .annotate(orders_count=Count('id'), salary=Sum('salary')) \
+        .order_by()
+    with transaction.atomic():
+        main_models.ContractorMonthlyEarnings.objects.all().delete()
+        earnings = main_models.ContractorMonthlyEarnings.objects.bulk_create([
+            main_models.ContractorMonthlyEarnings(
+                contractor_id=row['contractor_id'],
+                month=row['month'],
+                orders_count=row['orders_count'],
+                salary=row['salary']
+            )
+            for row in rows
+        ])
+    return len(earnings)
+
+
+def claim_order(telegram_id: int, order_id: int) -> Optional[main_models.Order]:
+    """Закрепляет свободный заказ за подрядчиком.
+
+    Заказ занимается одним условным UPDATE, поэтому при одновременных нажатиях
+    «взять» из разных воркеров заказ достается ровно одному подрядчику.
+    Возвращает заказ, если он достался этому подрядчику, иначе None.
+    """
+    contractor_id = main_models.Contractor.objects \
+        .filter(person__telegram_id=telegram_id) \
+        .values_list('id', flat=True) \
+        .get()
+    claimed = main_models.Order.objects.get_availables() \
+        .filter(id=order_id) \
+        .update(contractor_id=contractor_id, take_at=now())
+    if not claimed:
+        logger.info(f'Order {order_id} is already taken, contractor {telegram_id} lost')
+        return None
+    return get_orders_with_participants().get(id=order_id)
 
 
 def get_managers_telegram_ids() -> tuple[int]:
-    managers = main_models.Manager.objects.filter(active=True)
-    return tuple(manager.person.telegram_id for manager in managers)
+    return tuple(
+        main_models.Manager.objects.filter(active=True).values_list('person__telegram_id', flat=True)
+    )
 
 
 def get_service_categories():
@@ -245,6 +343,25 @@ def get_services_by_category(category_id):
     return Service.objects.filter(category_id=category_id, is_active=True)
 
 
+def get_services_page(services: QuerySet,
+                      page_size: int,
+                      after_id: int = None,
+                      before_id: int = None) -> tuple[list, bool, bool]:
+    """Страница услуг по ключу id: одна страница плюс одна строка за запрос.
+
+    Возвращает услуги страницы и признаки наличия предыдущей и следующей страниц.
+    """
+    if before_id is not None:
+        page = list(services.filter(id__lt=before_id).order_by('-id')[:page_size + 1])
+        has_prev = len(page) > page_size
+        return page[:page_size][::-1], has_prev, True
+
+    if after_id is not None:
+        services = services.filter(id__gt=after_id)
+    page = list(services.order_by('id')[:page_size + 1])
+    return page[:page_size], after_id is not None, len(page) > page_size
+
+
 def get_contractor_services(contractor_id):
     """Получает все услуги указанного исполнителя"""
     from main.models import Service
@@ -294,72 +411,45 @@ def delete_service(service_id):
     return service
 
 
-def add_service_to_set(client_id, service_id):
-    """Добавляет услугу в набор клиента"""
-    from main.models import ServiceSet, Service, Client
-    
-    client = Client.objects.get(person__telegram_id=client_id)
-    service = Service.objects.get(id=service_id)
-    
-    # Получаем или создаем текущий неоплаченный набор услуг
-    service_set, created = ServiceSet.objects.get_or_create(
-        client=client,
-        paid_at=None,
-        defaults={'created_at': datetime.now()}
-    )
-    
-    # Добавляем услугу в набор
-    service_set.services.add(service)
-    
-    return service_set
-
-
-def get_client_service_set(client_id):
-    """Получает текущий набор услуг клиента"""
-    from main.models import ServiceSet
-    
-    try:
-        return ServiceSet.objects.get(
-            client__person__telegram_id=client_id,
-            paid_at=None
+def save_service_set(telegram_id: int, service_ids: list[int]) -> main_models.ServiceSet:
+    """Сохраняет набор услуг из корзины как отправленный на оплату"""
+    with transaction.atomic():
+        service_set = main_models.ServiceSet.objects.create(
+            client=main_models.Client.objects.get(person__telegram_id=telegram_id),
+            paid_at=now()
         )
-    except ServiceSet.DoesNotExist:
-        return None
-
-
-def clear_service_set(client_id):
-    """Очищает текущий набор услуг клиента"""
-    service_set = get_client_service_set(client_id)
-    
-    if service_set:
-        service_set.services.clear()
-        
+        service_set.services.set(service_ids)
     return service_set
 
 
 def get_contractor_salary(telegram_id: int) -> str:
     """Получает информацию о зарплате подрядчика"""
-    from main.models import Order
-    
-    contractor = get_contractor(telegram_id)
-    
-    # Получаем все завершенные заказы подрядчика
-    completed_orders = Order.objects.filter(
-        contractor=contractor,
+    finished_orders = main_models.Order.objects.filter(
+        contractor__person__telegram_id=telegram_id,
         finished_at__isnull=False
     )
-    
-    # Рассчитываем общую сумму
-    total_salary = sum(order.salary for order in completed_orders)
-    
+    totals = finished_orders.aggregate(count=Count('id'), salary=Sum('salary'))
+
     # Формируем сообщение
-    message = f"Общая сумма заработка: {total_salary} руб.\n\n"
-    
-    if completed_orders:
-        message += "Последние выполненные заказы:\n"
-        for order in completed_orders.order_by('-finished_at')[:5]:
-            message += f"- {order.description[:30]}... ({order.salary} руб.)\n"
-    else:
+    message = f"Общая сумма заработка: {totals['salary'] or 0} руб.\n"
+    message += f"Выполнено заказов: {totals['count']}\n\n"
+
+    if not totals['count']:
         message += "У вас пока нет выполненных заказов."
-    
+        return message
+
+    if settings.CONTRACTOR_EARNINGS_ROLLUP:
+        earnings = main_models.ContractorMonthlyEarnings.objects \
+            .filter(contractor__person__telegram_id=telegram_id) \
+            .order_by('-month')[:CONTRACTOR_EARNINGS_MONTHS]
+        if earnings:
+            message += "По месяцам:\n"
+            for month in earnings:
+                message += f"- {month.month:%m.%Y}: {month.salary} руб. ({month.orders_count} зак.)\n"
+            message += "\n"
+
+    message += "Последние выполненные заказы:\n"
+    for order in finished_orders.order_by('-finished_at').only('description', 'salary')[:5]:
+        message += f"- {order.description[:30]}... ({order.salary} руб.)\n"
+
     return message
@@ -0,0 +1,86 @@
+import re
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+import main.management.commands.db_processing as db
+
+from main import models as main_models
+
+# Горячие запросы бота. Значения параметров не важны: план строится без выполнения
+HOT_QUERIES = {
+    'available_orders': lambda: db.get_contractor_available_orders(telegram_id=0),
+    'client_current_orders': lambda: db.get_current_client_orders(telegram_id=0),
+    'contractor_current_orders': lambda: main_models.Contractor(id=0).get_current_orders(),
+    'contractor_finished_orders': lambda: main_models.Order.objects
+        .filter(contractor_id=0, finished_at__isnull=False)
+        .order_by('-finished_at')[:5],
+    'order': lambda: db.get_orders_with_participants().filter(id=0),
+    'client_subscription': lambda: main_models.ClientSubscription.objects.with_status()
+        .filter(client__person__telegram_id=0)
+        .order_by('-id')[:1],
+    'services_by_category': lambda: db.get_services_by_category(category_id=0),
+    'services_page': lambda: db.get_services_by_category(category_id=0)
+        .filter(id__gt=0)
+        .order_by('id')[:11],
+}
+
+# Полный просмотр таблицы в плане: SQLite «SCAN table», PostgreSQL «Seq Scan on table»
+SQLITE_SCAN_PATTERN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?: USING (?:COVERING )?INDEX (\w+))?')
+POSTGRESQL_SCAN_PATTERN = re.compile(r'Seq Scan on (\w+)')
+
+
+def get_partial_indexes() -> set[str]:
+    """Проход по частичному индексу читает только подходящие под условие строки"""
+    return {
+        index.name
+        for model in apps.get_app_config('main').get_models()
+        for index in model._meta.indexes
+        if index.condition is not None
+    }
+
+
+def get_full_scans(plan: str, vendor: str) -> list[str]:
+    if vendor == 'sqlite':
+        partial_indexes = get_partial_indexes()
+        return [
+            table
+            for table, index in SQLITE_SCAN_PATTERN.findall(plan)
+            if index not in partial_indexes
+        ]
+    if vendor == 'postgresql':
+        return POSTGRESQL_SCAN_PATTERN.findall(plan)
+    raise CommandError(f'EXPLAIN для {vendor} не поддерживается')
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN горячих запросов db_processing, ошибка при полном просмотре таблицы"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'queries',
+            nargs='*',
+            help=f'Проверить только эти запросы: {", ".join(HOT_QUERIES)}'
+        )
+        parser.add_argument('--verbose-plan', action='store_true', help='Печатать планы целиком')
+
+    def handle(self, *args, **options):
+        unknown = set(options['queries']) - set(HOT_QUERIES)
+        if unknown:
+            raise CommandError(f'Неизвестные запросы: {", ".join(sorted(unknown))}')
+
+        failed = []
+        for name in options['queries'] or HOT_QUERIES:
+            plan = HOT_QUERIES[name]().explain()
+            full_scans = get_full_scans(plan, connection.vendor)
+            if full_scans:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'{name}: полный просмотр {", ".join(full_scans)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: OK'))
+            if full_scans or options['verbose_plan']:
+                self.stdout.write(plan)
+
+        if failed:
+            raise CommandError(f'Запросы без индекса: {", ".join(failed)}')
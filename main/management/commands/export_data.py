@@ -0,0 +1,67 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import datetime, is_naive, make_aware, now
+
+import main.management.commands.exports as exports
+
+from main import models as main_models
+
+
+def parse_moment(value: str) -> datetime:
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Неверная дата: {value}, ожидается YYYY-MM-DD или YYYY-MM-DDTHH:MM')
+        moment = datetime(day.year, day.month, day.day)
+    return make_aware(moment) if is_naive(moment) else moment
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка заказов, подписок, жалоб и выплат в CSV или JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(exports.DATASETS))
+        parser.add_argument('--format', choices=exports.FORMATS, default='csv')
+        parser.add_argument('--from', dest='date_from', help='Начало периода включительно')
+        parser.add_argument('--to', dest='date_to', help='Конец периода не включительно, по умолчанию сейчас')
+        parser.add_argument(
+            '--since-last',
+            action='store_true',
+            help='Выгрузить только записи после предыдущей выгрузки этого набора'
+        )
+        parser.add_argument('--output', help='Файл для выгрузки, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        dataset = options['dataset']
+        date_to = parse_moment(options['date_to']) if options['date_to'] else now()
+        date_from = parse_moment(options['date_from']) if options['date_from'] else None
+        if options['since_last']:
+            if date_from:
+                raise CommandError('--since-last и --from несовместимы')
+            date_from = exports.get_last_export_date(dataset)
+
+        rows = exports.get_rows(dataset, date_from=date_from, date_to=date_to)
+        output = open(options['output'], 'w', encoding='utf-8', newline='') \
+            if options['output'] else sys.stdout
+        count = 0
+        try:
+            for line in exports.iter_lines(rows, options['format']):
+                output.write(line)
+                count += 1
+        finally:
+            if options['output']:
+                output.close()
+
+        if options['format'] == 'csv':
+            count -= 1
+        main_models.DataExport.objects.create(
+            dataset=dataset,
+            format=options['format'],
+            date_from=date_from,
+            date_to=date_to,
+            rows=count
+        )
+        self.stderr.write(f'Выгружено строк: {count}, период: {date_from or "начало"} — {date_to}')
@@ -0,0 +1,134 @@
+import csv
+import json
+
+from typing import Optional
+
+from django.db.models import F, QuerySet
+from django.utils.timezone import datetime
+
+from main import models as main_models
+
+EXPORT_CHUNK_SIZE = 2000
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def get_orders() -> QuerySet:
+    return main_models.Order.objects.values(
+        'id',
+        'created_at',
+        'take_at',
+        'estimated_time',
+        'finished_at',
+        'declined',
+        'salary',
+        'description',
+        client_name=F('subscription__client__person__name'),
+        client_telegram_id=F('subscription__client__person__telegram_id'),
+        contractor_name=F('contractor__person__name'),
+        contractor_telegram_id=F('contractor__person__telegram_id'),
+    )
+
+
+def get_subscriptions() -> QuerySet:
+    return main_models.ClientSubscription.objects.values(
+        'id',
+        'started_at',
+        'payment_id',
+        client_name=F('client__person__name'),
+        client_telegram_id=F('client__person__telegram_id'),
+        tariff_title=F('tariff__title'),
+        tariff_price=F('tariff__price'),
+    )
+
+
+def get_complaints() -> QuerySet:
+    return main_models.Complaint.objects.values(
+        'id',
+        'order_id',
+        'created_at',
+        'closed_at',
+        'complaint',
+        'answer',
+        client_name=F('order__subscription__client__person__name'),
+        manager_name=F('manager__person__name'),
+    )
+
+
+def get_payouts() -> QuerySet:
+    """Выплаты подрядчикам: выполненные заказы с исполнителем"""
+    return main_models.Order.objects \
+        .filter(finished_at__isnull=False, contractor__isnull=False) \
+        .values(
+            'finished_at',
+            'salary',
+            order_id=F('id'),
+            contractor_name=F('contractor__person__name'),
+            contractor_telegram_id=F('contractor__person__telegram_id'),
+        )
+
+
+# Набор данных: функция выборки и поле даты для диапазона и инкрементальной выгрузки
+DATASETS = {
+    'orders': (get_orders, 'created_at'),
+    'subscriptions': (get_subscriptions, 'started_at'),
+    'complaints': (get_complaints, 'created_at'),
+    'payouts': (get_payouts, 'finished_at'),
+}
+
+
+def get_rows(dataset: str,
+             date_from: datetime = None,
+             date_to: datetime = None,
+             ids: QuerySet = None) -> QuerySet:
+    """Строки набора в полуинтервале [date_from, date_to) по полю даты набора.
+
+    ids ограничивает выгрузку выбранными записями (id заказа для orders и payouts).
+    """
+    get_queryset, date_field = DATASETS[dataset]
+    rows = get_queryset()
+    if date_from:
+        rows = rows.filter(**{f'{date_field}__gte': date_from})
+    if date_to:
+        rows = rows.filter(**{f'{date_field}__lt': date_to})
+    if ids is not None:
+        rows = rows.filter(id__in=ids)
+    return rows.order_by('id')
+
+
+class Echo:
+    """Объект с write(), который возвращает строку вместо записи: csv.writer пишет в генератор"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def serialize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def iter_lines(rows: QuerySet, fmt: str):
+    """Строки файла выгрузки. Записи читаются из БД пачками, поэтому память не растет с размером таблицы"""
+    records = rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    if fmt == 'jsonl':
+        for record in records:
+            yield json.dumps({key: serialize(value) for key, value in record.items()}, ensure_ascii=False) + '\n'
+        return
+
+    writer = csv.writer(Echo())
+    header = [*rows.query.values_select, *rows.query.annotation_select]
+    yield writer.writerow(header)
+    for record in records:
+        yield writer.writerow([serialize(record[key]) for key in header])
+
+
+def get_last_export_date(dataset: str) -> Optional[datetime]:
+    return main_models.DataExport.objects.filter(dataset=dataset) \
+        .order_by('-date_to') \
+        .values_list('date_to', flat=True) \
+        .first()
@@ -1,3 +1,5 @@
+from functools import partial
+
 from django.db.models import QuerySet
 from more_itertools import chunked
 from telegram import (
@@ -8,9 +10,14 @@ from telegram import (
 )
 
 import main.management.commands.buttons as buttons
+import main.management.commands.callbacks as callbacks
+import main.management.commands.search as search
+
+from main.management.commands.catalog import get_catalog
 
 from main import models as main_models
 
+CONTRACTOR_SERVICES_PAGE_SIZE = 10
 
 BACK_TO_CONTRACTOR_MAIN = InlineKeyboardMarkup(
     [[InlineKeyboardButton(**buttons.BACK_TO_CONTRACTOR_MAIN)]]
@@ -19,8 +26,14 @@ BACK_TO_CONTRACTOR_MAIN = InlineKeyboardMarkup(
 START_INLINE = InlineKeyboardMarkup(
     [
         [
-            InlineKeyboardButton(**buttons.I_AM_CLIENT),
-            InlineKeyboardButton(**buttons.I_AM_CONTACTOR)
+            InlineKeyboardButton(
+                text=buttons.I_AM_CLIENT['text'],
+                callback_data=callbacks.encode(buttons.CHECK_ACCESS_CALLBACK, buttons.I_AM_CLIENT['role'])
+            ),
+            InlineKeyboardButton(
+                text=buttons.I_AM_CONTACTOR['text'],
+                callback_data=callbacks.encode(buttons.CHECK_ACCESS_CALLBACK, buttons.I_AM_CONTACTOR['role'])
+            )
         ]
     ]
 )
@@ -37,6 +50,7 @@ BECOME_CONTRACTOR_INLINE = InlineKeyboardMarkup(
 
 CLIENT_INLINE_KEYBOARD = InlineKeyboardMarkup([
     [InlineKeyboardButton(**buttons.SELECT_CATEGORY)],
+    [InlineKeyboardButton(**buttons.SEARCH_SERVICES)],
     [InlineKeyboardButton(**buttons.MY_CART)],
     [InlineKeyboardButton(**buttons.CLIENT_CURRENT_ORDERS)],
     [InlineKeyboardButton(**buttons.CHANGE_ROLE)]
@@ -80,7 +94,7 @@ def client_orders_inline(orders: QuerySet,
     for num, order in enumerate(orders, enumerate_start):
         orders_buttons.append(InlineKeyboardButton(
             text=f'{buttons.ORDER["text"]} {num}',
-            callback_data=f'{buttons.ORDER["callback_data"]}:::{order.id}'
+            callback_data=callbacks.encode(buttons.ORDER['callback_data'], order.id)
         ))
     orders_buttons = list(chunked(orders_buttons, 3))
     orders_buttons.append([InlineKeyboardButton(**buttons.BACK_TO_CLIENT_MAIN)])
@@ -92,21 +106,21 @@ def client_order_inline(order: main_models.Order,
     order_buttons = [
         [InlineKeyboardButton(
             text=buttons.ORDER_COMMENT['text'],
-            callback_data=f'{buttons.ORDER_COMMENT["callback_data"]}:::{order.id}'
+            callback_data=callbacks.encode(buttons.ORDER_COMMENT['callback_data'], order.id)
         )]
     ]
     if can_see_contractor_contact:
         order_buttons.append([
             InlineKeyboardButton(
                 text=buttons.CONTRACTOR_CONTACTS['text'],
-                callback_data=f'{buttons.CONTRACTOR_CONTACTS["callback_data"]}:::{order.id}'
+                callback_data=callbacks.encode(buttons.CONTRACTOR_CONTACTS['callback_data'], order.id)
             )
         ])
     order_buttons += [
         [
             InlineKeyboardButton(
                 text=buttons.ORDER_COMPLAINT['text'],
-                callback_data=f'{buttons.ORDER_COMPLAINT["callback_data"]}:::{order.id}'
+                callback_data=callbacks.encode(buttons.ORDER_COMPLAINT['callback_data'], order.id)
             )
         ],
         [InlineKeyboardButton(**buttons.BACK_TO_CLIENT_MAIN)]
@@ -123,13 +137,13 @@ def contractor_orders_inline(orders: QuerySet,
         for num, order in enumerate(orders, enumerate_start):
             orders_buttons.append(InlineKeyboardButton(
                 text=f'{buttons.CURRENT_ORDER["text"]} {num}',
-                callback_data=f'{buttons.CURRENT_ORDER["callback_data"]}:::{order.id}'
+                callback_data=callbacks.encode(buttons.CURRENT_ORDER['callback_data'], order.id)
             ))
     elif are_available_orders:
         for num, order in enumerate(orders, enumerate_start):
             orders_buttons.append(InlineKeyboardButton(
                 text=f'{buttons.AVAILABLE_ORDER["text"]} {num}',
-                callback_data=f'{buttons.AVAILABLE_ORDER["callback_data"]}:::{order.id}'
+                callback_data=callbacks.encode(buttons.AVAILABLE_ORDER['callback_data'], order.id)
             ))
     orders_buttons = list(chunked(orders_buttons, 3))
     orders_buttons.append([InlineKeyboardButton(**buttons.BACK_TO_CONTRACTOR_MAIN)])
@@ -143,18 +157,18 @@ def contractor_order_inline(order: main_models.Order,
         order_buttons = [
             [InlineKeyboardButton(
                 text=buttons.FINISH_ORDER['text'],
-                callback_data=f'{buttons.FINISH_ORDER["callback_data"]}:::{order.id}'
+                callback_data=callbacks.encode(buttons.FINISH_ORDER['callback_data'], order.id)
             )],
             [InlineKeyboardButton(
                 text=buttons.CONTRACTOR_SET_ESTIMATE_DATETIME['text'],
-                callback_data=f'{buttons.CONTRACTOR_SET_ESTIMATE_DATETIME["callback_data"]}:::{order.id}'
+                callback_data=callbacks.encode(buttons.CONTRACTOR_SET_ESTIMATE_DATETIME['callback_data'], order.id)
             )]
         ]
     elif is_available:
         order_buttons = [
             [InlineKeyboardButton(
                 text=buttons.TAKE_ORDER['text'],
-                callback_data=f'{buttons.TAKE_ORDER["callback_data"]}:::{order.id}'
+                callback_data=callbacks.encode(buttons.TAKE_ORDER['callback_data'], order.id)
             )]
         ]
     order_buttons.append([InlineKeyboardButton(**buttons.BACK_TO_CONTRACTOR_MAIN)])
@@ -166,7 +180,7 @@ def subscriptions_inline(tariffs: QuerySet) -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(
                 text=f'Оформить подписку "{tariff.title}"',
-                callback_data=f'activate_subscription:{tariff.id}'
+                callback_data=callbacks.encode(buttons.ACTIVATE_SUBSCRIPTION_CALLBACK, tariff.id)
             )
         ]
         for tariff in tariffs
@@ -176,10 +190,15 @@ def subscriptions_inline(tariffs: QuerySet) -> InlineKeyboardMarkup:
 
 
 def get_categories_keyboard():
-    """Клавиатура с категориями услуг"""
-    from main.management.commands.db_processing import get_service_categories
-    
-    categories = get_service_categories()
+    """Клавиатура с категориями услуг (из кэша каталога)"""
+    catalog = get_catalog()
+    return catalog.get_keyboard(
+        'categories',
+        lambda: build_categories_keyboard(catalog.get_categories())
+    )
+
+
+def build_categories_keyboard(categories: list[dict]) -> InlineKeyboardMarkup:
     keyboard = []
     
     # Добавляем кнопки категорий по 2 в ряд
@@ -187,8 +206,8 @@ def get_categories_keyboard():
         row = []
         for category in chunk:
             row.append(InlineKeyboardButton(
-                category.name,
-                callback_data=buttons.CATEGORY_CALLBACK.format(category.id)
+                category['name'],
+                callback_data=callbacks.encode(buttons.CATEGORY_CALLBACK, category['id'])
             ))
         keyboard.append(row)
     
@@ -198,21 +217,55 @@ def get_categories_keyboard():
     return InlineKeyboardMarkup(keyboard)
 
 
-def get_services_keyboard(category_id):
-    """Клавиатура с услугами в категории"""
-    from main.management.commands.db_processing import get_services_by_category
-    
-    services = get_services_by_category(category_id)
+def get_services_keyboard(category_id, after_id=None, before_id=None):
+    """Страница клавиатуры с услугами в категории (из кэша каталога)"""
+    catalog = get_catalog()
+
+    def build() -> InlineKeyboardMarkup:
+        page = catalog.get_services_page(category_id, after_id=after_id, before_id=before_id)
+        return build_services_keyboard(
+            page['services'],
+            pagination_row(
+                page,
+                lambda direction, service_id: callbacks.encode(
+                    buttons.SERVICES_PAGE_CALLBACK, category_id, direction, service_id
+                )
+            )
+        )
+
+    return catalog.get_keyboard(f'services:{category_id}:{after_id}:{before_id}', build)
+
+
+def pagination_row(page: dict, callback) -> list[InlineKeyboardButton]:
+    """Кнопки перехода между страницами; callback(direction, service_id) дает callback_data"""
+    row = []
+    if page['services'] and page['has_prev']:
+        row.append(InlineKeyboardButton(
+            buttons.PREV_PAGE_TEXT,
+            callback_data=callback('prev', page['services'][0]['id'])
+        ))
+    if page['services'] and page['has_next']:
+        row.append(InlineKeyboardButton(
+            buttons.NEXT_PAGE_TEXT,
+            callback_data=callback('next', page['services'][-1]['id'])
+        ))
+    return row
+
+
+def build_services_keyboard(services: list[dict],
+                            pagination: list[InlineKeyboardButton]) -> InlineKeyboardMarkup:
     keyboard = []
     
     # Добавляем кнопки услуг по 1 в ряд
     for service in services:
         keyboard.append([
             InlineKeyboardButton(
-                f"{service.title} - {service.price} руб.",
-                callback_data=buttons.SERVICE_CALLBACK.format(service.id)
+                f"{service['title']} - {service['price']} руб.",
+                callback_data=callbacks.encode(buttons.SERVICE_CALLBACK, service['id'])
             )
         ])
+    if pagination:
+        keyboard.append(pagination)
     
     # Добавляем кнопки навигации
     keyboard.append([
@@ -223,12 +276,31 @@ def get_services_keyboard(category_id):
     return InlineKeyboardMarkup(keyboard)
 
 
+def get_search_results_keyboard(services: list, offset: int, has_next: bool) -> InlineKeyboardMarkup:
+    """Найденные услуги с переходом между страницами выдачи"""
+    pagination = []
+    if offset:
+        pagination.append(InlineKeyboardButton(
+            buttons.PREV_PAGE_TEXT,
+            callback_data=callbacks.encode(buttons.SEARCH_PAGE_CALLBACK, max(offset - search.SEARCH_PAGE_SIZE, 0))
+        ))
+    if has_next:
+        pagination.append(InlineKeyboardButton(
+            buttons.NEXT_PAGE_TEXT,
+            callback_data=callbacks.encode(buttons.SEARCH_PAGE_CALLBACK, offset + search.SEARCH_PAGE_SIZE)
+        ))
+    return build_services_keyboard(
+        [{'id': service.id, 'title': service.title, 'price': service.price} for service in services],
+        pagination
+    )
+
+
 def get_service_details_keyboard(service_id):
     """Клавиатура для детальной информации об услуге"""
     keyboard = [
         [InlineKeyboardButton(
             "Добавить в корзину",
-            callback_data=buttons.ADD_TO_CART_CALLBACK.format(service_id)
+            callback_data=callbacks.encode(buttons.ADD_TO_CART_CALLBACK, service_id)
         )],
         [
             InlineKeyboardButton(**buttons.BACK_TO_CLIENT_MAIN),
@@ -239,20 +311,17 @@ def get_service_details_keyboard(service_id):
     return InlineKeyboardMarkup(keyboard)
 
 
-def get_cart_keyboard(client_id):
-    """Клавиатура для корзины услуг"""
-    from main.management.commands.db_processing import get_client_service_set
-    
-    service_set = get_client_service_set(client_id)
+def get_cart_keyboard(summary) -> InlineKeyboardMarkup:
+    """Клавиатура для корзины услуг по cart.CartSummary"""
     keyboard = []
     
-    if service_set and service_set.services.exists():
+    if summary:
         # Добавляем кнопки для удаления услуг из корзины
-        for service in service_set.services.all():
+        for item in summary.items:
             keyboard.append([
                 InlineKeyboardButton(
-                    f"❌ {service.title} - {service.price} руб.",
-                    callback_data=buttons.REMOVE_FROM_CART_CALLBACK.format(service.id)
+                    f"❌ {item['title']} - {item['price']} руб.",
+                    callback_data=callbacks.encode(buttons.REMOVE_FROM_CART_CALLBACK, item['id'])
                 )
             ])
         
@@ -268,11 +337,16 @@ def get_cart_keyboard(client_id):
     return InlineKeyboardMarkup(keyboard)
 
 
-def get_contractor_services_keyboard(contractor_id):
-    """Клавиатура с услугами исполнителя"""
-    from main.management.commands.db_processing import get_contractor_services
+def get_contractor_services_keyboard(contractor_id, after_id=None, before_id=None):
+    """Страница клавиатуры с услугами исполнителя"""
+    from main.management.commands.db_processing import get_contractor_services, get_services_page
     
-    services = get_contractor_services(contractor_id)
+    services, has_prev, has_next = get_services_page(
+        get_contractor_services(contractor_id).only('id', 'title', 'price'),
+        page_size=CONTRACTOR_SERVICES_PAGE_SIZE,
+        after_id=after_id,
+        before_id=before_id
+    )
     keyboard = []
     
     # Добавляем кнопки услуг
@@ -280,9 +354,19 @@ def get_contractor_services_keyboard(contractor_id):
         keyboard.append([
             InlineKeyboardButton(
                 f"{service.title} - {service.price} руб.",
-                callback_data=buttons.EDIT_SERVICE_CALLBACK.format(service.id)
+                callback_data=callbacks.encode(buttons.EDIT_SERVICE_CALLBACK, service.id)
             )
         ])
+    pagination = pagination_row(
+        {
+            'services': [{'id': service.id} for service in services],
+            'has_prev': has_prev,
+            'has_next': has_next
+        },
+        partial(callbacks.encode, buttons.CONTRACTOR_SERVICES_PAGE_CALLBACK)
+    )
+    if pagination:
+        keyboard.append(pagination)
     
     # Добавляем кнопки действий
     keyboard.append([
@@ -298,27 +382,27 @@ def get_service_edit_keyboard(service_id):
     keyboard = [
         [InlineKeyboardButton(
             "✏️ Изменить название",
-            callback_data=f"edit_service_title:{service_id}"
+            callback_data=callbacks.encode(buttons.EDIT_SERVICE_TITLE_CALLBACK, service_id)
         )],
         [InlineKeyboardButton(
             "✏️ Изменить описание",
-            callback_data=f"edit_service_description:{service_id}"
+            callback_data=callbacks.encode(buttons.EDIT_SERVICE_DESCRIPTION_CALLBACK, service_id)
         )],
         [InlineKeyboardButton(
             "✏️ Изменить цену",
-            callback_data=f"edit_service_price:{service_id}"
+            callback_data=callbacks.encode(buttons.EDIT_SERVICE_PRICE_CALLBACK, service_id)
         )],
         [InlineKeyboardButton(
             "✏️ Изменить категорию",
-            callback_data=f"edit_service_category:{service_id}"
+            callback_data=callbacks.encode(buttons.EDIT_SERVICE_CATEGORY_CALLBACK, service_id)
         )],
         [InlineKeyboardButton(
             "✏️ Изменить фото",
-            callback_data=f"edit_service_photo:{service_id}"
+            callback_data=callbacks.encode(buttons.EDIT_SERVICE_PHOTO_CALLBACK, service_id)
         )],
         [InlineKeyboardButton(
             "🗑️ Удалить услугу",
-            callback_data=buttons.DELETE_SERVICE_CALLBACK.format(service_id)
+            callback_data=callbacks.encode(buttons.DELETE_SERVICE_CALLBACK, service_id)
         )],
         [InlineKeyboardButton(
             "⬅️ Назад к моим услугам",
@@ -6,8 +6,13 @@ import main.management.commands.buttons as buttons
 
 from main import models as main_models
 
+# Ограничение Telegram на длину одного сообщения
+MAX_MESSAGE_LENGTH = 4096
+
 APPROVE_ORDER_CONTRACTOR = 'Заказ ваш!'
 
+ORDER_ALREADY_TAKEN = 'Этот заказ уже взял другой подрядчик.'
+
 CHECK_ROLE = 'Укажите кто вы.'
 
 CLIENT_MAIN = """
@@ -24,6 +29,8 @@ CONTRACTOR_MAIN = """
 
 CONTRACTOR_NOT_FOUND = 'Исполнитель на ваш заказ еще не назначен. 🙏'
 
+DIALOG_EXPIRED = 'Диалог устарел, начните, пожалуйста, заново'
+
 DESCRIBE_REQUEST = dedent(
     """
     Опишите тезисно вашу проблему.
@@ -143,6 +150,20 @@ SERVICE_DETAILS_TEMPLATE = """
 <b>Исполнитель:</b> {contractor_name}
 """
 
+SEARCH_PROMPT_MESSAGE = """
+Напишите, какую услугу вы ищете, например: логотип или перевод текста.
+
+Искать можно и в любом чате: наберите @имя_бота и запрос.
+"""
+
+SEARCH_NOTHING_FOUND_MESSAGE = """
+По запросу «{query}» ничего не нашлось. Попробуйте другие слова.
+"""
+
+SEARCH_RESULTS_MESSAGE = """
+Результаты поиска по запросу «{query}»:
+"""
+
 CART_EMPTY_MESSAGE = """
 Ваша корзина пуста.
 
@@ -351,6 +372,28 @@ def contractor_set_estimate_datetime_notifiction(order: main_models.Order) -> st
     )
 
 
+def manager_digest(notifications: list[str]) -> str:
+    return dedent(
+        f"""
+        Сводка уведомлений: {len(notifications)}
+        """
+    ) + '\n'.join(notifications)
+
+
+def split_message(parts: list[str], limit: int = MAX_MESSAGE_LENGTH) -> list[list[str]]:
+    """Группирует части текста так, чтобы каждая группа помещалась в одно сообщение"""
+    chunks = [[]]
+    length = 0
+    for part in parts:
+        part = part[:limit]
+        if chunks[-1] and length + len(part) + 1 > limit:
+            chunks.append([])
+            length = 0
+        chunks[-1].append(part)
+        length += len(part) + 1
+    return [chunk for chunk in chunks if chunk]
+
+
 def display_orders(orders: QuerySet,
                    are_current: bool = False,
                    are_available: bool = False,
@@ -0,0 +1,184 @@
+import logging
+
+from collections import deque
+from functools import partial
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Optional
+
+from django.conf import settings
+
+import main.management.commands.db_processing as db
+import main.management.commands.messages as messages
+import main.management.commands.outbox as outbox
+
+logger = logging.getLogger(__name__)
+
+# Как часто обновлять список активных менеджеров, секунд
+MANAGERS_CACHE_TTL = 60
+# Запас под заголовок дайджеста
+DIGEST_HEADER_RESERVE = 100
+
+
+class ManagerDelivery:
+    """Окно частоты и статистика доставки для одного менеджера"""
+
+    def __init__(self):
+        self.window_started_at = monotonic()
+        self.sent_in_window = 0
+        self.pending = []
+        self.delivered = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=200)
+
+    def roll_window(self, window: float) -> bool:
+        if monotonic() - self.window_started_at < window:
+            return False
+        self.window_started_at = monotonic()
+        self.sent_in_window = 0
+        return True
+
+
+class ManagerNotifier:
+    """Фоновая рассылка уведомлений менеджерам.
+
+    Пока менеджер получает не больше rate уведомлений за window секунд,
+    они уходят по одному. Остальные копятся и в начале следующего окна
+    отправляются одним сообщением-дайджестом.
+    """
+
+    def __init__(self, bot, rate: int, window: float):
+        self.bot = bot
+        self.rate = rate
+        self.window = window
+        self._events = Queue()
+        self._lock = Lock()
+        self._deliveries = {}
+        self._managers = ()
+        self._managers_loaded_at = None
+        Thread(target=self._run, name='manager-notifier', daemon=True).start()
+
+    def notify(self, message: str) -> None:
+        self._events.put((monotonic(), message))
+
+    def _get_managers(self) -> tuple[int]:
+        if self._managers_loaded_at is None \
+                or monotonic() - self._managers_loaded_at > MANAGERS_CACHE_TTL:
+            self._managers = db.get_managers_telegram_ids()
+            self._managers_loaded_at = monotonic()
+        return self._managers
+
+    def _run(self) -> None:
+        while True:
+            try:
+                event = self._events.get(timeout=1)
+            except Empty:
+                event = None
+            try:
+                if event:
+                    self._dispatch(*event)
+                self._flush_digests()
+            except Exception:
+                logger.exception('Error while notifying managers')
+
+    def _start_window(self, delivery: ManagerDelivery) -> Optional[list]:
+        """Начинает новое окно, если прошлое истекло, и забирает накопленное для дайджеста.
+
+        Окно сдвигается только здесь, поэтому новое событие не может обогнать
+        дайджест, который ждал начала этого окна.
+        """
+        if not delivery.roll_window(self.window):
+            return None
+        pending, delivery.pending = delivery.pending, []
+        if pending:
+            delivery.sent_in_window += 1
+        return pending
+
+    def _dispatch(self, enqueued_at: float, message: str) -> None:
+        for manager_id in self._get_managers():
+            with self._lock:
+                delivery = self._deliveries.setdefault(manager_id, ManagerDelivery())
+                digest = self._start_window(delivery)
+                if digest:
+                    # Событие уходит вместе с дайджестом, а не раньше него
+                    digest.append((enqueued_at, message))
+                elif delivery.sent_in_window >= self.rate:
+                    delivery.pending.append((enqueued_at, message))
+                    continue
+                else:
+                    delivery.sent_in_window += 1
+            if digest:
+                self._send_digest(manager_id, digest)
+            else:
+                self._send(manager_id, message, [enqueued_at])
+
+    def _flush_digests(self) -> None:
+        with self._lock:
+            ready = []
+            for manager_id, delivery in self._deliveries.items():
+                if not delivery.pending:
+                    continue
+                digest = self._start_window(delivery)
+                if digest:
+                    ready.append((manager_id, digest))
+
+        for manager_id, digest in ready:
+            self._send_digest(manager_id, digest)
+
+    def _send_digest(self, manager_id: int, pending: list[tuple[float, str]]) -> None:
+        texts = [message for _, message in pending]
+        enqueued = iter(enqueued_at for enqueued_at, _ in pending)
+        limit = messages.MAX_MESSAGE_LENGTH - DIGEST_HEADER_RESERVE
+        for chunk in messages.split_message(texts, limit=limit):
+            self._send(
+                manager_id,
+                messages.manager_digest(chunk),
+                [next(enqueued) for _ in chunk]
+            )
+
+    def _send(self, manager_id: int, text: str, enqueued: list[float]) -> None:
+        future = self.bot.send_message(manager_id, text, priority=outbox.NOTIFICATION)
+        future.add_done_callback(partial(self._record, manager_id, enqueued))
+
+    def _record(self, manager_id: int, enqueued: list[float], future) -> None:
+        with self._lock:
+            delivery = self._deliveries[manager_id]
+            if future.exception():
+                logger.error(f'Failed to notify manager {manager_id}: {future.exception()}')
+                delivery.failed += len(enqueued)
+                return
+            delivery.delivered += len(enqueued)
+            delivery.latencies.extend(monotonic() - enqueued_at for enqueued_at in enqueued)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                manager_id: {
+                    'delivered': delivery.delivered,
+                    'failed': delivery.failed,
+                    'pending': len(delivery.pending),
+                    'avg_latency_ms': round(
+                        sum(delivery.latencies) / len(delivery.latencies) * 1000, 1
+                    ) if delivery.latencies else 0,
+                    'max_latency_ms': round(max(delivery.latencies) * 1000, 1) if delivery.latencies else 0,
+                }
+                for manager_id, delivery in self._deliveries.items()
+            }
+
+
+notifier = None
+notifier_lock = Lock()
+
+
+def get_manager_notifier() -> ManagerNotifier:
+    """Общий на процесс рассыльщик уведомлений менеджерам"""
+    global notifier
+    with notifier_lock:
+        if notifier is None:
+            notifier = ManagerNotifier(
+                bot=outbox.get_bot(),
+                rate=settings.MANAGER_NOTIFY_RATE,
+                window=settings.MANAGER_NOTIFY_WINDOW
+            )
+    return notifier
@@ -0,0 +1,262 @@
+import logging
+
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition, Lock, Thread
+from time import monotonic, sleep
+
+from django.conf import settings
+from telegram import Bot
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: чем меньше значение, тем раньше отправка
+INTERACTIVE = 0
+NOTIFICATION = 10
+REPORT = 20
+
+# Лимиты Telegram: 30 сообщений в секунду на бота и около 1 в секунду на чат
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+
+MAX_RETRIES = 5
+SEND_TIMEOUT = 60
+SEND_WORKERS = 4
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = monotonic()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class OutboundQueue:
+    """Очередь исходящих запросов к Telegram.
+
+    Соблюдает общий лимит бота и лимит на чат, сохраняет порядок сообщений
+    внутри чата, пропускает вперед чаты с более высоким приоритетом
+    и повторяет запрос после ответа 429 (RetryAfter).
+    """
+
+    def __init__(self,
+                 global_rate: float = GLOBAL_RATE,
+                 chat_rate: float = CHAT_RATE,
+                 chat_burst: float = CHAT_BURST,
+                 workers: int = SEND_WORKERS):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._paused_until = {}
+        self._chats = {}
+        self._ready = []
+        self._timers = []
+        self._seq = count()
+        self._condition = Condition()
+        self._senders = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox-sender')
+        self._counters = Counter()
+        self._latencies = deque(maxlen=1000)
+        Thread(target=self._run, name='outbox', daemon=True).start()
+
+    def submit(self, func, chat_id: int, priority: int = INTERACTIVE) -> Future:
+        future = Future()
+        item = (priority, next(self._seq), func, future, monotonic(), 0)
+        with self._condition:
+            if chat_id in self._chats:
+                self._chats[chat_id].append(item)
+            else:
+                self._chats[chat_id] = deque([item])
+                self._schedule(chat_id)
+        return future
+
+    def _chat_wait(self, chat_id: int) -> float:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        paused = self._paused_until.get(chat_id, 0) - monotonic()
+        return max(paused, bucket.wait_time(), 0)
+
+    def _schedule(self, chat_id: int) -> None:
+        wait = self._chat_wait(chat_id)
+        if wait:
+            heappush(self._timers, (monotonic() + wait, chat_id))
+        else:
+            priority, seq = self._chats[chat_id][0][:2]
+            heappush(self._ready, (priority, seq, chat_id))
+        self._condition.notify()
+
+    def _next_ready_chat(self) -> int:
+        while True:
+            now = monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, chat_id = heappop(self._timers)
+                priority, seq = self._chats[chat_id][0][:2]
+                heappush(self._ready, (priority, seq, chat_id))
+            if self._ready:
+                return heappop(self._ready)[2]
+            self._condition.wait(self._timers[0][0] - now if self._timers else None)
+
+    def _run(self) -> None:
+        while True:
+            self._step()
+
+    def _step(self) -> None:
+        """Ждет чат, которому можно отправить, и передает его первый запрос отправителям"""
+        with self._condition:
+            chat_id = self._next_ready_chat()
+            wait = self._chat_wait(chat_id)
+            if wait:
+                heappush(self._timers, (monotonic() + wait, chat_id))
+                return
+
+        # Общий лимит учитывает только этот поток
+        global_wait = self._global_bucket.wait_time()
+        if global_wait:
+            sleep(global_wait)
+        self._global_bucket.consume()
+
+        with self._condition:
+            self._chat_buckets[chat_id].consume()
+            item = self._chats[chat_id].popleft()
+        self._senders.submit(self._send, chat_id, item)
+
+    def _send(self, chat_id: int, item: tuple) -> None:
+        priority, seq, func, future, enqueued_at, attempts = item
+        try:
+            result = func()
+        except RetryAfter as error:
+            if attempts < MAX_RETRIES:
+                logger.warning(f'Telegram flood limit for chat {chat_id}, retry after {error.retry_after} s')
+                with self._condition:
+                    self._counters['retried'] += 1
+                    self._paused_until[chat_id] = monotonic() + error.retry_after
+                    self._chats[chat_id].appendleft(
+                        (priority, seq, func, future, enqueued_at, attempts + 1)
+                    )
+                    self._schedule(chat_id)
+                return
+            future.set_exception(error)
+        except Exception as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+        with self._condition:
+            if future.exception():
+                self._counters['failed'] += 1
+            else:
+                self._counters['sent'] += 1
+                self._latencies.append(monotonic() - enqueued_at)
+            if self._chats[chat_id]:
+                self._schedule(chat_id)
+                return
+            del self._chats[chat_id]
+            self._paused_until.pop(chat_id, None)
+            if len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+                self._prune_buckets()
+
+    def _prune_buckets(self) -> None:
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if chat_id not in self._chats and bucket.is_full():
+                del self._chat_buckets[chat_id]
+
+    def stats(self) -> dict:
+        with self._condition:
+            latencies = sorted(self._latencies)
+            return {
+                'queued': sum(len(chat_queue) for chat_queue in self._chats.values()),
+                'chats': len(self._chats),
+                'sent': self._counters['sent'],
+                'retried': self._counters['retried'],
+                'failed': self._counters['failed'],
+                'avg_latency_ms': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0,
+                'p95_latency_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else 0,
+            }
+
+
+class QueuedBot(Bot):
+    """Бот, отправляющий сообщения через OutboundQueue.
+
+    Отправки с приоритетом INTERACTIVE ждут результата, как обычный Bot.
+    Для остальных приоритетов возвращается Future, и обработчик не блокируется.
+    """
+
+    def __init__(self, *args, outbox: OutboundQueue, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbox = outbox
+
+    def _enqueue(self, method, chat_id: int, args: tuple, kwargs: dict):
+        priority = kwargs.pop('priority', INTERACTIVE)
+        future = self.outbox.submit(
+            partial(method, chat_id, *args, **kwargs),
+            chat_id=chat_id,
+            priority=priority
+        )
+        if priority == INTERACTIVE:
+            return future.result(timeout=SEND_TIMEOUT)
+        return future
+
+    def send_message(self, chat_id, *args, **kwargs):
+        return self._enqueue(super().send_message, chat_id, args, kwargs)
+
+    def send_photo(self, chat_id, *args, **kwargs):
+        return self._enqueue(super().send_photo, chat_id, args, kwargs)
+
+    def send_document(self, chat_id, *args, **kwargs):
+        return self._enqueue(super().send_document, chat_id, args, kwargs)
+
+    def send_contact(self, chat_id, *args, **kwargs):
+        return self._enqueue(super().send_contact, chat_id, args, kwargs)
+
+
+outbox = None
+bot = None
+outbox_lock = Lock()
+
+
+def get_outbox() -> OutboundQueue:
+    """Общая на процесс очередь исходящих сообщений"""
+    global outbox
+    with outbox_lock:
+        if outbox is None:
+            outbox = OutboundQueue()
+    return outbox
+
+
+def get_bot() -> QueuedBot:
+    """Общий на процесс бот для отправки вне обработчиков (админка, вебхуки)"""
+    global bot
+    outbound_queue = get_outbox()
+    with outbox_lock:
+        if bot is None:
+            bot = QueuedBot(token=settings.TELEGRAM_BOT_TOKEN, outbox=outbound_queue)
+    return bot
@@ -0,0 +1,32 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+import main.management.commands.yookassa_webhook as yookassa_webhook
+
+
+class Command(BaseCommand):
+    help = "Обработка сохраненных уведомлений YooKassa отдельным процессом"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help='Пауза между проверками очереди, секунд'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать накопленные уведомления и выйти'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = yookassa_webhook.process_pending_events()
+            if count:
+                self.stdout.write(f'Обработано уведомлений: {count}')
+            if options['once']:
+                return
+            if not count:
+                sleep(options['interval'])
@@ -0,0 +1,170 @@
+import json
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock
+from time import perf_counter
+
+from django.conf import settings
+from more_itertools import chunked
+from redis import Redis, RedisError
+from yookassa import Payment
+
+import main.management.commands.redis_pool as redis_pool
+import main.management.commands.yookassa_webhook as yookassa_webhook
+
+logger = logging.getLogger(__name__)
+
+# Отметка о проверке платежа, пока она жива, платеж повторно не проверяется
+CHECK_KEY = 'reconcile_payment_{}'
+# Сколько ключей просить у Redis за один шаг SCAN
+SCAN_BATCH_SIZE = 500
+# Сколько платежей проверять в API за один проход
+MAX_CHECKS_PER_RUN = 200
+# Свежие платежи подтверждает вебхук, сверка берет их только после этой паузы
+FIRST_CHECK_DELAY = timedelta(minutes=1)
+# Пауза между проверками платежа в ожидании растет с его возрастом в этих пределах
+MIN_CHECK_INTERVAL = timedelta(seconds=30)
+MAX_CHECK_INTERVAL = timedelta(minutes=30)
+
+stats = {
+    'runs': 0,
+    'checked': 0,
+    'activated': 0,
+    'canceled': 0,
+    'errors': 0,
+    'last_run_ms': 0,
+    'checks_per_second': 0,
+    'lag_seconds': 0,
+    'activation_lag_seconds': 0,
+}
+stats_lock = Lock()
+
+
+def get_check_interval(age: timedelta) -> timedelta:
+    """Чем дольше платеж в ожидании, тем реже его проверяем"""
+    return min(max(age / 2, MIN_CHECK_INTERVAL), MAX_CHECK_INTERVAL)
+
+
+def get_age(payment_data: dict, moment: datetime) -> timedelta:
+    # Бот пишет created_at в локальном времени без зоны, как datetime.now()
+    try:
+        return moment - datetime.fromisoformat(payment_data['created_at'])
+    except (KeyError, TypeError, ValueError):
+        return FIRST_CHECK_DELAY
+
+
+def scan_payments(redis: Redis):
+    """Пары (payment_id, возраст) неподтвержденных платежей из Redis.
+
+    Ключи обходятся SCAN, а значения читаются одним MGET на пачку,
+    поэтому Redis не блокируется и не получает запрос на каждый ключ.
+    """
+    prefix = yookassa_webhook.PAYMENT_KEY.format('')
+    moment = datetime.now()
+    keys = redis.scan_iter(match=f'{prefix}*', count=SCAN_BATCH_SIZE)
+    for batch in chunked(keys, SCAN_BATCH_SIZE):
+        for key, value in zip(batch, redis.mget(batch)):
+            if value is None:
+                continue
+            try:
+                payment_data = json.loads(value)
+            except ValueError:
+                logger.warning(f'Broken payment data in Redis: {key}')
+                continue
+            yield key[len(prefix):], get_age(payment_data, moment)
+
+
+def claim_checks(redis: Redis, payments: list[tuple[str, timedelta]]) -> list[tuple[str, timedelta]]:
+    """Ставит отметки о проверке и возвращает платежи, которые пора проверить.
+
+    SET NX делает отметку заодно блокировкой: несколько копий бота не проверят платеж одновременно.
+    """
+    with redis.pipeline(transaction=False) as pipe:
+        for payment_id, age in payments:
+            pipe.set(
+                CHECK_KEY.format(payment_id),
+                1,
+                nx=True,
+                ex=int(get_check_interval(age).total_seconds())
+            )
+        claimed = pipe.execute()
+    return [payment for payment, is_claimed in zip(payments, claimed) if is_claimed]
+
+
+def find_payment(payment_id: str):
+    try:
+        return Payment.find_one(payment_id)
+    except Exception as error:
+        logger.warning(f'Payment {payment_id} check failed: {error}')
+        return None
+
+
+def reconcile_payments(bot=None, redis: Redis = None, limit: int = MAX_CHECKS_PER_RUN) -> dict:
+    """Один проход сверки: проверяет в API платежи, по которым не пришел вебхук.
+
+    Оплаченные платежи активируют подписку тем же путем, что и вебхук,
+    поэтому одновременная доставка уведомления не создаст вторую подписку.
+    """
+    redis = redis or redis_pool.get_redis()
+    started_at = perf_counter()
+    result = {'checked': 0, 'activated': 0, 'canceled': 0, 'pending': 0, 'errors': 0}
+    lag = timedelta(0)
+    activation_lag = timedelta(0)
+
+    due = []
+    try:
+        for payment_id, age in scan_payments(redis):
+            lag = max(lag, age)
+            if age >= FIRST_CHECK_DELAY and len(due) < limit:
+                due.append((payment_id, age))
+        due = claim_checks(redis, due) if due else []
+    except RedisError as error:
+        logger.warning(f'Payment reconciliation skipped, Redis failed: {error}')
+        return result
+
+    if due:
+        yookassa_webhook.configure_yookassa()
+        with ThreadPoolExecutor(max_workers=settings.PAYMENT_RECONCILE_CONCURRENCY) as executor:
+            payments = list(executor.map(find_payment, [payment_id for payment_id, _ in due]))
+    else:
+        payments = []
+
+    for (payment_id, age), payment in zip(due, payments):
+        if payment is None:
+            result['errors'] += 1
+            continue
+        result['checked'] += 1
+        if payment.status == 'succeeded':
+            activated = yookassa_webhook.activate_payment(redis, payment_id, payment.metadata)
+            if activated is None:
+                result['errors'] += 1
+                continue
+            subscription, created = activated
+            if created:
+                logger.info(f'Payment {payment_id} confirmed by reconciliation, webhook was lost')
+                yookassa_webhook.notify_activated(bot, subscription)
+                result['activated'] += 1
+                activation_lag = max(activation_lag, age)
+        elif payment.status == 'canceled':
+            yookassa_webhook.forget_payment(redis, payment_id)
+            result['canceled'] += 1
+        else:
+            result['pending'] += 1
+
+    elapsed = perf_counter() - started_at
+    with stats_lock:
+        stats['runs'] += 1
+        for key in ('checked', 'activated', 'canceled', 'errors'):
+            stats[key] += result[key]
+        stats['last_run_ms'] = round(elapsed * 1000, 2)
+        stats['checks_per_second'] = round(len(due) / elapsed, 2) if due else 0
+        stats['lag_seconds'] = int(lag.total_seconds())
+        stats['activation_lag_seconds'] = int(activation_lag.total_seconds())
+    return result
+
+
+def get_stats() -> dict:
+    with stats_lock:
+        return dict(stats)
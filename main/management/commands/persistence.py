@@ -0,0 +1,155 @@
+import json
+import logging
+
+from collections import defaultdict
+from threading import Lock, Thread
+from time import sleep
+
+from redis import Redis
+from telegram.ext import BasePersistence
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'persistence'
+
+# Сколько хранить данные без обращений пользователя, секунд
+CONVERSATION_TTL = 60 * 60 * 24 * 7
+USER_DATA_TTL = 60 * 60 * 24 * 30
+CHAT_DATA_TTL = 60 * 60 * 24 * 30
+
+# Как часто сбрасывать накопленные изменения в Redis, секунд
+FLUSH_INTERVAL = 0.2
+
+
+class RedisConversations(dict):
+    """Состояния ConversationHandler с чтением из Redis.
+
+    ConversationHandler получает состояние через get() перед каждым обновлением,
+    поэтому другая реплика бота сразу видит переходы, сделанные этой.
+    """
+
+    def __init__(self, persistence: 'RedisPersistence', name: str):
+        super().__init__()
+        self.persistence = persistence
+        self.name = name
+
+    def get(self, key: tuple, default=None):
+        state = self.persistence.load(self.persistence.conversation_key(self.name, key))
+        if state is None:
+            self.pop(key, None)
+            return default
+        self[key] = state
+        return state
+
+
+class RedisPersistence(BasePersistence):
+    """Хранит состояния диалогов, user_data и chat_data в Redis.
+
+    Изменения копятся в памяти и записываются одним pipeline раз в flush_interval
+    секунд (write-behind). Каждый ключ живет ttl секунд с последней записи.
+    """
+
+    def __init__(self,
+                 redis: Redis,
+                 conversation_ttl: int = CONVERSATION_TTL,
+                 user_data_ttl: int = USER_DATA_TTL,
+                 chat_data_ttl: int = CHAT_DATA_TTL,
+                 flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(store_user_data=True, store_chat_data=True, store_bot_data=False)
+        self.redis = redis
+        self.conversation_ttl = conversation_ttl
+        self.user_data_ttl = user_data_ttl
+        self.chat_data_ttl = chat_data_ttl
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = Lock()
+        Thread(target=self._run, name='redis-persistence', daemon=True).start()
+
+    @staticmethod
+    def conversation_key(name: str, key: tuple) -> str:
+        return f'{KEY_PREFIX}:conversation:{name}:{":".join(map(str, key))}'
+
+    @staticmethod
+    def user_data_key(user_id: int) -> str:
+        return f'{KEY_PREFIX}:user_data:{user_id}'
+
+    @staticmethod
+    def chat_data_key(chat_id: int) -> str:
+        return f'{KEY_PREFIX}:chat_data:{chat_id}'
+
+    def load(self, key: str):
+        """Читает значение, учитывая еще не записанные изменения"""
+        with self._lock:
+            if key in self._pending:
+                payload = self._pending[key][0]
+                return None if payload is None else json.loads(payload)
+        payload = self.redis.get(key)
+        return None if payload is None else json.loads(payload)
+
+    def _store(self, key: str, value, ttl: int) -> None:
+        payload = None if value is None else json.dumps(value)
+        with self._lock:
+            self._pending[key] = (payload, ttl)
+
+    def _run(self) -> None:
+        while True:
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Error while writing bot state to Redis')
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            with self.redis.pipeline(transaction=False) as pipeline:
+                for key, (payload, ttl) in pending.items():
+                    if payload is None:
+                        pipeline.delete(key)
+                    else:
+                        pipeline.set(key, payload, ex=ttl)
+                pipeline.execute()
+        except Exception:
+            # Вернем изменения в очередь, если их не перезаписали более новые
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+            raise
+
+    def get_conversations(self, name: str) -> RedisConversations:
+        return RedisConversations(self, name)
+
+    def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        self._store(self.conversation_key(name, key), new_state, self.conversation_ttl)
+
+    def get_user_data(self) -> defaultdict:
+        return defaultdict(dict)
+
+    def get_chat_data(self) -> defaultdict:
+        return defaultdict(dict)
+
+    def get_bot_data(self) -> dict:
+        return {}
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        self._store(self.user_data_key(user_id), data or None, self.user_data_ttl)
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._store(self.chat_data_key(chat_id), data or None, self.chat_data_ttl)
+
+    def update_bot_data(self, data: dict) -> None:
+        pass
+
+    def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        self._refresh(self.user_data_key(user_id), user_data)
+
+    def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        self._refresh(self.chat_data_key(chat_id), chat_data)
+
+    def _refresh(self, key: str, data: dict) -> None:
+        """Подтягивает данные, записанные другой репликой, перед обработкой обновления"""
+        stored = self.load(key) or {}
+        data.clear()
+        data.update(stored)
@@ -0,0 +1,30 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+import main.management.commands.payment_reconciler as payment_reconciler
+
+
+class Command(BaseCommand):
+    help = "Сверка с YooKassa платежей, по которым не пришел вебхук"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60,
+            help='Пауза между проходами, секунд'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить один проход и выйти'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            result = payment_reconciler.reconcile_payments()
+            self.stdout.write(f'Сверка платежей: {result}, {payment_reconciler.get_stats()}')
+            if options['once']:
+                return
+            sleep(options['interval'])
@@ -0,0 +1,55 @@
+from contextlib import nullcontext
+from threading import Lock
+
+from django.conf import settings
+from redis import ConnectionPool, Redis
+
+pool = None
+client = None
+pool_lock = Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Общий на процесс пул соединений с Redis, настроенный из settings"""
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ConnectionPool(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                password=settings.REDIS_PASSWORD or None,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                decode_responses=True
+            )
+    return pool
+
+
+def get_redis() -> Redis:
+    """Клиент Redis поверх общего пула. Клиент потокобезопасен, его можно хранить"""
+    global client
+    connection_pool = get_pool()
+    with pool_lock:
+        if client is None:
+            client = Redis(connection_pool=connection_pool)
+    return client
+
+
+def pool_stats() -> dict:
+    """Заполненность пула для логов. Счетчики — внутренние поля redis-py,
+    поэтому берем только те, что есть в установленной версии
+    """
+    if pool is None:
+        return {}
+    stats = {'max_connections': pool.max_connections}
+    counters = {
+        'created': ('_created_connections', lambda value: value),
+        'in_use': ('_in_use_connections', len),
+        'idle': ('_available_connections', len),
+    }
+    with getattr(pool, '_lock', nullcontext()):
+        for name, (attr, count) in counters.items():
+            value = getattr(pool, attr, None)
+            if value is not None:
+                stats[name] = count(value)
+    return stats
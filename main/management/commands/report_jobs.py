@@ -0,0 +1,32 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+import main.management.commands.reports as reports
+
+
+class Command(BaseCommand):
+    help = "Фоновая сборка и рассылка отчетов, поставленных из админки"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Пауза между проверками очереди, секунд'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить задачи из очереди и выйти'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = reports.run_pending_jobs()
+            if count:
+                self.stdout.write(f'Выполнено отчетов: {count}')
+            if options['once']:
+                return
+            if not count:
+                sleep(options['interval'])
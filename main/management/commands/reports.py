@@ -0,0 +1,214 @@
+import logging
+
+from collections import deque
+from datetime import timedelta
+from typing import Optional
+
+from django.db.models import Count, Q, QuerySet, Sum
+from django.utils.timezone import now
+from more_itertools import chunked
+
+import main.management.commands.db_processing as db
+import main.management.commands.messages as messages
+import main.management.commands.outbox as outbox
+
+from main import models as main_models
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей отчета читать одним запросом
+REPORT_BATCH_SIZE = 500
+# Задача в статусе «выполняется» дольше этого срока считается брошенной и запускается снова
+STALE_JOB_TIMEOUT = timedelta(minutes=30)
+# Сколько ждать доставки одного сообщения отчета из очереди исходящих, секунд
+DELIVERY_TIMEOUT = 10 * 60
+
+NO_MANAGERS_ERROR = 'Нет активных менеджеров, отчет некому отправить'
+
+
+def build_orders_count(ids: list[int]):
+    totals = {'total': 0, 'finished': 0, 'declined': 0, 'in_work': 0}
+    for batch in chunked(ids, REPORT_BATCH_SIZE):
+        counts = main_models.Order.objects.filter(id__in=batch).aggregate(
+            total=Count('id'),
+            finished=Count('id', filter=Q(finished_at__isnull=False)),
+            declined=Count('id', filter=Q(declined=True)),
+            in_work=Count('id', filter=Q(contractor__isnull=False, finished_at__isnull=True)),
+        )
+        for key, value in counts.items():
+            totals[key] += value
+        yield len(batch), []
+    yield 0, [
+        f'Всего заказов: {totals["total"]}',
+        f'В работе: {totals["in_work"]}',
+        f'Выполнено: {totals["finished"]}',
+        f'Отклонено: {totals["declined"]}',
+    ]
+
+
+def build_salary(ids: list[int]):
+    for batch in chunked(ids, REPORT_BATCH_SIZE):
+        contractors = main_models.Contractor.objects.filter(id__in=batch).with_earnings().order_by('id')
+        yield len(batch), [
+            f'Исполнитель: {contractor}\n'
+            f'Выполнено заказов: {contractor.finished_orders_count}\n'
+            f'Заработано: {contractor.earned}\n'
+            for contractor in contractors
+        ]
+
+
+def build_client_orders(ids: list[int]):
+    for batch in chunked(ids, REPORT_BATCH_SIZE):
+        subscriptions = main_models.ClientSubscription.objects.filter(id__in=batch) \
+            .select_related('client__person') \
+            .annotate(
+                created_orders=Count('orders'),
+                declined_orders=Count('orders', filter=Q(orders__declined=True)),
+            ) \
+            .order_by('id')
+        yield len(batch), [
+            f'Клиент: {subscription.client}\n'
+            f'Размещено заказов: {subscription.created_orders}\n'
+            f'Отклонено заказов: {subscription.declined_orders}\n'
+            for subscription in subscriptions
+        ]
+
+
+# Отчет: заголовок и генератор пар (обработано записей, строки отчета)
+REPORTS = {
+    main_models.ReportJob.ORDERS_COUNT: ('Отчет по числу заказов:', build_orders_count),
+    main_models.ReportJob.SALARY: ('Отчет по зарплатам:', build_salary),
+    main_models.ReportJob.CLIENT_ORDERS: ('Отчет по заказам:', build_client_orders),
+}
+
+
+class ReportSender:
+    """Копит строки отчета и отправляет их менеджерам сообщениями не длиннее лимита Telegram.
+
+    QueuedBot отправляет отчеты в фоне и возвращает Future, поэтому ошибка Telegram
+    становится видна только в collect(). sent — число сообщений, доставленных всем менеджерам.
+    """
+
+    def __init__(self, bot, chat_ids: tuple[int], limit: int = messages.MAX_MESSAGE_LENGTH):
+        self.bot = bot
+        self.chat_ids = chat_ids
+        self.limit = limit
+        self.parts = []
+        self.length = 0
+        self.sent = 0
+        self.in_flight = deque()
+
+    def add(self, part: str) -> None:
+        part = part[:self.limit]
+        if self.parts and self.length + len(part) + 1 > self.limit:
+            self.flush()
+        self.parts.append(part)
+        self.length += len(part) + 1
+
+    def flush(self) -> None:
+        if not self.parts:
+            return
+        if not self.chat_ids:
+            # Без получателей сообщение не отправлено и не учитывается в sent
+            self.parts = []
+            self.length = 0
+            return
+        text = '\n'.join(self.parts)
+        self.in_flight.append([
+            self.bot.send_message(chat_id, text, priority=outbox.REPORT)
+            for chat_id in self.chat_ids
+        ])
+        self.parts = []
+        self.length = 0
+        self.collect()
+
+    def collect(self, wait: bool = False) -> None:
+        """Учитывает доставленные сообщения и пробрасывает ошибку первой неудачной отправки.
+
+        Без wait проверяет только уже завершенные отправки и не блокируется.
+        """
+        while self.in_flight and (wait or all(future.done() for future in self.in_flight[0])):
+            for future in self.in_flight.popleft():
+                future.result(timeout=DELIVERY_TIMEOUT)
+            self.sent += 1
+
+
+def enqueue_report(report: str, queryset: QuerySet) -> main_models.ReportJob:
+    return main_models.ReportJob.objects.create(
+        report=report,
+        object_ids=list(queryset.order_by().values_list('id', flat=True))
+    )
+
+
+def get_claimable_jobs() -> QuerySet:
+    return main_models.ReportJob.objects.filter(
+        Q(status=main_models.ReportJob.PENDING) |
+        Q(status=main_models.ReportJob.RUNNING, started_at__lt=now() - STALE_JOB_TIMEOUT)
+    )
+
+
+def claim_next_job() -> Optional[main_models.ReportJob]:
+    """Забирает задачу условным UPDATE, чтобы несколько воркеров не взяли одну и ту же"""
+    for job_id in get_claimable_jobs().order_by('id').values_list('id', flat=True)[:10]:
+        claimed = get_claimable_jobs().filter(id=job_id).update(
+            status=main_models.ReportJob.RUNNING,
+            started_at=now(),
+            progress=0
+        )
+        if claimed:
+            return main_models.ReportJob.objects.get(id=job_id)
+    return None
+
+
+def run_job(job: main_models.ReportJob, bot=None) -> None:
+    title, build = REPORTS[job.report]
+    sender = ReportSender(bot or outbox.get_bot(), db.get_managers_telegram_ids())
+    if not sender.chat_ids:
+        logger.warning(f'Report job {job.id} skipped: no managers')
+        main_models.ReportJob.objects.filter(id=job.id).update(
+            status=main_models.ReportJob.FAILED,
+            error=NO_MANAGERS_ERROR,
+            finished_at=now()
+        )
+        return
+    total = len(job.object_ids)
+    done = 0
+    try:
+        sender.add(title)
+        for processed, lines in build(job.object_ids):
+            for line in lines:
+                sender.add(line)
+            done += processed
+            if processed:
+                main_models.ReportJob.objects.filter(id=job.id).update(
+                    progress=done * 100 // total,
+                    messages_sent=sender.sent
+                )
+        sender.flush()
+        sender.collect(wait=True)
+    except Exception as error:
+        logger.exception(f'Report job {job.id} failed')
+        main_models.ReportJob.objects.filter(id=job.id).update(
+            status=main_models.ReportJob.FAILED,
+            error=str(error),
+            messages_sent=sender.sent,
+            finished_at=now()
+        )
+        return
+    main_models.ReportJob.objects.filter(id=job.id).update(
+        status=main_models.ReportJob.DONE,
+        progress=100,
+        messages_sent=sender.sent,
+        finished_at=now()
+    )
+
+
+def run_pending_jobs(bot=None, limit: int = 10) -> int:
+    """Выполняет задачи из очереди, возвращает их число"""
+    for count in range(limit):
+        job = claim_next_job()
+        if job is None:
+            return count
+        logger.info(f'Running report job {job.id}: {job.report}, {len(job.object_ids)} records')
+        run_job(job, bot=bot)
+    return limit
@@ -4,15 +4,17 @@ import logging
 import uuid
 import json
 import requests
-from yookassa import Configuration, Payment
+from yookassa import Payment
 
 from contextlib import suppress
+from queue import Queue
+from threading import Event, Lock, Thread
 from functools import partial
 from textwrap import dedent
-from time import sleep
+from typing import Union
 from uuid import uuid4
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils.timezone import datetime, make_aware
 from environs import Env
 from more_itertools import chunked
@@ -27,24 +29,49 @@ from telegram import (
     LabeledPrice,
     Contact,
     InlineKeyboardMarkup,
-    InlineKeyboardButton
+    InlineKeyboardButton,
+    InlineQueryResultArticle,
+    InputTextMessageContent
 )
 from telegram.error import BadRequest
+from telegram.utils.request import Request
 from telegram.ext import (
     Updater,
+    BasePersistence,
     CommandHandler,
     MessageHandler,
     CallbackContext,
     CallbackQueryHandler,
     ConversationHandler,
+    Dispatcher,
     Filters,
-    PreCheckoutQueryHandler
+    InlineQueryHandler,
+    JobQueue,
+    PreCheckoutQueryHandler,
+    TypeHandler
 )
 
 import main.management.commands.db_processing as db
 import main.management.commands.messages as messages
 import main.management.commands.buttons as buttons
+import main.management.commands.callbacks as callbacks
+import main.management.commands.cart as cart
 import main.management.commands.keyboards as keyboards
+import main.management.commands.notifications as notifications
+import main.management.commands.outbox as outbox
+import main.management.commands.payment_reconciler as payment_reconciler
+import main.management.commands.redis_pool as redis_pool
+import main.management.commands.reports as reports
+import main.management.commands.scratch as scratch
+import main.management.commands.search as search
+import main.management.commands.telegram_files as telegram_files
+import main.management.commands.yookassa_webhook as yookassa_webhook
+
+from main.management.commands.callback_router import CallbackRouter
+from main.management.commands.catalog import get_catalog
+from main.management.commands.chat_executor import ChatOrderedDispatcher, ChatOrderedExecutor
+from main.management.commands.outbox import QueuedBot
+from main.management.commands.persistence import RedisPersistence
 
 # Настройка логирования
 logging.basicConfig(
@@ -53,6 +80,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Пауза перед показом следующего экрана, секунд
+FOLLOWUP_DELAY = 2
+
+# Как часто проверять очередь отчетов из админки, секунд
+REPORT_JOBS_INTERVAL = 5
+# Как часто обрабатывать сохраненные уведомления YooKassa, секунд
+PAYMENT_EVENTS_INTERVAL = 2
+# Как часто сверять с YooKassa платежи без вебхука, секунд
+PAYMENT_RECONCILE_INTERVAL = 60
+
+# Последний update_id каждого чата: отложенный экран не показываем,
+# если пользователь уже нажал что-то еще
+last_update_ids = {}
+last_update_ids_lock = Lock()
+
 def delete_prev_inline(func, *args, **kwargs):
     def wrapper(*args, **kwargs):
         try:
@@ -97,14 +139,50 @@ def check_available_client_request(func, *args, **kwargs):
     return wrapper
 
 
+def track_last_update(update: Update, context: CallbackContext) -> None:
+    if update.effective_chat:
+        with last_update_ids_lock:
+            last_update_ids[update.effective_chat.id] = update.update_id
+
+
+def is_latest_update(update: Update) -> bool:
+    with last_update_ids_lock:
+        return last_update_ids.get(update.effective_chat.id, update.update_id) <= update.update_id
+
+
+def send_followup(callback,
+                  state: str,
+                  update: Update,
+                  context: CallbackContext,
+                  delay: float = FOLLOWUP_DELAY) -> str:
+    """Показывает следующий экран через delay секунд, не занимая поток обработчика.
+
+    Если за это время из чата пришло новое обновление, экран не показывается.
+    Возвращает состояние диалога, в которое перейдет callback.
+    """
+    def followup() -> None:
+        if not is_latest_update(update):
+            logger.debug(f'Skip stale follow-up for chat {update.effective_chat.id}')
+            return
+        callback(update=update, context=context)
+
+    def run_followup(_: CallbackContext) -> None:
+        if isinstance(context.dispatcher, ChatOrderedDispatcher):
+            # Сохраняем порядок относительно других обновлений этого чата
+            context.dispatcher.executor.submit(update.effective_chat.id, followup)
+        else:
+            followup()
+
+    if not context.job_queue:
+        return callback(update=update, context=context)
+    context.job_queue.run_once(run_followup, delay)
+    return state
+
+
 def send_message_all_managers(message: str,
                               update: Update,
                               context: CallbackContext) -> None:
-    for manager_id in db.get_managers_telegram_ids():
-        context.bot.send_message(
-            manager_id,
-            message
-        )
+    notifications.get_manager_notifier().notify(message)
 
 
 @delete_prev_inline
@@ -126,7 +204,7 @@ def start(update: Update, context: CallbackContext) -> str:
 
 @delete_prev_inline
 def check_access(update: Update, context: CallbackContext) -> str:
-    _, claimed_role = update.callback_query.data.split(":::")
+    claimed_role, = callbacks.get_args(update)
 
     if claimed_role == 'contractor':
         if db.is_contractor(telegram_id=update.effective_chat.id):
@@ -147,8 +225,7 @@ def subscription_alert(update: Update, context: CallbackContext) -> str:
         update.effective_chat.id,
         messages.SUBSCRIPTION_ALERT
     )
-    sleep(2)
-    return tell_about_subscription(update=update, context=context)
+    return send_followup(tell_about_subscription, 'CLIENT', update=update, context=context)
 
 
 def available_requests_alert(update: Update, context: CallbackContext) -> str:
@@ -161,9 +238,11 @@ def available_requests_alert(update: Update, context: CallbackContext) -> str:
 
 
 def hello_visitor(update: Update, context: CallbackContext) -> str:
-    context.bot.send_document(
+    telegram_files.send_file(
+        context.bot.send_document,
+        'privacy_policy.pdf',
+        media='document',
         chat_id=update.effective_chat.id,
-        document=open('privacy_policy.pdf', 'rb'),
         caption=messages.HELLO_VISITOR,
         reply_markup=keyboards.PHONE_REQUEST_MARKUP,
     )
@@ -240,14 +319,13 @@ def select_category(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def show_category_services(update: Update, context: CallbackContext) -> str:
     """Показывает услуги в выбранной категории"""
-    category_id = int(update.callback_query.data.split(':')[1])
+    category_id, = callbacks.get_args(update)
     
     # Сохраняем ID категории в контексте
     context.user_data['selected_category_id'] = category_id
     
     # Получаем категорию
-    categories = db.get_service_categories()
-    category = next((c for c in categories if c.id == category_id), None)
+    category = get_catalog().get_category(category_id)
     
     if not category:
         return client_main(update, context)
@@ -255,7 +333,7 @@ def show_category_services(update: Update, context: CallbackContext) -> str:
     # Отправляем сообщение с услугами в категории
     context.bot.send_message(
         update.effective_chat.id,
-        text=f"Услуги в категории: <b>{category.name}</b>",
+        text=f"Услуги в категории: <b>{category['name']}</b>",
         parse_mode='HTML',
         reply_markup=keyboards.get_services_keyboard(category_id)
     )
@@ -263,10 +341,118 @@ def show_category_services(update: Update, context: CallbackContext) -> str:
     return 'CLIENT_BROWSE_SERVICES'
 
 
+def get_page_cursor(direction: str, service_id: str) -> dict:
+    if direction == 'prev':
+        return {'before_id': int(service_id)}
+    return {'after_id': int(service_id)}
+
+
+def show_services_page(update: Update, context: CallbackContext) -> str:
+    """Листает услуги категории в том же сообщении"""
+    category_id, direction, service_id = callbacks.get_args(update)
+    with suppress(BadRequest):
+        context.bot.edit_message_reply_markup(
+            chat_id=update.effective_chat.id,
+            message_id=update.callback_query.message.message_id,
+            reply_markup=keyboards.get_services_keyboard(
+                int(category_id),
+                **get_page_cursor(direction, service_id)
+            )
+        )
+    return 'CLIENT_BROWSE_SERVICES'
+
+
+@delete_prev_inline
+def ask_search_query(update: Update, context: CallbackContext) -> str:
+    context.bot.send_message(
+        update.effective_chat.id,
+        text=messages.SEARCH_PROMPT_MESSAGE,
+        reply_markup=keyboards.CANCEL_INLINE
+    )
+    return 'CLIENT_SEARCH'
+
+
+def search_command(update: Update, context: CallbackContext) -> str:
+    """/search <запрос>, без запроса спрашивает, что искать"""
+    query = ' '.join(context.args or [])
+    if not query:
+        return ask_search_query(update, context)
+    return show_search_results(update, context, query)
+
+
+def enter_search_query(update: Update, context: CallbackContext) -> str:
+    return show_search_results(update, context, update.message.text)
+
+
+def show_search_results(update: Update, context: CallbackContext, query: str) -> str:
+    # Запрос не помещается в callback_data, листаем выдачу по сохраненному
+    context.user_data['search_query'] = query
+    services, has_next = search.search_services(query)
+    if not services:
+        context.bot.send_message(
+            update.effective_chat.id,
+            text=messages.SEARCH_NOTHING_FOUND_MESSAGE.format(query=query),
+            reply_markup=keyboards.CANCEL_INLINE
+        )
+        return 'CLIENT_SEARCH'
+
+    context.bot.send_message(
+        update.effective_chat.id,
+        text=messages.SEARCH_RESULTS_MESSAGE.format(query=query),
+        reply_markup=keyboards.get_search_results_keyboard(services, offset=0, has_next=has_next)
+    )
+    return 'CLIENT_BROWSE_SERVICES'
+
+
+def show_search_page(update: Update, context: CallbackContext) -> str:
+    """Листает результаты поиска в том же сообщении"""
+    query = context.user_data.get('search_query')
+    if not query:
+        return client_main(update, context)
+    offset, = callbacks.get_args(update)
+    services, has_next = search.search_services(query, offset=offset)
+    with suppress(BadRequest):
+        context.bot.edit_message_reply_markup(
+            chat_id=update.effective_chat.id,
+            message_id=update.callback_query.message.message_id,
+            reply_markup=keyboards.get_search_results_keyboard(services, offset=offset, has_next=has_next)
+        )
+    return 'CLIENT_BROWSE_SERVICES'
+
+
+def inline_search(update: Update, context: CallbackContext) -> None:
+    """Поиск услуг в inline-режиме: @имя_бота запрос в любом чате"""
+    inline_query = update.inline_query
+    offset = int(inline_query.offset or 0)
+    services, has_next = search.search_services(inline_query.query, offset=offset)
+    results = [
+        InlineQueryResultArticle(
+            id=str(service.id),
+            title=service.title,
+            description=f'{service.price} руб.',
+            input_message_content=InputTextMessageContent(
+                messages.SERVICE_DETAILS_TEMPLATE.format(
+                    title=service.title,
+                    description=service.description,
+                    price=service.price,
+                    contractor_name=service.contractor.person.name
+                ),
+                parse_mode='HTML'
+            )
+        )
+        for service in services
+    ]
+    inline_query.answer(
+        results,
+        cache_time=search.INLINE_CACHE_TIME,
+        next_offset=str(offset + search.SEARCH_PAGE_SIZE) if has_next else ''
+    )
+
+
 @delete_prev_inline
 def show_service_details(update: Update, context: CallbackContext) -> str:
     """Показывает детальную информацию об услуге"""
-    service_id = int(update.callback_query.data.split(':')[1])
+    service_id, = callbacks.get_args(update)
     
     # Сохраняем ID услуги в контексте
     context.user_data['selected_service_id'] = service_id
@@ -274,7 +460,7 @@ def show_service_details(update: Update, context: CallbackContext) -> str:
     # Получаем услугу из базы данных
     from main.models import Service
     try:
-        service = Service.objects.get(id=service_id)
+        service = Service.objects.select_related('contractor__person').get(id=service_id)
         
         # Формируем сообщение с деталями услуги и информацией о фрилансере
         message = f"""
@@ -290,9 +476,11 @@ def show_service_details(update: Update, context: CallbackContext) -> str:
         # Отправляем сообщение с фото, если оно есть и файл существует
         if service.photo and os.path.exists(service.photo.path):
             try:
-                context.bot.send_photo(
-                    update.effective_chat.id,
-                    photo=open(service.photo.path, 'rb'),
+                telegram_files.send_file(
+                    context.bot.send_photo,
+                    service.photo.path,
+                    media='photo',
+                    chat_id=update.effective_chat.id,
                     caption=message,
                     parse_mode='HTML',
                     reply_markup=keyboards.get_service_details_keyboard(service_id)
@@ -327,28 +515,31 @@ def show_service_details(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def add_to_cart(update: Update, context: CallbackContext) -> str:
     """Добавляет услугу в корзину"""
-    service_id = int(update.callback_query.data.split(':')[1])
-    
-    # Добавляем услугу в набор
-    db.add_service_to_set(update.effective_user.id, service_id)
+    service_id, = callbacks.get_args(update)
     
-    # Отправляем сообщение об успешном добавлении
-    context.bot.send_message(
-        update.effective_chat.id,
-        text=messages.ADDED_TO_CART_MESSAGE
-    )
+    if cart.add_service(update.effective_user.id, service_id):
+        context.bot.send_message(
+            update.effective_chat.id,
+            text=messages.ADDED_TO_CART_MESSAGE
+        )
     
     # Показываем корзину
     return show_cart(update, context)
 
 
+def format_cart(summary: cart.CartSummary) -> tuple[str, str]:
+    """Строки услуг и пометка о скидке для сообщений с корзиной"""
+    services_text = ''.join(f"• {item['title']} - {item['price']} руб.\n" for item in summary.items)
+    discount_text = f" (включая скидку {summary.discount_percent}%)" if summary.has_discount else ""
+    return services_text, discount_text
+
+
 @delete_prev_inline
 def show_cart(update: Update, context: CallbackContext) -> str:
     """Показывает содержимое корзины"""
-    # Получаем набор услуг пользователя
-    service_set = db.get_client_service_set(update.effective_user.id)
+    summary = cart.get_summary(update.effective_user.id)
     
-    if not service_set or not service_set.services.exists():
+    if not summary:
         # Если корзина пуста
         context.bot.send_message(
             update.effective_chat.id,
@@ -357,29 +548,16 @@ def show_cart(update: Update, context: CallbackContext) -> str:
         )
         return 'CLIENT_SELECT_CATEGORY'
     
-    # Формируем список услуг в корзине
-    services_text = ""
-    for service in service_set.services.all():
-        services_text += f"• {service.title} - {service.get_final_price()} руб.\n"
-    
-    # Рассчитываем общую стоимость
-    total_price = service_set.get_total_price()
-    
-    # Проверяем, есть ли скидка
-    discount_text = ""
-    if service_set.services.count() >= 3:
-        discount_text = " (включая скидку 10%)"
-    
-    # Отправляем сообщение с корзиной
+    services_text, discount_text = format_cart(summary)
     context.bot.send_message(
         update.effective_chat.id,
         text=messages.CART_TEMPLATE.format(
             services=services_text,
-            total_price=total_price,
+            total_price=summary.total,
             discount=discount_text
         ),
         parse_mode='HTML',
-        reply_markup=keyboards.get_cart_keyboard(update.effective_user.id)
+        reply_markup=keyboards.get_cart_keyboard(summary)
     )
     
     return 'CLIENT_CART'
@@ -388,25 +566,13 @@ def show_cart(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def remove_from_cart(update: Update, context: CallbackContext) -> str:
     """Удаляет услугу из корзины"""
-    service_id = int(update.callback_query.data.split(':')[1])
+    service_id, = callbacks.get_args(update)
     
-    # Получаем набор услуг пользователя
-    service_set = db.get_client_service_set(update.effective_user.id)
-    
-    if service_set:
-        # Удаляем услугу из набора
-        from main.models import Service
-        try:
-            service = Service.objects.get(id=service_id)
-            service_set.services.remove(service)
-            
-            # Отправляем сообщение об успешном удалении
-            context.bot.send_message(
-                update.effective_chat.id,
-                text=messages.REMOVED_FROM_CART_MESSAGE
-            )
-        except Service.DoesNotExist:
-            pass
+    if cart.remove_service(update.effective_user.id, service_id):
+        context.bot.send_message(
+            update.effective_chat.id,
+            text=messages.REMOVED_FROM_CART_MESSAGE
+        )
     
     # Показываем обновленную корзину
     return show_cart(update, context)
@@ -415,8 +581,7 @@ def remove_from_cart(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def clear_cart(update: Update, context: CallbackContext) -> str:
     """Очищает корзину"""
-    # Очищаем набор услуг пользователя
-    db.clear_service_set(update.effective_user.id)
+    cart.clear(update.effective_user.id)
     
     # Отправляем сообщение об успешной очистке
     context.bot.send_message(
@@ -431,10 +596,10 @@ def clear_cart(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def checkout(update: Update, context: CallbackContext) -> str:
     """Перенаправляет клиента на сайт консалтинговой фирмы для оплаты"""
-    # Получаем набор услуг пользователя
-    service_set = db.get_client_service_set(update.effective_user.id)
+    # Корзина сохраняется в БД как набор услуг, отправленный на оплату
+    checked_out = cart.checkout(update.effective_user.id)
     
-    if not service_set or not service_set.services.exists():
+    if checked_out is None:
         # Если корзина пуста
         context.bot.send_message(
             update.effective_chat.id,
@@ -442,24 +607,14 @@ def checkout(update: Update, context: CallbackContext) -> str:
         )
         return select_category(update, context)
     
-    # Формируем список услуг в корзине для отображения
-    services_text = ""
-    for service in service_set.services.all():
-        services_text += f"• {service.title} - {service.get_final_price()} руб.\n"
-    
-    # Рассчитываем общую стоимость
-    total_price = service_set.get_total_price()
-    
-    # Проверяем, есть ли скидка
-    discount_text = ""
-    if service_set.services.count() >= 3:
-        discount_text = " (включая скидку 10%)"
+    service_set, summary = checked_out
+    services_text, discount_text = format_cart(summary)
     
     # Создаем уникальный идентификатор заказа
     order_id = str(uuid.uuid4())
     
     # Формируем URL для оплаты на сайте консалтинговой фирмы
-    payment_url = f"https://consulting-firm.com/payment?order_id={order_id}&amount={total_price}"
+    payment_url = f"https://consulting-firm.com/payment?order_id={order_id}&amount={summary.total}"
     
     # Отправляем сообщение с информацией о заказе и ссылкой на оплату
     context.bot.send_message(
@@ -468,7 +623,7 @@ def checkout(update: Update, context: CallbackContext) -> str:
 <b>Ваш заказ:</b>
 
 {services_text}
-<b>Итого:</b> {total_price} руб.{discount_text}
+<b>Итого:</b> {summary.total} руб.{discount_text}
 
 Для оплаты перейдите по ссылке ниже:
 {payment_url}
@@ -478,11 +633,6 @@ def checkout(update: Update, context: CallbackContext) -> str:
         parse_mode='HTML'
     )
     
-    # Отмечаем набор как отправленный на оплату
-    from django.utils.timezone import now
-    service_set.paid_at = now()
-    service_set.save()
-    
     # Возвращаемся на главную
     return client_main(update, context)
 
@@ -512,6 +662,21 @@ def contractor_services(update: Update, context: CallbackContext) -> str:
     return 'CONTRACTOR_SERVICES'
 
 
+def contractor_services_page(update: Update, context: CallbackContext) -> str:
+    """Листает услуги исполнителя в том же сообщении"""
+    direction, service_id = callbacks.get_args(update)
+    with suppress(BadRequest):
+        context.bot.edit_message_reply_markup(
+            chat_id=update.effective_chat.id,
+            message_id=update.callback_query.message.message_id,
+            reply_markup=keyboards.get_contractor_services_keyboard(
+                update.effective_user.id,
+                **get_page_cursor(direction, service_id)
+            )
+        )
+    return 'CONTRACTOR_SERVICES'
+
+
 @delete_prev_inline
 def add_service_start(update: Update, context: CallbackContext) -> str:
     """Начинает процесс добавления услуги"""
@@ -593,7 +758,7 @@ def add_service_price(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def add_service_category(update: Update, context: CallbackContext) -> str:
     """Сохраняет категорию услуги и запрашивает фото"""
-    category_id = int(update.callback_query.data.split(':')[1])
+    category_id, = callbacks.get_args(update)
     
     # Сохраняем категорию
     context.user_data['new_service']['category_id'] = category_id
@@ -684,7 +849,7 @@ def skip_photo(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def edit_service(update: Update, context: CallbackContext) -> str:
     """Показывает меню редактирования услуги"""
-    service_id = int(update.callback_query.data.split(':')[1])
+    service_id, = callbacks.get_args(update)
     
     # Сохраняем ID услуги в контексте
     context.user_data['edit_service_id'] = service_id
@@ -708,9 +873,11 @@ def edit_service(update: Update, context: CallbackContext) -> str:
         # Отправляем сообщение с фото, если оно есть и файл существует
         if service.photo and os.path.exists(service.photo.path):
             try:
-                context.bot.send_photo(
-                    update.effective_chat.id,
-                    photo=open(service.photo.path, 'rb'),
+                telegram_files.send_file(
+                    context.bot.send_photo,
+                    service.photo.path,
+                    media='photo',
+                    chat_id=update.effective_chat.id,
                     caption=message,
                     parse_mode='HTML',
                     reply_markup=keyboards.get_service_edit_keyboard(service_id)
@@ -745,7 +912,7 @@ def edit_service(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def delete_service_confirm(update: Update, context: CallbackContext) -> str:
     """Подтверждает удаление услуги"""
-    service_id = int(update.callback_query.data.split(':')[1])
+    service_id, = callbacks.get_args(update)
     
     # Сохраняем ID услуги в контексте
     context.user_data['delete_service_id'] = service_id
@@ -857,8 +1024,7 @@ def client_request_description(update: Update, context: CallbackContext) -> str:
         update.effective_chat.id,
         messages.SUCCESS_REQUEST
     )
-    sleep(2)
-    return client_main(update=update, context=context)
+    return send_followup(client_main, 'CLIENT', update=update, context=context)
 
 
 @delete_prev_inline
@@ -874,7 +1040,7 @@ def display_current_orders(update: Update, context: CallbackContext) -> str:
 
 @delete_prev_inline
 def display_order(update: Update, context: CallbackContext) -> str:
-    _, order_id = update.callback_query.data.split(':::')
+    order_id, = callbacks.get_args(update)
     order = db.get_order(order_id=int(order_id))
     context.bot.send_message(
         update.effective_chat.id,
@@ -889,10 +1055,19 @@ def display_order(update: Update, context: CallbackContext) -> str:
     return 'CLIENT'
 
 
+def dialog_expired(main_screen, update: Update, context: CallbackContext) -> str:
+    """Временные данные диалога истекли: сообщаем об этом и возвращаем на главный экран"""
+    context.bot.send_message(
+        update.effective_chat.id,
+        text=messages.DIALOG_EXPIRED
+    )
+    return main_screen(update, context)
+
+
 @delete_prev_inline
 def add_order_comment(redis: Redis, update: Update, context: CallbackContext) -> str:
-    _, order_id = update.callback_query.data.split(':::')
-    redis.set(f'{update.effective_chat.id}_order_id', order_id)
+    order_id, = callbacks.get_args(update)
+    scratch.set_value(redis, scratch.ORDER_ID, update.effective_chat.id, order_id)
     context.bot.send_message(
         update.effective_chat.id,
         text=messages.NEW_CLIENT_COMMENT,
@@ -910,7 +1085,9 @@ def client_comment_description(redis: Redis, update: Update, context: CallbackCo
             reply_markup=keyboards.CANCEL_INLINE
         )
         return 'CLIENT_NEW_COMMENT'
-    order_id = redis.get(f'{update.effective_chat.id}_order_id')
+    order_id = scratch.pop_value(redis, scratch.ORDER_ID, update.effective_chat.id)
+    if order_id is None:
+        return dialog_expired(client_main, update, context)
     order, comment = db.create_comment_from_client(
         order_id=int(order_id),
         comment=update.message.text
@@ -924,15 +1101,13 @@ def client_comment_description(redis: Redis, update: Update, context: CallbackCo
         update.effective_chat.id,
         messages.SUCCESS_COMMENT
     )
-    redis.delete(f'{update.effective_chat.id}_order_id')
-    sleep(2)
-    return client_main(update=update, context=context)
+    return send_followup(client_main, 'CLIENT', update=update, context=context)
 
 
 @delete_prev_inline
 def add_order_complaint(redis: Redis, update: Update, context: CallbackContext) -> str:
-    _, order_id = update.callback_query.data.split(':::')
-    redis.set(f'{update.effective_chat.id}_order_id', order_id)
+    order_id, = callbacks.get_args(update)
+    scratch.set_value(redis, scratch.ORDER_ID, update.effective_chat.id, order_id)
     context.bot.send_message(
         update.effective_chat.id,
         text=messages.NEW_CLIENT_COMMENT,
@@ -950,7 +1125,9 @@ def client_complaint_description(redis: Redis, update: Update, context: Callback
             reply_markup=keyboards.CANCEL_INLINE
         )
         return 'CLIENT_NEW_COMPLAINT'
-    order_id = redis.get(f'{update.effective_chat.id}_order_id')
+    order_id = scratch.pop_value(redis, scratch.ORDER_ID, update.effective_chat.id)
+    if order_id is None:
+        return dialog_expired(client_main, update, context)
     order, complaint = db.create_client_order_complaint(
         order_id=int(order_id),
         complaint=update.message.text
@@ -964,14 +1141,12 @@ def client_complaint_description(redis: Redis, update: Update, context: Callback
         update.effective_chat.id,
         messages.SUCCESS_COMPLAINT
     )
-    redis.delete(f'{update.effective_chat.id}_order_id')
-    sleep(2)
-    return client_main(update=update, context=context)
+    return send_followup(client_main, 'CLIENT', update=update, context=context)
 
 
 @delete_prev_inline
 def send_contractor_contact(update: Update, context: CallbackContext) -> str:
-    _, order_id = update.callback_query.data.split(':::')
+    order_id, = callbacks.get_args(update)
     try:
         contractor_contact_meta = db.get_order_contractor_contact(order_id=int(order_id))
         context.bot.send_contact(
@@ -983,8 +1158,7 @@ def send_contractor_contact(update: Update, context: CallbackContext) -> str:
             update.effective_chat.id,
             text=error.message
         )
-    sleep(2)
-    return display_order(update=update, context=context)
+    return send_followup(display_order, 'CLIENT', update=update, context=context)
 
 
 @delete_prev_inline
@@ -994,8 +1168,7 @@ def send_current_tariff(update: Update, context: CallbackContext) -> str:
         update.effective_chat.id,
         text=client_tariff_info or messages.NO_ACTIVE_SUBSCRIPTIONS
     )
-    sleep(2)
-    return client_main(update=update, context=context)
+    return send_followup(client_main, 'CLIENT', update=update, context=context)
 
 
 @delete_prev_inline
@@ -1058,8 +1231,7 @@ def contractor_display_orders(update: Update, context: CallbackContext) -> str:
             update.effective_chat.id,
             text=no_order_message,
         )
-        sleep(2)
-        return contractor_main(update=update, context=context)
+        return send_followup(contractor_main, 'CONTRACTOR', update=update, context=context)
 
     context.bot.send_message(
         update.effective_chat.id,
@@ -1071,7 +1243,7 @@ def contractor_display_orders(update: Update, context: CallbackContext) -> str:
 
 @delete_prev_inline
 def contractor_display_order(update: Update, context: CallbackContext) -> str:
-    callback, order_id = update.callback_query.data.split(':::')
+    callback, (order_id,) = callbacks.decode(update.callback_query.data)
     order = db.get_order(order_id=int(order_id))
     if callback == buttons.AVAILABLE_ORDER['callback_data']:
         keyboard = keyboards.contractor_order_inline(order=order, is_available=True)
@@ -1087,8 +1259,14 @@ def contractor_display_order(update: Update, context: CallbackContext) -> str:
 
 @delete_prev_inline
 def contractor_take_order(update: Update, context: CallbackContext) -> str:
-    _, order_id = update.callback_query.data.split(':::')
-    order = db.set_order_contractor(telegram_id=update.effective_chat.id, order_id=order_id)
+    order_id, = callbacks.get_args(update)
+    order = db.claim_order(telegram_id=update.effective_chat.id, order_id=int(order_id))
+    if not order:
+        context.bot.send_message(
+            update.effective_chat.id,
+            text=messages.ORDER_ALREADY_TAKEN
+        )
+        return contractor_main(update=update, context=context)
     send_message_all_managers(
         message=messages.contractor_took_order_notification(order=order),
         update=update,
@@ -1103,7 +1281,7 @@ def contractor_take_order(update: Update, context: CallbackContext) -> str:
 
 @delete_prev_inline
 def contractor_finish_order(update: Update, context: CallbackContext) -> str:
-    _, order_id = update.callback_query.data.split(':::')
+    order_id, = callbacks.get_args(update)
     order = db.close_order(order_id=int(order_id))
     send_message_all_managers(
         message=messages.contractor_finished_order_notification(order=order),
@@ -1119,8 +1297,8 @@ def contractor_finish_order(update: Update, context: CallbackContext) -> str:
 
 @delete_prev_inline
 def contractor_set_estimate_datetime(redis: Redis, update: Update, context: CallbackContext) -> str:
-    _, order_id = update.callback_query.data.split(':::')
-    redis.set(f'{update.effective_chat.id}_contractor_order_id', order_id)
+    order_id, = callbacks.get_args(update)
+    scratch.set_value(redis, scratch.CONTRACTOR_ORDER_ID, update.effective_chat.id, order_id)
     context.bot.send_message(
         update.effective_chat.id,
         messages.SET_ESTIMATE_DATETIME,
@@ -1138,7 +1316,9 @@ def contractor_enter_estimate_datetime(redis: Redis, update: Update, context: Ca
         estimate_datetime = datetime(
             int(year), int(month), int(day), int(hour), int(minute), 0, 0
         )
-        order_id = redis.get(f'{update.effective_chat.id}_contractor_order_id')
+        order_id = scratch.pop_value(redis, scratch.CONTRACTOR_ORDER_ID, update.effective_chat.id)
+        if order_id is None:
+            return dialog_expired(contractor_main, update, context)
         order = db.set_estimate_datetime(order_id=int(order_id), estimate_datetime=estimate_datetime)
         
         # Отправляем уведомление клиенту
@@ -1188,58 +1368,38 @@ def tell_about_subscription(update: Update, context: CallbackContext) -> str:
     return 'CLIENT'
 
 
+def get_payment_key(payment_id: str) -> Union[uuid.UUID, str]:
+    """id платежа YooKassa — UUID, в кнопке он занимает 16 байт вместо 36 символов"""
+    try:
+        return uuid.UUID(payment_id)
+    except ValueError:
+        return payment_id
+
+
 def check_payment_status(update: Update, context: CallbackContext) -> None:
     """Проверяет статус платежа и активирует подписку если оплата прошла"""
     
     # Получаем payment_id из callback_data
-    payment_id = update.callback_query.data.split(':')[1]
+    payment_id = str(callbacks.get_args(update)[0])
     
-    # Инициализируем Redis
-    env = Env()
-    env.read_env()
-    redis = Redis(
-        host=env('REDIS_HOST', 'localhost'),
-        port=env('REDIS_PORT', 6379),
-        db=env('REDIS_DB', 0),
-        password=env('REDIS_PASSWORD', None),
-        decode_responses=True
-    )
+    redis = redis_pool.get_redis()
 
     logging.debug(f"Checking payment status for payment_id: {payment_id}")
     
     try:
         # Проверяем статус платежа через YooKassa API
+        yookassa_webhook.configure_yookassa()
         payment = Payment.find_one(payment_id)
         logging.debug(f"Payment status: {payment.status}")
         
         if payment.status == "succeeded":
-            # Получаем данные платежа из Redis
-            payment_data = redis.get(f'payment_{payment_id}')
-            
-            if payment_data:
-                payment_info = json.loads(payment_data)
-                tariff_id = payment_info.get('tariff_id')
-                user_id = payment_info.get('user_id')
-                
-                # Создаем подписку
-                subscription = db.create_subscription(
-                    telegram_id=user_id,
-                    tariff_id=tariff_id,
-                    payment_id=payment_id,
-                    active=True
-                )
-                
-                # Отправляем сообщение об успешной оплате
+            # Тот же путь, что и у вебхука: подписка по платежу создается один раз
+            if yookassa_webhook.activate_payment(redis, payment_id, payment.metadata):
                 context.bot.send_message(
                     chat_id=update.effective_chat.id,
                     text="✅ Оплата прошла успешно! Ваша подписка активирована."
                 )
-                
-                # Удаляем данные платежа из Redis
-                redis.delete(f'payment_{payment_id}')
-                
             else:
-                logging.error(f"Payment data not found in Redis for payment_id: {payment_id}")
                 context.bot.send_message(
                     chat_id=update.effective_chat.id,
                     text="Произошла ошибка при проверке платежа. Пожалуйста, обратитесь в поддержку."
@@ -1270,7 +1430,7 @@ def activate_subscription(update: Update, context: CallbackContext) -> str:
     logging.debug(f"Activating subscription for user {update.effective_user.id}")
     
     # Получаем tariff_id из callback_data
-    tariff_id = int(update.callback_query.data.split(':')[1])
+    tariff_id, = callbacks.get_args(update)
     logging.debug(f"Selected tariff_id: {tariff_id}")
     
     # Получаем тариф из базы
@@ -1278,9 +1438,8 @@ def activate_subscription(update: Update, context: CallbackContext) -> str:
     logging.debug(f"Got tariff: {tariff.title}")
     
     try:
-        # Инициализируем YooKassa
-        Configuration.account_id = os.getenv('SHOP_ID')
-        Configuration.secret_key = os.getenv('YOOKASSA_TOKEN')
+        # Инициализируем YooKassa так же, как обработка вебхуков и сверка платежей
+        yookassa_webhook.configure_yookassa()
         
         # Создаем платеж
         payment = Payment.create({
@@ -1300,17 +1459,8 @@ def activate_subscription(update: Update, context: CallbackContext) -> str:
             }
         })
         
-        # Инициализируем Redis
-        env = Env()
-        env.read_env()
-        redis = Redis(
-            host=env('REDIS_HOST', 'localhost'),
-            port=env('REDIS_PORT', 6379),
-            db=env('REDIS_DB', 0),
-            password=env('REDIS_PASSWORD', None),
-            decode_responses=True
-        )
-        
+        redis = redis_pool.get_redis()
+
         # Сохраняем данные платежа в Redis
         payment_data = {
             'tariff_id': tariff_id,
@@ -1331,7 +1481,7 @@ def activate_subscription(update: Update, context: CallbackContext) -> str:
             reply_markup=InlineKeyboardMarkup([[
                 InlineKeyboardButton(
                     "Проверить оплату",
-                    callback_data=f"check_payment:{payment.id}"
+                    callback_data=callbacks.encode(buttons.CHECK_PAYMENT_CALLBACK, get_payment_key(payment.id))
                 )
             ]])
         )
@@ -1385,7 +1535,7 @@ def confirm_payment(redis: Redis, update: Update, context: CallbackContext) -> N
 @delete_prev_inline
 def edit_service_title(update: Update, context: CallbackContext) -> str:
     """Запрашивает новое название услуги"""
-    service_id = int(update.callback_query.data.split(':')[1])
+    service_id, = callbacks.get_args(update)
     
     # Сохраняем ID услуги в контексте
     context.user_data['edit_service_id'] = service_id
@@ -1430,7 +1580,7 @@ def edit_service_title_input(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def edit_service_description(update: Update, context: CallbackContext) -> str:
     """Запрашивает новое описание услуги"""
-    service_id = int(update.callback_query.data.split(':')[1])
+    service_id, = callbacks.get_args(update)
     
     # Сохраняем ID услуги в контексте
     context.user_data['edit_service_id'] = service_id
@@ -1475,7 +1625,7 @@ def edit_service_description_input(update: Update, context: CallbackContext) ->
 @delete_prev_inline
 def edit_service_price(update: Update, context: CallbackContext) -> str:
     """Запрашивает новую цену услуги"""
-    service_id = int(update.callback_query.data.split(':')[1])
+    service_id, = callbacks.get_args(update)
     
     # Сохраняем ID услуги в контексте
     context.user_data['edit_service_id'] = service_id
@@ -1533,7 +1683,7 @@ def edit_service_price_input(update: Update, context: CallbackContext) -> str:
 @delete_prev_inline
 def edit_service_category(update: Update, context: CallbackContext) -> str:
     """Запрашивает новую категорию услуги"""
-    service_id = int(update.callback_query.data.split(':')[1])
+    service_id, = callbacks.get_args(update)
     
     # Сохраняем ID услуги в контексте
     context.user_data['edit_service_id'] = service_id
@@ -1557,7 +1707,7 @@ def edit_service_category_input(update: Update, context: CallbackContext) -> str
         return contractor_services(update, context)
     
     # Получаем ID категории
-    category_id = int(update.callback_query.data.split(':')[1])
+    category_id, = callbacks.get_args(update)
     
     # Обновляем услугу
     db.update_service(service_id, category_id=category_id)
@@ -1576,7 +1726,7 @@ def edit_service_category_input(update: Update, context: CallbackContext) -> str
 @delete_prev_inline
 def edit_service_photo(update: Update, context: CallbackContext) -> str:
     """Запрашивает новое фото услуги"""
-    service_id = int(update.callback_query.data.split(':')[1])
+    service_id, = callbacks.get_args(update)
     
     # Сохраняем ID услуги в контексте
     context.user_data['edit_service_id'] = service_id
@@ -1666,216 +1816,491 @@ def cancel_edit_service(update: Update, context: CallbackContext) -> str:
     return contractor_services(update, context)
 
 
+def create_conversation_handler(redis: Redis) -> ConversationHandler:
+    """Диалог бота: состояния и их обработчики.
+
+    Нажатия inline кнопок в каждом состоянии разбирает CallbackRouter,
+    конфликты кнопок обнаруживаются при сборке, то есть на старте бота.
+    """
+    return ConversationHandler(
+        entry_points=[
+            CommandHandler('start', start),
+            MessageHandler(filters=Filters.all, callback=start),
+            CallbackQueryHandler(callback=start)
+        ],
+        states={
+            'VISITOR': [
+                CommandHandler('start', start),
+                CallbackRouter('VISITOR', [
+                    (buttons.CHECK_ACCESS_CALLBACK, check_access),
+                    (buttons.CHANGE_ROLE['callback_data'], start),
+                    (buttons.NEW_CLIENT['callback_data'], new_client),
+                    (buttons.NEW_CONTRACTOR['callback_data'], new_contractor),
+                ]),
+            ],
+            'VISITOR_PHONENUMBER': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.all, callback=enter_phone),
+            ],
+            'SUBSCRIPTION': [
+                CommandHandler('start', start),
+                CallbackRouter('SUBSCRIPTION', [
+                    (buttons.ACTIVATE_SUBSCRIPTION_CALLBACK, activate_subscription),
+                    (buttons.CANCEL['callback_data'], start),
+                ]),
+                PreCheckoutQueryHandler(partial(confirm_payment, redis)),
+                MessageHandler(Filters.successful_payment, client_main)
+            ],
+            'NEW_CONTRACTOR': [
+                CommandHandler('start', start),
+                CallbackRouter('NEW_CONTRACTOR', [
+                    (buttons.CANCEL['callback_data'], start),
+                ]),
+                MessageHandler(Filters.text, new_contractor_message)
+            ],
+            'CLIENT': [
+                CallbackRouter('CLIENT', [
+                    (buttons.CHANGE_ROLE['callback_data'], start),
+                    (buttons.NEW_REQUEST['callback_data'], new_request),
+                    (buttons.CLIENT_CURRENT_ORDERS['callback_data'], display_current_orders),
+                    (buttons.ORDER['callback_data'], display_order),
+                    (buttons.ORDER_COMMENT['callback_data'], partial(add_order_comment, redis)),
+                    (buttons.ORDER_COMPLAINT['callback_data'], partial(add_order_complaint, redis)),
+                    (buttons.CONTRACTOR_CONTACTS['callback_data'], send_contractor_contact),
+                    (buttons.NEW_CONTRACTOR['callback_data'], new_contractor),
+                    (buttons.CANCEL['callback_data'], client_main),
+                    (buttons.BACK_TO_CLIENT_MAIN['callback_data'], client_main),
+                    (buttons.ACTIVATE_SUBSCRIPTION_CALLBACK, activate_subscription),
+                    (buttons.SELECT_CATEGORY['callback_data'], select_category),
+                    (buttons.SEARCH_SERVICES['callback_data'], ask_search_query),
+                    (buttons.MY_CART['callback_data'], show_cart),
+                ]),
+                CommandHandler('start', start),
+                CommandHandler('search', search_command),
+            ],
+            'CLIENT_SEARCH': [
+                CommandHandler('start', start),
+                CommandHandler('search', search_command),
+                MessageHandler(filters=Filters.text & ~Filters.command, callback=enter_search_query),
+                CallbackRouter('CLIENT_SEARCH', [
+                    (buttons.CANCEL['callback_data'], client_main),
+                ]),
+            ],
+            'CLIENT_SELECT_CATEGORY': [
+                CommandHandler('start', start),
+                CallbackRouter('CLIENT_SELECT_CATEGORY', [
+                    (buttons.CATEGORY_CALLBACK, show_category_services),
+                    (buttons.CANCEL['callback_data'], client_main),
+                ]),
+            ],
+            'CLIENT_BROWSE_SERVICES': [
+                CommandHandler('start', start),
+                CallbackRouter('CLIENT_BROWSE_SERVICES', [
+                    (buttons.SERVICE_CALLBACK, show_service_details),
+                    (buttons.SERVICES_PAGE_CALLBACK, show_services_page),
+                    (buttons.SEARCH_PAGE_CALLBACK, show_search_page),
+                    (buttons.BACK_TO_CLIENT_MAIN['callback_data'], client_main),
+                    (buttons.MY_CART['callback_data'], show_cart),
+                ]),
+                CommandHandler('search', search_command),
+            ],
+            'CLIENT_SERVICE_DETAILS': [
+                CommandHandler('start', start),
+                CallbackRouter('CLIENT_SERVICE_DETAILS', [
+                    (buttons.ADD_TO_CART_CALLBACK, add_to_cart),
+                    (buttons.BACK_TO_CLIENT_MAIN['callback_data'], client_main),
+                    (buttons.MY_CART['callback_data'], show_cart),
+                ]),
+            ],
+            'CLIENT_CART': [
+                CommandHandler('start', start),
+                CallbackRouter('CLIENT_CART', [
+                    (buttons.REMOVE_FROM_CART_CALLBACK, remove_from_cart),
+                    (buttons.CLEAR_CART['callback_data'], clear_cart),
+                    (buttons.CHECKOUT['callback_data'], checkout),
+                    (buttons.BACK_TO_CLIENT_MAIN['callback_data'], client_main),
+                ]),
+            ],
+            'CLIENT_NEW_REQUEST': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.text, callback=client_request_description),
+                CallbackRouter('CLIENT_NEW_REQUEST', [
+                    (buttons.CANCEL['callback_data'], client_main),
+                ]),
+            ],
+            'CLIENT_NEW_COMMENT': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.text, callback=partial(client_comment_description, redis)),
+                CallbackRouter('CLIENT_NEW_COMMENT', [
+                    (buttons.CANCEL['callback_data'], client_main),
+                ]),
+            ],
+            'CLIENT_NEW_COMPLAINT': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.text, callback=partial(client_complaint_description, redis)),
+                CallbackRouter('CLIENT_NEW_COMPLAINT', [
+                    (buttons.CANCEL['callback_data'], client_main),
+                ]),
+            ],
+            'CONTRACTOR': [
+                CommandHandler('start', start),
+                CallbackRouter('CONTRACTOR', [
+                    (buttons.CHANGE_ROLE['callback_data'], start),
+                    (buttons.CONTRACTOR_AVAILABLE_ORDERS['callback_data'], contractor_display_orders),
+                    (buttons.CURRENT_ORDER['callback_data'], contractor_display_order),
+                    (buttons.AVAILABLE_ORDER['callback_data'], contractor_display_order),
+                    (buttons.TAKE_ORDER['callback_data'], contractor_take_order),
+                    (buttons.FINISH_ORDER['callback_data'], contractor_finish_order),
+                    (buttons.CONTRACTOR_SET_ESTIMATE_DATETIME['callback_data'], partial(contractor_set_estimate_datetime, redis)),
+                    (buttons.CONTRACTOR_SALARY['callback_data'], contractor_display_salary),
+                    (buttons.BACK_TO_CONTRACTOR_MAIN['callback_data'], contractor_main),
+                    (buttons.MY_SERVICES['callback_data'], contractor_services),
+                    (buttons.ADD_SERVICE['callback_data'], add_service_start),
+                    (buttons.EDIT_SERVICE_CALLBACK, edit_service),
+                    (buttons.DELETE_SERVICE_CALLBACK, delete_service_confirm),
+                    (buttons.SWITCH_TO_CLIENT['callback_data'], switch_to_client),
+                ]),
+            ],
+            'CONTRACTOR_SERVICES': [
+                CommandHandler('start', start),
+                CallbackRouter('CONTRACTOR_SERVICES', [
+                    (buttons.CONTRACTOR_SERVICES_PAGE_CALLBACK, contractor_services_page),
+                    (buttons.ADD_SERVICE['callback_data'], add_service_start),
+                    (buttons.EDIT_SERVICE_CALLBACK, edit_service),
+                    (buttons.BACK_TO_CONTRACTOR_MAIN['callback_data'], contractor_main),
+                ]),
+            ],
+            'CONTRACTOR_ADD_SERVICE_TITLE': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.text, callback=add_service_title),
+                CallbackRouter('CONTRACTOR_ADD_SERVICE_TITLE', [
+                    (buttons.CANCEL['callback_data'], contractor_services),
+                ]),
+            ],
+            'CONTRACTOR_ADD_SERVICE_DESCRIPTION': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.text, callback=add_service_description),
+                CallbackRouter('CONTRACTOR_ADD_SERVICE_DESCRIPTION', [
+                    (buttons.CANCEL['callback_data'], contractor_services),
+                ]),
+            ],
+            'CONTRACTOR_ADD_SERVICE_PRICE': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.text, callback=add_service_price),
+                CallbackRouter('CONTRACTOR_ADD_SERVICE_PRICE', [
+                    (buttons.CANCEL['callback_data'], contractor_services),
+                ]),
+            ],
+            'CONTRACTOR_ADD_SERVICE_CATEGORY': [
+                CommandHandler('start', start),
+                CallbackRouter('CONTRACTOR_ADD_SERVICE_CATEGORY', [
+                    (buttons.CATEGORY_CALLBACK, add_service_category),
+                    (buttons.CANCEL['callback_data'], contractor_services),
+                ]),
+            ],
+            'CONTRACTOR_ADD_SERVICE_PHOTO': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.photo, callback=add_service_photo),
+                CallbackRouter('CONTRACTOR_ADD_SERVICE_PHOTO', [
+                    ('skip_photo', skip_photo),
+                    (buttons.CANCEL['callback_data'], contractor_services),
+                ]),
+            ],
+            'CONTRACTOR_EDIT_SERVICE': [
+                CommandHandler('start', start),
+                CallbackRouter('CONTRACTOR_EDIT_SERVICE', [
+                    (buttons.MY_SERVICES['callback_data'], contractor_services),
+                    (buttons.DELETE_SERVICE_CALLBACK, delete_service_confirm),
+                    (buttons.EDIT_SERVICE_TITLE_CALLBACK, edit_service_title),
+                    (buttons.EDIT_SERVICE_DESCRIPTION_CALLBACK, edit_service_description),
+                    (buttons.EDIT_SERVICE_PRICE_CALLBACK, edit_service_price),
+                    (buttons.EDIT_SERVICE_CATEGORY_CALLBACK, edit_service_category),
+                    (buttons.EDIT_SERVICE_PHOTO_CALLBACK, edit_service_photo),
+                    ('cancel_edit_service', cancel_edit_service),
+                ]),
+            ],
+            'CONTRACTOR_EDIT_SERVICE_TITLE': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.text, callback=edit_service_title_input),
+                CallbackRouter('CONTRACTOR_EDIT_SERVICE_TITLE', [
+                    ('cancel_edit_service', cancel_edit_service),
+                ]),
+            ],
+            'CONTRACTOR_EDIT_SERVICE_DESCRIPTION': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.text, callback=edit_service_description_input),
+                CallbackRouter('CONTRACTOR_EDIT_SERVICE_DESCRIPTION', [
+                    ('cancel_edit_service', cancel_edit_service),
+                ]),
+            ],
+            'CONTRACTOR_EDIT_SERVICE_PRICE': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.text, callback=edit_service_price_input),
+                CallbackRouter('CONTRACTOR_EDIT_SERVICE_PRICE', [
+                    ('cancel_edit_service', cancel_edit_service),
+                ]),
+            ],
+            'CONTRACTOR_EDIT_SERVICE_CATEGORY': [
+                CommandHandler('start', start),
+                CallbackRouter('CONTRACTOR_EDIT_SERVICE_CATEGORY', [
+                    (buttons.CATEGORY_CALLBACK, edit_service_category_input),
+                    ('cancel_edit_service', cancel_edit_service),
+                ]),
+            ],
+            'CONTRACTOR_EDIT_SERVICE_PHOTO': [
+                CommandHandler('start', start),
+                MessageHandler(filters=Filters.photo, callback=edit_service_photo_input),
+                CallbackRouter('CONTRACTOR_EDIT_SERVICE_PHOTO', [
+                    ('delete_service_photo', delete_service_photo),
+                    ('cancel_edit_service', cancel_edit_service),
+                ]),
+            ],
+            'CONTRACTOR_DELETE_SERVICE': [
+                CommandHandler('start', start),
+                CallbackRouter('CONTRACTOR_DELETE_SERVICE', [
+                    ('confirm_delete_service', confirm_delete_service),
+                    ('cancel_delete_service', cancel_delete_service),
+                ]),
+            ],
+            'CONTACTOR_SET_ESTIMATE_DATETIME': [
+                CommandHandler('start', start),
+                CallbackRouter('CONTACTOR_SET_ESTIMATE_DATETIME', [
+                    (buttons.BACK_TO_CONTRACTOR_MAIN['callback_data'], contractor_main),
+                ]),
+                MessageHandler(filters=Filters.text, callback=partial(contractor_enter_estimate_datetime, redis)),
+            ],
+        },
+        fallbacks=[],
+        name='main',
+        persistent=True,
+    )
+
+
+def setup_dispatcher(dispatcher: Dispatcher, redis: Redis) -> None:
+    """Регистрирует обработчики бота, общие для polling и webhook режимов"""
+    dispatcher.add_handler(TypeHandler(Update, track_last_update), group=-1)
+    dispatcher.add_handler(create_conversation_handler(redis))
+    dispatcher.add_handler(PreCheckoutQueryHandler(partial(confirm_payment, redis)))
+    dispatcher.add_handler(InlineQueryHandler(inline_search))
+
+    # Добавляем обработчик проверки оплаты
+    dispatcher.add_handler(CallbackQueryHandler(
+        check_payment_status,
+        pattern=rf'^{buttons.CHECK_PAYMENT_CALLBACK}[.:]'
+    ))
+
+
+def create_dispatcher(token: str,
+                      workers: int = 0,
+                      persistence: BasePersistence = None,
+                      request: Request = None,
+                      outbound_queue: outbox.OutboundQueue = None) -> Dispatcher:
+    """Создает диспетчер бота.
+
+    При workers > 0 обновления разных чатов обрабатываются параллельно
+    в пуле потоков, а обновления одного чата — строго по порядку.
+    С persistence состояния диалогов и user_data хранятся в Redis
+    и переживают перезапуск. request и outbound_queue подменяют
+    запросы к Bot API и очередь исходящих, например в webhook_bench.
+    """
+    bot = QueuedBot(
+        token=token,
+        request=request or Request(con_pool_size=max(workers, 4) + outbox.SEND_WORKERS + 4),
+        outbox=outbound_queue or outbox.get_outbox()
+    )
+    job_queue = JobQueue()
+    if workers:
+        dispatcher = ChatOrderedDispatcher(
+            bot,
+            Queue(),
+            job_queue=job_queue,
+            persistence=persistence,
+            use_context=True,
+            executor=ChatOrderedExecutor(workers=workers)
+        )
+    else:
+        dispatcher = Dispatcher(
+            bot,
+            Queue(),
+            job_queue=job_queue,
+            persistence=persistence,
+            use_context=True
+        )
+    job_queue.set_dispatcher(dispatcher)
+    return dispatcher
+
+
+def log_metrics(context: CallbackContext) -> None:
+    if isinstance(context.dispatcher, ChatOrderedDispatcher):
+        logger.info(f'Chat executor: {context.dispatcher.executor.stats()}')
+    logger.info(f'Outbound queue: {outbox.get_outbox().stats()}')
+    if notifications.notifier is not None:
+        logger.info(f'Manager notifications: {notifications.notifier.stats()}')
+    logger.info(f'Redis pool: {redis_pool.pool_stats()}')
+    logger.info(f'Service search: {search.get_stats()}')
+    logger.info(f'Payment reconciliation: {payment_reconciler.get_stats()}')
+
+
+def run_report_jobs(context: CallbackContext) -> None:
+    reports.run_pending_jobs(bot=context.bot)
+
+
+def run_payment_events(context: CallbackContext) -> None:
+    yookassa_webhook.process_pending_events(bot=context.bot)
+
+
+def run_payment_reconciliation(context: CallbackContext) -> None:
+    payment_reconciler.reconcile_payments(bot=context.bot)
+
+
+def schedule_jobs(job_queue: JobQueue, metrics_interval: int) -> None:
+    """Фоновые задачи бота. Должны работать в одном процессе на развертывание,
+    см. runbot --jobs-only и TELEGRAM_WEBHOOK_JOBS"""
+    job_queue.run_repeating(log_metrics, interval=metrics_interval)
+    job_queue.run_repeating(run_report_jobs, interval=REPORT_JOBS_INTERVAL)
+    job_queue.run_repeating(run_payment_events, interval=PAYMENT_EVENTS_INTERVAL)
+    job_queue.run_repeating(run_payment_reconciliation, interval=PAYMENT_RECONCILE_INTERVAL)
+
+
+def create_webhook_dispatcher(token: str,
+                              redis: Redis,
+                              workers: int = 0,
+                              metrics_interval: int = 60,
+                              run_jobs: bool = False) -> Dispatcher:
+    """Создает диспетчер для приема обновлений через webhook внутри Django.
+
+    Диспетчер создается в каждом процессе Django, поэтому фоновые задачи
+    по умолчанию не запускаются: их выполняет отдельный runbot --jobs-only.
+    """
+    dispatcher = create_dispatcher(
+        token=token,
+        workers=workers,
+        persistence=RedisPersistence(redis)
+    )
+    setup_dispatcher(dispatcher, redis)
+    if run_jobs:
+        schedule_jobs(dispatcher.job_queue, metrics_interval)
+
+    Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+    dispatcher.job_queue.start()
+    return dispatcher
+
+
+def get_webhook_path(token: str) -> str:
+    return f'webhook/telegram/{token}/'
+
+
 class Command(BaseCommand):
     help = "Start Telegram bot"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--webhook',
+            action='store_true',
+            help='Получать обновления через webhook вместо long polling'
+        )
+        parser.add_argument(
+            '--webhook-url',
+            help='Публичный адрес сервера, например https://bot.example.com '
+                 '(по умолчанию TELEGRAM_WEBHOOK_URL)'
+        )
+        parser.add_argument(
+            '--listen',
+            default='0.0.0.0',
+            help='Адрес встроенного webhook сервера'
+        )
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8443,
+            help='Порт встроенного webhook сервера'
+        )
+        parser.add_argument(
+            '--register-only',
+            action='store_true',
+            help='Только зарегистрировать webhook, который обслуживает Django (osminog/urls.py)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Размер пула обработчиков; обновления одного чата выполняются по порядку '
+                 '(по умолчанию TELEGRAM_WORKERS, 0 — последовательная обработка)'
+        )
+        parser.add_argument(
+            '--jobs-only',
+            action='store_true',
+            help='Выполнять только фоновые задачи (отчеты, платежи, метрики), не получая обновления'
+        )
+        parser.add_argument(
+            '--no-jobs',
+            action='store_true',
+            help='Не запускать фоновые задачи, если их выполняет другой процесс (runbot --jobs-only)'
+        )
+        parser.add_argument(
+            '--metrics-interval',
+            type=int,
+            default=60,
+            help='Период вывода метрик в лог, секунд'
+        )
+
+    def handle(self, *args, **options):
 
         env = Env()
         env.read_env()
 
-        updater = Updater(token=env.str('TELEGRAM_BOT_TOKEN'), use_context=True)
-        redis = Redis(
-            host=env.str('REDIS_HOST', 'localhost'),
-            port=env.int('REDIS_PORT', 6379),
-            db=env.int('REDIS_DB', 0),
-            password=env.str('REDIS_PASSWORD', None),
-            decode_responses=True
+        token = env.str('TELEGRAM_BOT_TOKEN')
+        workers = options['workers']
+        if workers is None:
+            workers = env.int('TELEGRAM_WORKERS', 0)
+        if options['jobs_only'] and options['no_jobs']:
+            raise CommandError('--jobs-only и --no-jobs несовместимы')
+        if options['jobs_only']:
+            return self.run_jobs_only(token, options['metrics_interval'])
+
+        redis = redis_pool.get_redis()
+        updater = Updater(
+            dispatcher=create_dispatcher(
+                token=token,
+                workers=workers,
+                persistence=RedisPersistence(redis)
+            ),
+            workers=None
         )
 
-        updater.dispatcher.add_handler(
-            ConversationHandler(
-                entry_points=[
-                    CommandHandler('start', start),
-                    MessageHandler(filters=Filters.all, callback=start),
-                    CallbackQueryHandler(callback=start)
-                ],
-                states={
-                    'VISITOR': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(check_access, pattern=buttons.CHECK_ACCESS_CALLBACK),
-                        CallbackQueryHandler(start, pattern=buttons.CHANGE_ROLE['callback_data']),
-                        CallbackQueryHandler(new_client, pattern=buttons.NEW_CLIENT['callback_data']),
-                        CallbackQueryHandler(new_contractor, pattern=buttons.NEW_CONTRACTOR['callback_data']),
-                    ],
-                    'VISITOR_PHONENUMBER': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.all, callback=enter_phone),
-                    ],
-                    'SUBSCRIPTION': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(activate_subscription, pattern='activate_subscription'),
-                        CallbackQueryHandler(start, pattern=buttons.CANCEL['callback_data']),
-                        PreCheckoutQueryHandler(confirm_payment),
-                        MessageHandler(Filters.successful_payment, client_main)
-                    ],
-                    'NEW_CONTRACTOR': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(start, pattern=buttons.CANCEL['callback_data']),
-                        MessageHandler(Filters.text, new_contractor_message)
-                    ],
-                    'CLIENT': [
-                        CallbackQueryHandler(start, pattern=buttons.CHANGE_ROLE['callback_data']),
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(new_request, pattern=buttons.NEW_REQUEST['callback_data']),
-                        CallbackQueryHandler(display_current_orders, pattern=buttons.CLIENT_CURRENT_ORDERS['callback_data']),
-                        CallbackQueryHandler(display_order, pattern=buttons.ORDER['callback_data']),
-                        CallbackQueryHandler(add_order_comment, pattern=buttons.ORDER_COMMENT['callback_data']),
-                        CallbackQueryHandler(add_order_complaint, pattern=buttons.ORDER_COMPLAINT['callback_data']),
-                        CallbackQueryHandler(send_contractor_contact, pattern=buttons.CONTRACTOR_CONTACTS['callback_data']),
-                        CallbackQueryHandler(new_contractor, pattern=buttons.NEW_CONTRACTOR['callback_data']),
-                        CallbackQueryHandler(client_main, pattern=buttons.CANCEL['callback_data']),
-                        CallbackQueryHandler(client_main, pattern=buttons.BACK_TO_CLIENT_MAIN['callback_data']),
-                        CallbackQueryHandler(activate_subscription, pattern='activate_subscription'),
-                        CallbackQueryHandler(select_category, pattern=buttons.SELECT_CATEGORY['callback_data']),
-                        CallbackQueryHandler(show_cart, pattern=buttons.MY_CART['callback_data']),
-                    ],
-                    'CLIENT_SELECT_CATEGORY': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(show_category_services, pattern=f"^{buttons.CATEGORY_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(client_main, pattern=buttons.CANCEL['callback_data']),
-                    ],
-                    'CLIENT_BROWSE_SERVICES': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(show_service_details, pattern=f"^{buttons.SERVICE_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(client_main, pattern=buttons.BACK_TO_CLIENT_MAIN['callback_data']),
-                        CallbackQueryHandler(show_cart, pattern=buttons.MY_CART['callback_data']),
-                    ],
-                    'CLIENT_SERVICE_DETAILS': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(add_to_cart, pattern=f"^{buttons.ADD_TO_CART_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(client_main, pattern=buttons.BACK_TO_CLIENT_MAIN['callback_data']),
-                        CallbackQueryHandler(show_cart, pattern=buttons.MY_CART['callback_data']),
-                    ],
-                    'CLIENT_CART': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(remove_from_cart, pattern=f"^{buttons.REMOVE_FROM_CART_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(clear_cart, pattern=buttons.CLEAR_CART['callback_data']),
-                        CallbackQueryHandler(checkout, pattern=buttons.CHECKOUT['callback_data']),
-                        CallbackQueryHandler(client_main, pattern=buttons.BACK_TO_CLIENT_MAIN['callback_data']),
-                    ],
-                    'CLIENT_NEW_REQUEST': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.text, callback=client_request_description),
-                        CallbackQueryHandler(client_main, pattern=buttons.CANCEL['callback_data']),
-                    ],
-                    'CLIENT_NEW_COMMENT': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.text, callback=client_comment_description),
-                        CallbackQueryHandler(client_main, pattern=buttons.CANCEL['callback_data']),
-                    ],
-                    'CLIENT_NEW_COMPLAINT': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.text, callback=client_complaint_description),
-                        CallbackQueryHandler(client_main, pattern=buttons.CANCEL['callback_data']),
-                    ],
-                    'CONTRACTOR': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(start, pattern=buttons.CHANGE_ROLE['callback_data']),
-                        CallbackQueryHandler(contractor_display_orders, pattern=buttons.CONTRACTOR_AVAILABLE_ORDERS['callback_data']),
-                        CallbackQueryHandler(contractor_display_order, pattern=buttons.CURRENT_ORDER['callback_data']),
-                        CallbackQueryHandler(contractor_take_order, pattern=buttons.TAKE_ORDER['callback_data']),
-                        CallbackQueryHandler(contractor_finish_order, pattern=buttons.FINISH_ORDER['callback_data']),
-                        CallbackQueryHandler(contractor_set_estimate_datetime, pattern=buttons.CONTRACTOR_SET_ESTIMATE_DATETIME['callback_data']),
-                        CallbackQueryHandler(contractor_display_salary, pattern=buttons.CONTRACTOR_SALARY['callback_data']),
-                        CallbackQueryHandler(contractor_main, pattern=buttons.BACK_TO_CONTRACTOR_MAIN['callback_data']),
-                        CallbackQueryHandler(contractor_services, pattern=buttons.MY_SERVICES['callback_data']),
-                        CallbackQueryHandler(add_service_start, pattern=buttons.ADD_SERVICE['callback_data']),
-                        CallbackQueryHandler(edit_service, pattern=f"^{buttons.EDIT_SERVICE_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(delete_service_confirm, pattern=f"^{buttons.DELETE_SERVICE_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(switch_to_client, pattern=buttons.SWITCH_TO_CLIENT['callback_data']),
-                    ],
-                    'CONTRACTOR_SERVICES': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(add_service_start, pattern=buttons.ADD_SERVICE['callback_data']),
-                        CallbackQueryHandler(edit_service, pattern=f"^{buttons.EDIT_SERVICE_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(contractor_main, pattern=buttons.BACK_TO_CONTRACTOR_MAIN['callback_data']),
-                    ],
-                    'CONTRACTOR_ADD_SERVICE_TITLE': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.text, callback=add_service_title),
-                        CallbackQueryHandler(contractor_services, pattern=buttons.CANCEL['callback_data']),
-                    ],
-                    'CONTRACTOR_ADD_SERVICE_DESCRIPTION': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.text, callback=add_service_description),
-                        CallbackQueryHandler(contractor_services, pattern=buttons.CANCEL['callback_data']),
-                    ],
-                    'CONTRACTOR_ADD_SERVICE_PRICE': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.text, callback=add_service_price),
-                        CallbackQueryHandler(contractor_services, pattern=buttons.CANCEL['callback_data']),
-                    ],
-                    'CONTRACTOR_ADD_SERVICE_CATEGORY': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(add_service_category, pattern=f"^{buttons.CATEGORY_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(contractor_services, pattern=buttons.CANCEL['callback_data']),
-                    ],
-                    'CONTRACTOR_ADD_SERVICE_PHOTO': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.photo, callback=add_service_photo),
-                        CallbackQueryHandler(skip_photo, pattern="skip_photo"),
-                        CallbackQueryHandler(contractor_services, pattern=buttons.CANCEL['callback_data']),
-                    ],
-                    'CONTRACTOR_EDIT_SERVICE': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(contractor_services, pattern=buttons.MY_SERVICES['callback_data']),
-                        CallbackQueryHandler(delete_service_confirm, pattern=f"^{buttons.DELETE_SERVICE_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(edit_service_title, pattern=f"^edit_service_title:"),
-                        CallbackQueryHandler(edit_service_description, pattern=f"^edit_service_description:"),
-                        CallbackQueryHandler(edit_service_price, pattern=f"^edit_service_price:"),
-                        CallbackQueryHandler(edit_service_category, pattern=f"^edit_service_category:"),
-                        CallbackQueryHandler(edit_service_photo, pattern=f"^edit_service_photo:"),
-                        CallbackQueryHandler(cancel_edit_service, pattern="cancel_edit_service"),
-                    ],
-                    'CONTRACTOR_EDIT_SERVICE_TITLE': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.text, callback=edit_service_title_input),
-                        CallbackQueryHandler(cancel_edit_service, pattern="cancel_edit_service"),
-                    ],
-                    'CONTRACTOR_EDIT_SERVICE_DESCRIPTION': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.text, callback=edit_service_description_input),
-                        CallbackQueryHandler(cancel_edit_service, pattern="cancel_edit_service"),
-                    ],
-                    'CONTRACTOR_EDIT_SERVICE_PRICE': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.text, callback=edit_service_price_input),
-                        CallbackQueryHandler(cancel_edit_service, pattern="cancel_edit_service"),
-                    ],
-                    'CONTRACTOR_EDIT_SERVICE_CATEGORY': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(edit_service_category_input, pattern=f"^{buttons.CATEGORY_CALLBACK.split(':')[0]}:"),
-                        CallbackQueryHandler(cancel_edit_service, pattern="cancel_edit_service"),
-                    ],
-                    'CONTRACTOR_EDIT_SERVICE_PHOTO': [
-                        CommandHandler('start', start),
-                        MessageHandler(filters=Filters.photo, callback=edit_service_photo_input),
-                        CallbackQueryHandler(delete_service_photo, pattern="delete_service_photo"),
-                        CallbackQueryHandler(cancel_edit_service, pattern="cancel_edit_service"),
-                    ],
-                    'CONTRACTOR_DELETE_SERVICE': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(confirm_delete_service, pattern="confirm_delete_service"),
-                        CallbackQueryHandler(cancel_delete_service, pattern="cancel_delete_service"),
-                    ],
-                    'CONTACTOR_SET_ESTIMATE_DATETIME': [
-                        CommandHandler('start', start),
-                        CallbackQueryHandler(contractor_main, pattern=buttons.BACK_TO_CONTRACTOR_MAIN['callback_data']),
-                        MessageHandler(filters=Filters.text, callback=contractor_enter_estimate_datetime),
-                    ],
-                },
-                fallbacks=[],
-            )
+        setup_dispatcher(updater.dispatcher, redis)
+        if not options['no_jobs']:
+            schedule_jobs(updater.job_queue, options['metrics_interval'])
+
+        if not options['webhook']:
+            updater.start_polling()
+            updater.idle()
+            return
+
+        webhook_url = options['webhook_url'] or env.str('TELEGRAM_WEBHOOK_URL', None)
+        if not webhook_url:
+            raise CommandError('Не указан адрес webhook: --webhook-url или TELEGRAM_WEBHOOK_URL')
+        webhook_url = f'{webhook_url.rstrip("/")}/{get_webhook_path(token)}'
+
+        if options['register_only']:
+            updater.bot.set_webhook(url=webhook_url)
+            logger.info(f'Webhook registered: {webhook_url}')
+            return
+
+        updater.start_webhook(
+            listen=options['listen'],
+            port=options['port'],
+            url_path=get_webhook_path(token),
+            webhook_url=webhook_url
         )
-
-        updater.dispatcher.add_handler(PreCheckoutQueryHandler(confirm_payment))
-
-        # Добавляем обработчик проверки оплаты
-        updater.dispatcher.add_handler(CallbackQueryHandler(
-            check_payment_status,
-            pattern=r'^check_payment:.*$'
-        ))
-
-        updater.start_polling()
-        updater.idle()
\ No newline at end of file
+        updater.idle()
+
+    def run_jobs_only(self, token: str, metrics_interval: int) -> None:
+        """Единственный на развертывание процесс фоновых задач"""
+        dispatcher = create_dispatcher(token=token)
+        schedule_jobs(dispatcher.job_queue, metrics_interval)
+        dispatcher.job_queue.start()
+        logger.info('Background jobs started, updates are not received by this process')
+        try:
+            Event().wait()
+        except KeyboardInterrupt:
+            dispatcher.job_queue.stop()
@@ -0,0 +1,96 @@
+import re
+
+from collections import Counter
+from typing import Optional
+
+from more_itertools import chunked
+from redis import Redis
+
+from main.management.commands.persistence import CONVERSATION_TTL
+
+SCRATCH_PREFIX = 'scratch'
+
+# Пространства имен временных значений диалогов
+ORDER_ID = 'order_id'
+CONTRACTOR_ORDER_ID = 'contractor_order_id'
+
+# Сколько ждать продолжения брошенного диалога, секунд.
+# Не меньше, чем хранится состояние диалога, иначе диалог переживет свои данные
+SCRATCH_TTL = CONVERSATION_TTL
+
+# Ключи до введения пространств имен: {chat_id}_order_id и {chat_id}_contractor_order_id.
+# Шаблон SCAN шире нужного, поэтому ключи дополнительно сверяются с LEGACY_KEY_RE
+LEGACY_PATTERN = '*_order_id'
+LEGACY_KEY_RE = re.compile(r'-?\d+_(?:contractor_)?order_id')
+
+SCAN_BATCH_SIZE = 1000
+
+
+def get_key(namespace: str, chat_id: int) -> str:
+    return f'{SCRATCH_PREFIX}:{namespace}:{chat_id}'
+
+
+def set_value(redis: Redis, namespace: str, chat_id: int, value: str, ttl: int = SCRATCH_TTL) -> None:
+    if not ttl or ttl <= 0:
+        raise ValueError('Временное значение должно иметь положительный TTL')
+    redis.set(get_key(namespace, chat_id), value, ex=ttl)
+
+
+def get_value(redis: Redis, namespace: str, chat_id: int) -> Optional[str]:
+    return redis.get(get_key(namespace, chat_id))
+
+
+def pop_value(redis: Redis, namespace: str, chat_id: int) -> Optional[str]:
+    """Возвращает значение и удаляет ключ за один запрос к Redis"""
+    key = get_key(namespace, chat_id)
+    with redis.pipeline() as pipeline:
+        value, _ = pipeline.get(key).delete(key).execute()
+    return value
+
+
+def iter_ttls(redis: Redis, pattern: str):
+    """Перебирает ключи по шаблону вместе с их TTL, запрашивая TTL пачками"""
+    keys = redis.scan_iter(match=pattern, count=SCAN_BATCH_SIZE)
+    for batch in chunked(keys, SCAN_BATCH_SIZE):
+        with redis.pipeline(transaction=False) as pipeline:
+            for key in batch:
+                pipeline.ttl(key)
+            yield from zip(batch, pipeline.execute())
+
+
+def iter_legacy_keys(redis: Redis):
+    """Ключи старого формата, без посторонних ключей, оканчивающихся на _order_id"""
+    for key in redis.scan_iter(match=LEGACY_PATTERN, count=SCAN_BATCH_SIZE):
+        if LEGACY_KEY_RE.fullmatch(key):
+            yield key
+
+
+def get_stats(redis: Redis) -> dict:
+    namespaces = Counter()
+    without_ttl = 0
+    for key, ttl in iter_ttls(redis, f'{SCRATCH_PREFIX}:*'):
+        namespaces[key.split(':')[1]] += 1
+        without_ttl += ttl == -1
+    legacy = sum(1 for _ in iter_legacy_keys(redis))
+    return {
+        'namespaces': dict(namespaces),
+        'total': sum(namespaces.values()),
+        'without_ttl': without_ttl,
+        'legacy': legacy,
+    }
+
+
+def sweep(redis: Redis, ttl: int = SCRATCH_TTL) -> tuple[int, int]:
+    """Ставит TTL временным ключам без него и удаляет ключи старого формата.
+
+    Возвращает число исправленных и удаленных ключей.
+    """
+    fixed = [key for key, key_ttl in iter_ttls(redis, f'{SCRATCH_PREFIX}:*') if key_ttl == -1]
+    legacy = list(iter_legacy_keys(redis))
+    with redis.pipeline(transaction=False) as pipeline:
+        for key in fixed:
+            pipeline.expire(key, ttl)
+        for batch in chunked(legacy, SCAN_BATCH_SIZE):
+            pipeline.delete(*batch)
+        pipeline.execute()
+    return len(fixed), len(legacy)
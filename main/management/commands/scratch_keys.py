@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+import main.management.commands.redis_pool as redis_pool
+import main.management.commands.scratch as scratch
+
+
+class Command(BaseCommand):
+    help = "Статистика временных ключей диалогов в Redis и очистка ключей без TTL"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sweep',
+            action='store_true',
+            help='Поставить TTL ключам без него и удалить ключи старого формата'
+        )
+        parser.add_argument(
+            '--ttl',
+            type=int,
+            default=scratch.SCRATCH_TTL,
+            help='TTL для ключей без него, секунд'
+        )
+
+    def handle(self, *args, **options):
+        redis = redis_pool.get_redis()
+        if options['sweep']:
+            fixed, deleted = scratch.sweep(redis, ttl=options['ttl'])
+            self.stdout.write(f'TTL выставлен: {fixed}, удалено ключей старого формата: {deleted}')
+
+        stats = scratch.get_stats(redis)
+        self.stdout.write(
+            f'Временных ключей: {stats["total"]}, без TTL: {stats["without_ttl"]}, '
+            f'старого формата: {stats["legacy"]}'
+        )
+        for namespace, count in sorted(stats['namespaces'].items()):
+            self.stdout.write(f'  {namespace}: {count}')
@@ -0,0 +1,144 @@
+import re
+
+from abc import ABC, abstractmethod
+from collections import deque
+from threading import Lock
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, When
+from django.utils.module_loading import import_string
+
+from main import models as main_models
+
+SEARCH_PAGE_SIZE = 10
+# Сколько секунд Telegram может отдавать inline-выдачу из своего кэша
+INLINE_CACHE_TIME = 60
+FTS_TABLE = 'main_service_search'
+# Вес совпадения в названии относительно описания
+TITLE_WEIGHT = 10.0
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def get_words(query: str) -> list[str]:
+    return WORD_PATTERN.findall(query)[:10]
+
+
+class SearchBackend(ABC):
+    """Поисковый индекс услуг. Возвращает id активных услуг в порядке релевантности"""
+
+    @abstractmethod
+    def search(self, query: str, limit: int, offset: int = 0) -> list[int]:
+        ...
+
+    def index(self, service: main_models.Service) -> None:
+        pass
+
+    def remove(self, service_id: int) -> None:
+        pass
+
+    def rebuild(self) -> None:
+        pass
+
+
+class LikeSearchBackend(SearchBackend):
+    """Поиск без отдельного индекса для любых БД: совпадения в названии выше"""
+
+    def search(self, query: str, limit: int, offset: int = 0) -> list[int]:
+        words = get_words(query)
+        if not words:
+            return []
+        matches = Q()
+        title_matches = Q()
+        for word in words:
+            matches &= Q(title__icontains=word) | Q(description__icontains=word)
+            title_matches &= Q(title__icontains=word)
+        services = main_models.Service.objects.filter(matches, is_active=True) \
+            .annotate(title_rank=Case(When(title_matches, then=0), default=1, output_field=IntegerField())) \
+            .order_by('title_rank', 'id') \
+            .values_list('id', flat=True)
+        return list(services[offset:offset + limit])
+
+
+class SqliteFtsSearchBackend(SearchBackend):
+    """Полнотекстовый индекс SQLite FTS5, таблица создается миграцией"""
+
+    def search(self, query: str, limit: int, offset: int = 0) -> list[int]:
+        words = get_words(query)
+        if not words:
+            return []
+        # Каждое слово ищем по префиксу: «логот» найдет «логотип»
+        match = ' '.join(f'"{word}"*' for word in words)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {TITLE_WEIGHT}, 1.0) LIMIT %s OFFSET %s',
+                [match, limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index(self, service: main_models.Service) -> None:
+        self.remove(service.id)
+        if not service.is_active:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (%s, %s, %s)',
+                [service.id, service.title, service.description]
+            )
+
+    def remove(self, service_id: int) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [service_id])
+
+    def rebuild(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description) '
+                f'SELECT id, title, description FROM main_service WHERE is_active'
+            )
+
+
+search_backend = None
+search_backend_lock = Lock()
+latencies = deque(maxlen=1000)
+
+
+def get_search_backend() -> SearchBackend:
+    """Бэкенд из SERVICE_SEARCH_BACKEND, по умолчанию FTS5 для SQLite"""
+    global search_backend
+    with search_backend_lock:
+        if search_backend is None:
+            if settings.SERVICE_SEARCH_BACKEND:
+                search_backend = import_string(settings.SERVICE_SEARCH_BACKEND)()
+            elif connection.vendor == 'sqlite':
+                search_backend = SqliteFtsSearchBackend()
+            else:
+                search_backend = LikeSearchBackend()
+    return search_backend
+
+
+def search_services(query: str,
+                    offset: int = 0,
+                    page_size: int = SEARCH_PAGE_SIZE) -> tuple[list[main_models.Service], bool]:
+    """Страница результатов поиска и признак наличия следующей страницы"""
+    started_at = perf_counter()
+    ids = get_search_backend().search(query, limit=page_size + 1, offset=offset)
+    services = main_models.Service.objects \
+        .select_related('contractor__person') \
+        .in_bulk(ids[:page_size])
+    latencies.append(perf_counter() - started_at)
+    return [services[service_id] for service_id in ids[:page_size] if service_id in services], \
+        len(ids) > page_size
+
+
+def get_stats() -> dict:
+    values = sorted(latencies)
+    return {
+        'searches': len(values),
+        'avg_ms': round(sum(values) / len(values) * 1000, 2) if values else 0,
+        'p95_ms': round(values[int(len(values) * 0.95)] * 1000, 2) if values else 0,
+    }
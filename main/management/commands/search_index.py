@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+import main.management.commands.search as search
+
+
+class Command(BaseCommand):
+    help = "Перестроение поискового индекса услуг и проверочный поиск"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Перестроить индекс, например после массового обновления услуг в обход сигналов'
+        )
+        parser.add_argument('query', nargs='?', help='Проверочный запрос')
+
+    def handle(self, *args, **options):
+        backend = search.get_search_backend()
+        if options['rebuild']:
+            backend.rebuild()
+            self.stdout.write(f'Индекс перестроен: {type(backend).__name__}')
+
+        if options['query']:
+            services, has_next = search.search_services(options['query'])
+            for service in services:
+                self.stdout.write(f'{service.id}: {service.title} - {service.price} руб.')
+            if has_next:
+                self.stdout.write('...')
+            self.stdout.write(f'Время поиска: {search.get_stats()["avg_ms"]} мс')
@@ -0,0 +1,84 @@
+import logging
+import os
+
+from threading import Lock
+from typing import Optional
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from main import models as main_models
+
+logger = logging.getLogger(__name__)
+
+file_ids = {}
+file_ids_lock = Lock()
+
+# Фрагменты ответа Telegram, по которым видно, что отклонен именно file_id
+FILE_ID_ERRORS = ('file identifier', 'file_id')
+
+
+def get_file_key(path: str) -> str:
+    """Ключ меняется вместе с файлом, поэтому замененный файл загрузится заново"""
+    return f'{path}:{os.stat(path).st_mtime_ns}'
+
+
+def get_file_id(key: str) -> Optional[str]:
+    with file_ids_lock:
+        if key in file_ids:
+            return file_ids[key]
+    file_id = main_models.TelegramFile.objects.filter(key=key) \
+        .values_list('file_id', flat=True) \
+        .first()
+    if file_id:
+        with file_ids_lock:
+            file_ids[key] = file_id
+    return file_id
+
+
+def save_file_id(key: str, file_id: str) -> None:
+    main_models.TelegramFile.objects.update_or_create(key=key, defaults={'file_id': file_id})
+    with file_ids_lock:
+        file_ids[key] = file_id
+
+
+def forget_file_id(key: str) -> None:
+    main_models.TelegramFile.objects.filter(key=key).delete()
+    with file_ids_lock:
+        file_ids.pop(key, None)
+
+
+def is_file_id_error(error: BadRequest) -> bool:
+    message = error.message.lower()
+    return any(fragment in message for fragment in FILE_ID_ERRORS)
+
+
+def extract_file_id(message: Message, media: str) -> str:
+    if media == 'photo':
+        return message.photo[-1].file_id
+    return getattr(message, media).file_id
+
+
+def send_file(send, path: str, media: str, **kwargs) -> Message:
+    """Отправляет файл по сохраненному file_id, а при первой отправке загружает его.
+
+    send — метод бота (send_photo, send_document), media — имя его аргумента
+    с файлом ('photo', 'document'). Если Telegram отклонил file_id, файл
+    загружается заново и file_id обновляется. Прочие ошибки BadRequest
+    (например, неверный chat_id) пробрасываются, а file_id сохраняется.
+    """
+    key = get_file_key(path)
+    file_id = get_file_id(key)
+    if file_id:
+        try:
+            return send(**{media: file_id}, **kwargs)
+        except BadRequest as error:
+            if not is_file_id_error(error):
+                raise
+            logger.warning(f'Telegram rejected file_id for {path}: {error}')
+            forget_file_id(key)
+
+    with open(path, 'rb') as file:
+        message = send(**{media: file}, **kwargs)
+    save_file_id(key, extract_file_id(message, media))
+    return message
@@ -0,0 +1,288 @@
+import statistics
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from queue import Empty, Queue
+from threading import Event, Lock, local
+from time import perf_counter, sleep, time
+
+import requests
+
+from django.core.management.base import BaseCommand, CommandError
+from telegram import Update
+from telegram.ext import DictPersistence, TypeHandler, Updater
+
+import main.management.commands.buttons as buttons
+import main.management.commands.outbox as outbox
+import main.management.commands.redis_pool as redis_pool
+
+from main.management.commands.runbot import create_dispatcher, get_webhook_path, setup_dispatcher
+
+
+session_storage = local()
+update_ids = count(1)
+
+# Токен-заглушка: Bot проверяет только формат
+BENCH_TOKEN = '100000:bench'
+# Синтетические чаты, telegram_id помещается в SmallIntegerField
+BENCH_CHAT_ID = 30000
+# Лимиты очереди исходящих, которые не мешают замеру
+UNLIMITED_RATE = 10 ** 6
+
+
+def get_session() -> requests.Session:
+    if not hasattr(session_storage, 'session'):
+        session_storage.session = requests.Session()
+    return session_storage.session
+
+
+def build_user(chat_id: int) -> dict:
+    return {'id': chat_id, 'is_bot': False, 'first_name': f'Bench {chat_id}'}
+
+
+def build_message(chat_id: int, text: str) -> dict:
+    return {
+        'message_id': next(update_ids),
+        'date': int(time()),
+        'chat': {'id': chat_id, 'type': 'private', 'first_name': f'Bench {chat_id}'},
+        'from': build_user(chat_id),
+        'text': text,
+    }
+
+
+def build_update(chat_id: int, kind: str) -> dict:
+    """Собирает синтетический Update в формате Bot API"""
+    update_id = next(update_ids)
+    if kind == 'callback':
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': build_user(chat_id),
+                'chat_instance': str(chat_id),
+                'data': buttons.BACK_TO_CLIENT_MAIN['callback_data'],
+                'message': build_message(chat_id, 'bench'),
+            }
+        }
+    return {'update_id': update_id, 'message': build_message(chat_id, '/start')}
+
+
+def post_update(url: str, update: dict) -> tuple[float, int]:
+    started_at = perf_counter()
+    try:
+        status = get_session().post(url, json=update, timeout=10).status_code
+    except requests.RequestException:
+        status = 0
+    return perf_counter() - started_at, status
+
+
+def percentile(values: list[float], percent: int) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, round(len(values) * percent / 100))
+    return values[index]
+
+
+class StubRequest:
+    """Bot API без сети: методы отправки отвечают заготовкой сообщения,
+    getUpdates раздает обновления, положенные в updates.
+    """
+
+    con_pool_size = 64
+
+    def __init__(self):
+        self.updates = Queue()
+        self.calls = 0
+        self._lock = Lock()
+
+    def post(self, url: str, data: dict = None, timeout: float = None):
+        method = url.rsplit('/', 1)[-1]
+        data = data or {}
+        with self._lock:
+            self.calls += 1
+        if method == 'getUpdates':
+            return self._get_updates(data)
+        if method == 'getMe':
+            return {'id': int(BENCH_TOKEN.split(':')[0]), 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method.startswith(('send', 'edit')) and 'chat_id' in data:
+            return {
+                'message_id': next(update_ids),
+                'date': int(time()),
+                'chat': {'id': int(data['chat_id']), 'type': 'private'},
+                'text': data.get('text', ''),
+            }
+        return True
+
+    def _get_updates(self, data: dict) -> list[dict]:
+        # Long polling: ждем первое обновление, затем забираем накопившиеся
+        try:
+            updates = [self.updates.get(timeout=min(float(data.get('timeout') or 0), 0.5) or 0.05)]
+        except Empty:
+            return []
+        limit = int(data.get('limit') or 100)
+        while len(updates) < limit:
+            try:
+                updates.append(self.updates.get_nowait())
+            except Empty:
+                break
+        return updates
+
+    def stop(self) -> None:
+        pass
+
+
+class HandlerTimer:
+    """Время от отправки обновления до конца его обработки"""
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.sent_at = {}
+        self.latencies = []
+        self.finished_at = None
+        self.done = Event()
+        self._lock = Lock()
+
+    def sent(self, update_id: int) -> None:
+        with self._lock:
+            self.sent_at[update_id] = perf_counter()
+
+    def handled(self, update: Update, context) -> None:
+        # Обработчик последней группы: вызывается после обработчиков бота
+        finished_at = perf_counter()
+        with self._lock:
+            sent_at = self.sent_at.pop(update.update_id, None)
+            if sent_at is None:
+                return
+            self.latencies.append(finished_at - sent_at)
+            if len(self.latencies) == self.expected:
+                self.finished_at = finished_at
+                self.done.set()
+
+
+def create_bench_updater(request: StubRequest, workers: int, timer: HandlerTimer) -> Updater:
+    dispatcher = create_dispatcher(
+        token=BENCH_TOKEN,
+        workers=workers,
+        persistence=DictPersistence(),
+        request=request,
+        outbound_queue=outbox.OutboundQueue(
+            global_rate=UNLIMITED_RATE,
+            chat_rate=UNLIMITED_RATE,
+            chat_burst=UNLIMITED_RATE
+        )
+    )
+    setup_dispatcher(dispatcher, redis_pool.get_redis())
+    dispatcher.add_handler(TypeHandler(Update, timer.handled), group=100)
+    return Updater(dispatcher=dispatcher, workers=None)
+
+
+def feed(updates: list[dict], rate: float, concurrency: int, send) -> float:
+    """Отправляет обновления с заданной частотой, возвращает время начала"""
+    started_at = perf_counter()
+
+    def send_at(numbered: tuple[int, dict]):
+        number, update = numbered
+        delay = started_at + number / rate - perf_counter()
+        if delay > 0:
+            sleep(delay)
+        return send(update)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send_at, enumerate(updates)))
+    return started_at
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный прогон: обработка синтетических Update через webhook и long polling без обращений к Telegram"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='Сколько обновлений отправить в каждом режиме')
+        parser.add_argument('--rate', type=float, default=200, help='Частота отправки обновлений, в секунду')
+        parser.add_argument('--concurrency', type=int, default=10, help='Число параллельных клиентов webhook')
+        parser.add_argument('--chats', type=int, default=50, help='Число разных синтетических чатов')
+        parser.add_argument('--workers', type=int, default=8, help='Размер пула обработчиков, 0 — последовательно')
+        parser.add_argument('--port', type=int, default=8787, help='Порт локального webhook сервера')
+        parser.add_argument(
+            '--kind',
+            choices=('message', 'callback'),
+            default='message',
+            help='Тип обновления: сообщение /start или нажатие inline кнопки'
+        )
+        parser.add_argument('--timeout', type=float, default=60, help='Сколько ждать обработки, секунд')
+
+    def build_updates(self, options) -> list[dict]:
+        return [
+            build_update(chat_id=BENCH_CHAT_ID + num % options['chats'], kind=options['kind'])
+            for num in range(options['count'])
+        ]
+
+    def run_webhook(self, options) -> dict:
+        request = StubRequest()
+        timer = HandlerTimer(options['count'])
+        updater = create_bench_updater(request, options['workers'], timer)
+        path = get_webhook_path(BENCH_TOKEN)
+        updater.start_webhook(listen='127.0.0.1', port=options['port'], url_path=path)
+        url = f'http://127.0.0.1:{options["port"]}/{path}'
+        accepted = []
+
+        def send(update: dict) -> None:
+            timer.sent(update['update_id'])
+            latency, status = post_update(url, update)
+            if status == 200:
+                accepted.append(latency)
+
+        try:
+            started_at = feed(self.build_updates(options), options['rate'], options['concurrency'], send)
+            timer.done.wait(options['timeout'])
+        finally:
+            updater.stop()
+        if not accepted:
+            raise CommandError(f'Webhook сервер {url} не принял ни одного обновления')
+        return self.summarize(timer, started_at, request, accepted)
+
+    def run_polling(self, options) -> dict:
+        request = StubRequest()
+        timer = HandlerTimer(options['count'])
+        updater = create_bench_updater(request, options['workers'], timer)
+        updater.start_polling(poll_interval=0, timeout=1)
+
+        def send(update: dict) -> None:
+            timer.sent(update['update_id'])
+            request.updates.put(update)
+
+        try:
+            started_at = feed(self.build_updates(options), options['rate'], options['concurrency'], send)
+            timer.done.wait(options['timeout'])
+        finally:
+            updater.stop()
+        return self.summarize(timer, started_at, request)
+
+    @staticmethod
+    def summarize(timer: HandlerTimer, started_at: float, request: StubRequest, accepted: list = None) -> dict:
+        latencies = [latency * 1000 for latency in timer.latencies]
+        if not latencies:
+            raise CommandError('Ни одно обновление не дошло до конца обработки')
+        elapsed = (timer.finished_at or perf_counter()) - started_at
+        return {
+            'Обработано': f'{len(latencies)}/{timer.expected}',
+            'upd/s': f'{len(latencies) / elapsed:.1f}',
+            'avg, мс': f'{statistics.mean(latencies):.1f}',
+            'p50, мс': f'{percentile(latencies, 50):.1f}',
+            'p95, мс': f'{percentile(latencies, 95):.1f}',
+            'p99, мс': f'{percentile(latencies, 99):.1f}',
+            'max, мс': f'{max(latencies):.1f}',
+            'прием HTTP p95, мс': f'{percentile([value * 1000 for value in accepted], 95):.1f}' if accepted else '-',
+            'запросов к API': str(request.calls),
+        }
+
+    def handle(self, *args, **options):
+        results = {
+            'webhook': self.run_webhook(options),
+            'polling': self.run_polling(options),
+        }
+        self.stdout.write(
+            f'{options["count"]} обновлений ({options["kind"]}), {options["rate"]:.0f}/с, '
+            f'workers={options["workers"]}; задержка — от отправки до конца обработчика'
+        )
+        self.stdout.write(f'{"":<20}{"webhook":>12}{"polling":>12}')
+        for metric in results['webhook']:
+            self.stdout.write(f'{metric:<20}{results["webhook"][metric]:>12}{results["polling"][metric]:>12}')
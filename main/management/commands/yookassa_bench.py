@@ -0,0 +1,119 @@
+import random
+import statistics
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+import main.management.commands.yookassa_webhook as yookassa_webhook
+
+from main import models as main_models
+from main.management.commands.webhook_bench import percentile, post_update
+
+BENCH_PREFIX = 'bench-'
+
+
+def build_notification(payment_id: str, telegram_id: int, tariff: main_models.Tariff) -> dict:
+    """Уведомление в формате YooKassa об успешном платеже"""
+    return {
+        'type': 'notification',
+        'event': 'payment.succeeded',
+        'object': {
+            'id': payment_id,
+            'status': 'succeeded',
+            'paid': True,
+            'amount': {'value': f'{tariff.price}.00', 'currency': 'RUB'},
+            'created_at': now().isoformat(),
+            'description': f'Подписка {tariff.title}',
+            'metadata': {'tariff_id': tariff.id, 'user_id': telegram_id},
+            'refundable': False,
+            'test': True,
+        }
+    }
+
+
+class Command(BaseCommand):
+    help = "Локальная замена YooKassa: отправляет на вебхук пачки уведомлений с повторами"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000/webhook/yookassa/',
+            help='Адрес вебхука YooKassa'
+        )
+        parser.add_argument('--payments', type=int, default=100, help='Сколько разных платежей')
+        parser.add_argument(
+            '--duplicates',
+            type=int,
+            default=3,
+            help='Сколько раз доставить каждое уведомление, как при повторах YooKassa'
+        )
+        parser.add_argument('--concurrency', type=int, default=20, help='Число параллельных отправок')
+        parser.add_argument('--telegram-id', type=int, help='Клиент, для которого создаются платежи')
+        parser.add_argument('--tariff-id', type=int, help='Оплачиваемый тариф')
+        parser.add_argument(
+            '--process',
+            action='store_true',
+            help='После отправки обработать уведомления и проверить, что подписок ровно по одной на платеж'
+        )
+
+    def handle(self, *args, **options):
+        client = main_models.Client.objects.select_related('person')
+        client = client.get(person__telegram_id=options['telegram_id']) if options['telegram_id'] \
+            else client.first()
+        tariff = main_models.Tariff.objects.get(id=options['tariff_id']) if options['tariff_id'] \
+            else main_models.Tariff.objects.first()
+        if client is None or tariff is None:
+            raise CommandError('Нужны клиент и тариф: создайте их или укажите --telegram-id и --tariff-id')
+        if options['process'] and settings.YOOKASSA_VERIFY_PAYMENTS:
+            raise CommandError('Для --process выключите YOOKASSA_VERIFY_PAYMENTS: тестовых платежей нет в API')
+
+        payment_ids = [f'{BENCH_PREFIX}{uuid4()}' for _ in range(options['payments'])]
+        notifications = [
+            build_notification(payment_id, client.person.telegram_id, tariff)
+            for payment_id in payment_ids
+            for _ in range(options['duplicates'])
+        ]
+        random.shuffle(notifications)
+
+        started_at = perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(
+                lambda notification: post_update(options['url'], notification),
+                notifications
+            ))
+        elapsed = perf_counter() - started_at
+
+        latencies = [latency * 1000 for latency, status in results if status == 200]
+        if not latencies:
+            raise CommandError(f'Вебхук {options["url"]} не принял ни одного уведомления')
+        self.stdout.write(
+            f'Отправлено: {len(results)}, ошибок: {len(results) - len(latencies)}, '
+            f'время: {elapsed:.2f} с, {len(results) / elapsed:.1f} req/s\n'
+            f'Задержка ответа, мс: avg {statistics.mean(latencies):.1f}, '
+            f'p50 {percentile(latencies, 50):.1f}, '
+            f'p95 {percentile(latencies, 95):.1f}, '
+            f'max {max(latencies):.1f}'
+        )
+
+        events = main_models.PaymentEvent.objects.filter(payment_id__in=payment_ids).count()
+        self.stdout.write(f'Сохранено событий: {events} из {len(payment_ids)} платежей')
+        if not options['process']:
+            return
+
+        started_at = perf_counter()
+        processed = 0
+        while count := yookassa_webhook.process_pending_events():
+            processed += count
+        elapsed = perf_counter() - started_at
+        subscriptions = main_models.ClientSubscription.objects.filter(payment_id__in=payment_ids).count()
+        self.stdout.write(
+            f'Обработано событий: {processed} за {elapsed:.2f} с, '
+            f'создано подписок: {subscriptions} на {len(payment_ids)} платежей'
+        )
+        if subscriptions != len(payment_ids):
+            raise CommandError('Число подписок не совпадает с числом платежей')
@@ -1,12 +1,22 @@
 import os
 import json
 import logging
+
+from datetime import timedelta
+from functools import partial
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import F, Q, QuerySet
+from django.utils.timezone import now
 from yookassa import Configuration, Payment
 from yookassa.domain.notification import WebhookNotification
-from redis import Redis
+from redis import Redis, RedisError
 import main.management.commands.db_processing as db
-from telegram import Bot
-from telegram.error import TelegramError
+import main.management.commands.outbox as outbox
+import main.management.commands.redis_pool as redis_pool
+
+from main import models as main_models
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,63 +25,175 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def handle_payment_notification(notification_data: dict, redis: Redis) -> None:
-    """Обработка уведомления о платеже от YooKassa"""
+PAYMENT_KEY = 'payment_{}'
+# После стольких неудачных попыток событие остается в статусе «ошибка»
+MAX_ATTEMPTS = 5
+# Событие в обработке дольше этого срока считается брошенным воркером
+STALE_EVENT_TIMEOUT = timedelta(minutes=5)
+# Пауза перед повтором события после ошибки
+RETRY_DELAY = timedelta(seconds=30)
+
+SUBSCRIPTION_ACTIVATED_MESSAGE = "✅ Оплата прошла успешно!\nПодписка '{title}' активирована.\n\nТеперь вы можете отправлять заявки."
+
+
+def configure_yookassa() -> None:
+    Configuration.account_id = os.getenv('SHOP_ID')
+    Configuration.secret_key = os.getenv('YOOKASSA_TOKEN')
+
+
+def get_payment_info(redis: Redis, payment_id: str, metadata: dict = None) -> Optional[dict]:
+    """telegram_id и tariff_id платежа из metadata платежа или из Redis.
+
+    Бот сохраняет пользователя под ключом user_id, ранние записи — под telegram_id.
+    """
+    info = dict(metadata or {})
+    if not info.get('tariff_id') or not (info.get('user_id') or info.get('telegram_id')):
+        try:
+            payment_data = redis.get(PAYMENT_KEY.format(payment_id))
+        except RedisError as error:
+            logger.warning(f'Payment data read from Redis failed: {error}')
+            payment_data = None
+        if payment_data:
+            info.update(json.loads(payment_data))
+
+    telegram_id = info.get('telegram_id') or info.get('user_id')
+    tariff_id = info.get('tariff_id')
+    if not telegram_id or not tariff_id:
+        return None
+    return {'telegram_id': int(telegram_id), 'tariff_id': int(tariff_id)}
+
+
+def forget_payment(redis: Redis, payment_id: str) -> None:
+    try:
+        redis.delete(PAYMENT_KEY.format(payment_id))
+    except RedisError as error:
+        logger.warning(f'Payment data delete from Redis failed: {error}')
+
+
+def activate_payment(redis: Redis,
+                     payment_id: str,
+                     metadata: dict = None) -> Optional[tuple[main_models.ClientSubscription, bool]]:
+    """Активирует подписку по оплаченному платежу, общий путь для вебхука и проверки оплаты.
+
+    Возвращает подписку и признак, что она создана сейчас, или None,
+    если неизвестно, кто и какой тариф оплатил.
+    """
+    info = get_payment_info(redis, payment_id, metadata)
+    if info is None:
+        logger.error(f'Payment data not found for payment_id: {payment_id}')
+        return None
+    subscription, created = db.activate_payment(
+        telegram_id=info['telegram_id'],
+        tariff_id=info['tariff_id'],
+        payment_id=payment_id
+    )
+    forget_payment(redis, payment_id)
+    if created:
+        logger.info(f'Created subscription {subscription.id} for payment {payment_id}')
+    return subscription, created
+
+
+def notify_activated(bot, subscription: main_models.ClientSubscription) -> None:
+    """Ставит уведомление в очередь и не ждет отправки: сбой Telegram не должен
+    возвращать уже активированный платеж на повторную обработку
+    """
     try:
-        logger.debug(f'Received payment notification: {notification_data}')
-        
-        # Инициализация YooKassa
-        Configuration.account_id = os.getenv('SHOP_ID')
-        Configuration.secret_key = os.getenv('YOOKASSA_TOKEN')
-        logger.debug('YooKassa configuration initialized')
-        
-        # Инициализация бота
-        bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'))
-        logger.debug('Telegram bot initialized')
-        
-        # Обработка уведомления
-        notification = WebhookNotification(notification_data)
-        payment = notification.object
-        logger.debug(f'Payment status: {payment.status}')
-        
-        if payment.status == 'succeeded':
-            # Получаем данные из Redis
-            payment_data = redis.get(f'payment_{payment.id}')
-            logger.debug(f'Payment data from Redis: {payment_data}')
-            
-            if payment_data:
-                payment_info = json.loads(payment_data)
-                telegram_id = int(payment_info['telegram_id'])
-                tariff_id = payment_info['tariff_id']
-                logger.debug(f'Processing payment for user {telegram_id}, tariff {tariff_id}')
-                
-                # Создаем подписку
-                subscription = db.create_subscription(
-                    telegram_id=telegram_id,
-                    tariff_id=tariff_id,
-                    payment_id=payment.id
-                )
-                logger.debug(f'Created subscription: {subscription}')
-                
-                # Очищаем данные из Redis
-                redis.delete(f'payment_{payment.id}')
-                logger.debug(f'Deleted payment data from Redis for payment {payment.id}')
-                
-                # Отправляем уведомление пользователю
-                try:
-                    bot.send_message(
-                        chat_id=telegram_id,
-                        text=f"✅ Оплата прошла успешно!\nПодписка '{subscription.tariff.title}' активирована.\n\nТеперь вы можете отправлять заявки."
-                    )
-                    logger.debug(f'Sent success notification to user {telegram_id}')
-                except TelegramError as e:
-                    logger.error(f'Error sending notification to user {telegram_id}: {e}')
-                
-            else:
-                logger.error(f'Payment data not found in Redis for payment_id: {payment.id}')
-        else:
-            logger.debug(f'Payment {payment.id} status is not succeeded: {payment.status}')
-        
-    except Exception as e:
-        logger.error(f'Error handling payment notification: {e}')
-        raise 
\ No newline at end of file
+        future = (bot or outbox.get_bot()).send_message(
+            chat_id=subscription.client.person.telegram_id,
+            text=SUBSCRIPTION_ACTIVATED_MESSAGE.format(title=subscription.tariff.title),
+            priority=outbox.NOTIFICATION
+        )
+    except Exception as error:
+        logger.error(f'Error sending payment notification for {subscription.payment_id}: {error}')
+        return
+    future.add_done_callback(partial(log_notification_error, subscription.payment_id))
+
+
+def log_notification_error(payment_id: str, future) -> None:
+    if future.exception():
+        logger.error(f'Error sending payment notification for {payment_id}: {future.exception()}')
+
+
+def record_notification(notification_data: dict) -> tuple[main_models.PaymentEvent, bool]:
+    """Проверяет уведомление и сохраняет его. Повторная доставка возвращает уже сохраненное событие"""
+    notification = WebhookNotification(notification_data)
+    payment = notification.object
+    if not payment.id or not payment.status:
+        raise ValueError('Notification without payment id or status')
+    return main_models.PaymentEvent.objects.get_or_create(
+        payment_id=payment.id,
+        event=notification.event,
+        defaults={'status': payment.status, 'payload': notification_data}
+    )
+
+
+def get_claimable_events() -> QuerySet:
+    moment = now()
+    return main_models.PaymentEvent.objects.filter(
+        Q(state=main_models.PaymentEvent.RECEIVED, started_at__isnull=True) |
+        Q(state=main_models.PaymentEvent.RECEIVED, started_at__lt=moment - RETRY_DELAY) |
+        Q(state=main_models.PaymentEvent.PROCESSING, started_at__lt=moment - STALE_EVENT_TIMEOUT)
+    )
+
+
+def claim_next_event() -> Optional[main_models.PaymentEvent]:
+    """Забирает событие условным UPDATE, чтобы два воркера не обработали его оба"""
+    for event_id in get_claimable_events().order_by('id').values_list('id', flat=True)[:10]:
+        claimed = get_claimable_events().filter(id=event_id).update(
+            state=main_models.PaymentEvent.PROCESSING,
+            started_at=now(),
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return main_models.PaymentEvent.objects.get(id=event_id)
+    return None
+
+
+def process_event(event: main_models.PaymentEvent, bot=None, redis: Redis = None) -> None:
+    redis = redis or redis_pool.get_redis()
+    status = event.status
+    metadata = event.payload.get('object', {}).get('metadata')
+    if settings.YOOKASSA_VERIFY_PAYMENTS:
+        # Уведомлению не доверяем: статус и metadata берем из API
+        configure_yookassa()
+        payment = Payment.find_one(event.payment_id)
+        status, metadata = payment.status, payment.metadata
+
+    subscription = None
+    if status == 'succeeded':
+        activated = activate_payment(redis, event.payment_id, metadata)
+        if activated is None:
+            raise ValueError(f'Payment data not found for payment_id: {event.payment_id}')
+        subscription, created = activated
+        if created:
+            notify_activated(bot, subscription)
+    elif status == 'canceled':
+        forget_payment(redis, event.payment_id)
+    else:
+        logger.debug(f'Payment {event.payment_id} status is not final: {status}')
+
+    main_models.PaymentEvent.objects.filter(id=event.id).update(
+        state=main_models.PaymentEvent.PROCESSED,
+        status=status,
+        subscription=subscription,
+        error='',
+        processed_at=now()
+    )
+
+
+def process_pending_events(bot=None, redis: Redis = None, limit: int = 100) -> int:
+    """Обрабатывает сохраненные уведомления, возвращает их число"""
+    for count in range(limit):
+        event = claim_next_event()
+        if event is None:
+            return count
+        try:
+            process_event(event, bot=bot, redis=redis)
+        except Exception as error:
+            logger.exception(f'Payment event {event.id} failed')
+            main_models.PaymentEvent.objects.filter(id=event.id).update(
+                state=main_models.PaymentEvent.FAILED
+                if event.attempts >= MAX_ATTEMPTS else main_models.PaymentEvent.RECEIVED,
+                error=str(error)
+            )
+    return limit
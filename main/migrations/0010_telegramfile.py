@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-17 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_servicecategory_service_photo_service_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True, verbose_name='Файл')),
+                ('file_id', models.CharField(max_length=255, verbose_name='Telegram file_id')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Загружен')),
+            ],
+            options={
+                'verbose_name': 'файл в Telegram',
+                'verbose_name_plural': 'файлы в Telegram',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.7 on 2026-10-17 12:28
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_telegramfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicecategory',
+            name='page_size',
+            field=models.PositiveSmallIntegerField(default=10, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(50)], verbose_name='Услуг на странице'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['category', 'is_active', 'id'], name='service_category_page_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['contractor', 'is_active', 'id'], name='service_contractor_page_idx'),
+        ),
+    ]
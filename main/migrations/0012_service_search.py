@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# Копия search.FTS_TABLE: миграция не должна зависеть от кода приложения
+FTS_TABLE = 'main_service_search'
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5 индекс услуг нужен только на SQLite, другие БД ищут без него"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        f"USING fts5(title, description, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        f'INSERT INTO {FTS_TABLE} (rowid, title, description) '
+        f'SELECT id, title, description FROM main_service WHERE is_active'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_service_pagination'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
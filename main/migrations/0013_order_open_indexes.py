@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-17 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_service_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('contractor', None), ('declined', False), ('take_at', None)), fields=['created_at'], name='order_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('declined', False), ('finished_at', None)), fields=['subscription', 'created_at'], name='order_client_current_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('declined', False), ('finished_at', None)), fields=['contractor', 'created_at'], name='order_contractor_current_idx'),
+        ),
+    ]
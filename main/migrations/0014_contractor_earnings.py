@@ -0,0 +1,56 @@
+# Generated by Django 4.1.7 on 2026-10-17 12:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import TruncMonth
+
+
+def fill_earnings(apps, schema_editor):
+    Order = apps.get_model('main', 'Order')
+    ContractorMonthlyEarnings = apps.get_model('main', 'ContractorMonthlyEarnings')
+    rows = Order.objects.filter(finished_at__isnull=False, contractor__isnull=False) \
+        .annotate(month=TruncMonth('finished_at', output_field=models.DateField())) \
+        .values('contractor_id', 'month') \
+        .annotate(orders_count=models.Count('id'), salary=models.Sum('salary')) \
+        .order_by()
+    ContractorMonthlyEarnings.objects.bulk_create([
+        ContractorMonthlyEarnings(**row) for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_order_open_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContractorMonthlyEarnings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Месяц')),
+                ('orders_count', models.PositiveIntegerField(default=0, verbose_name='Выполнено заказов')),
+                ('salary', models.IntegerField(default=0, verbose_name='Заработано')),
+            ],
+            options={
+                'verbose_name': 'заработок за месяц',
+                'verbose_name_plural': 'заработок подрядчиков по месяцам',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('finished_at__isnull', False)), fields=['contractor', 'finished_at'], name='order_contractor_finished_idx'),
+        ),
+        migrations.AddField(
+            model_name='contractormonthlyearnings',
+            name='contractor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_earnings', to='main.contractor', verbose_name='подрядчик'),
+        ),
+        migrations.AddConstraint(
+            model_name='contractormonthlyearnings',
+            constraint=models.UniqueConstraint(fields=('contractor', 'month'), name='contractor_month_unique'),
+        ),
+        migrations.RunPython(fill_earnings, migrations.RunPython.noop),
+    ]
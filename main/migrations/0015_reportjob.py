@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-17 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_contractor_earnings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report', models.CharField(choices=[('orders_count', 'Число заказов'), ('salary', 'Зарплаты подрядчиков'), ('client_orders', 'Заказы клиентов')], max_length=20, verbose_name='Отчет')),
+                ('object_ids', models.JSONField(default=list, verbose_name='Выбранные записи')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готов'), ('failed', 'Ошибка')], db_index=True, default='pending', max_length=10, verbose_name='Статус')),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='Готово, %')),
+                ('messages_sent', models.PositiveIntegerField(default=0, verbose_name='Отправлено сообщений')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Запущен')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершен')),
+            ],
+            options={
+                'verbose_name': 'отчет',
+                'verbose_name_plural': 'отчеты',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-17 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset', models.CharField(max_length=20, verbose_name='Данные')),
+                ('format', models.CharField(max_length=10, verbose_name='Формат')),
+                ('date_from', models.DateTimeField(blank=True, null=True, verbose_name='С')),
+                ('date_to', models.DateTimeField(verbose_name='По')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Строк')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Выгружено')),
+            ],
+            options={
+                'verbose_name': 'выгрузка данных',
+                'verbose_name_plural': 'выгрузки данных',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='clientsubscription',
+            name='started_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Старт подписки'),
+        ),
+        migrations.AddIndex(
+            model_name='dataexport',
+            index=models.Index(fields=['dataset', 'date_to'], name='data_export_dataset_idx'),
+        ),
+    ]
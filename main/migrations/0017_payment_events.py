@@ -0,0 +1,63 @@
+# Generated by Django 4.1.7 on 2026-10-17 12:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def clear_duplicate_payments(apps, schema_editor):
+    """Повторные уведомления могли создать несколько подписок на один платеж.
+    Платеж остается за первой из них, иначе уникальность не создать"""
+    ClientSubscription = apps.get_model('main', 'ClientSubscription')
+    duplicates = ClientSubscription.objects.exclude(payment_id='') \
+        .values('payment_id') \
+        .annotate(first_id=models.Min('id'), count=models.Count('id')) \
+        .filter(count__gt=1)
+    for duplicate in duplicates:
+        ClientSubscription.objects.filter(payment_id=duplicate['payment_id']) \
+            .exclude(id=duplicate['first_id']) \
+            .update(payment_id='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_dataexport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=50, verbose_name='Платеж')),
+                ('event', models.CharField(max_length=50, verbose_name='Событие')),
+                ('status', models.CharField(max_length=30, verbose_name='Статус платежа')),
+                ('payload', models.JSONField(default=dict, verbose_name='Уведомление')),
+                ('state', models.CharField(choices=[('received', 'Получено'), ('processing', 'Обрабатывается'), ('processed', 'Обработано'), ('failed', 'Ошибка')], db_index=True, default='received', max_length=10, verbose_name='Состояние')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Получено')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начата обработка')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Обработано')),
+            ],
+            options={
+                'verbose_name': 'уведомление о платеже',
+                'verbose_name_plural': 'уведомления о платежах',
+                'ordering': ['-received_at'],
+            },
+        ),
+        migrations.RunPython(clear_duplicate_payments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='clientsubscription',
+            constraint=models.UniqueConstraint(condition=models.Q(('payment_id', ''), _negated=True), fields=('payment_id',), name='subscription_payment_unique'),
+        ),
+        migrations.AddField(
+            model_name='paymentevent',
+            name='subscription',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_events', to='main.clientsubscription', verbose_name='Подписка'),
+        ),
+        migrations.AddConstraint(
+            model_name='paymentevent',
+            constraint=models.UniqueConstraint(fields=('payment_id', 'event'), name='payment_event_unique'),
+        ),
+    ]
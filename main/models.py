@@ -1,8 +1,10 @@
+from decimal import Decimal
 from textwrap import dedent
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now, timedelta
 from phonenumber_field.modelfields import PhoneNumberField
-from django.core.validators import MinValueValidator
+from django.core.validators import MaxValueValidator, MinValueValidator
 
 
 class Person(models.Model):
@@ -33,13 +35,16 @@ class Client(models.Model):
     def __str__(self):
         return f'{self.person.name} ({self.person.phone})'
 
+    def get_last_subscription(self):
+        return self.subscriptions.with_status().order_by('-id').first()
+
     def has_actual_subscription(self):
-        if not self.subscriptions.last():
-            return False
-        return self.subscriptions.last().is_actual()
+        subscription = self.get_last_subscription()
+        return bool(subscription and subscription.is_actual())
 
     def is_new_request_available(self):
-        return self.subscriptions.last().orders_left() > 0
+        subscription = self.get_last_subscription()
+        return bool(subscription and subscription.orders_left() > 0)
 
     def get_current_orders(self):
         return Order.objects.filter(subscription__client=self, finished_at=None, declined=False)
@@ -62,6 +67,16 @@ class Owner(models.Model):
         return f'{self.person.name} ({self.person.phone})'
 
 
+class ContractorQuerySet(models.QuerySet):
+    def with_earnings(self):
+        """Подрядчики с числом выполненных заказов и заработком — одним запросом"""
+        finished = models.Q(orders__finished_at__isnull=False)
+        return self.select_related('person').annotate(
+            finished_orders_count=models.Count('orders', filter=finished),
+            earned=Coalesce(models.Sum('orders__salary', filter=finished), 0),
+        )
+
+
 class Contractor(models.Model):
     person = models.OneToOneField(
         Person,
@@ -72,6 +87,8 @@ class Contractor(models.Model):
     active = models.BooleanField('исполнитель утвержден', default=False)
     comment = models.TextField('заявка на утверждение', blank=True)
 
+    objects = ContractorQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'подрядчик'
         verbose_name_plural = 'подрядчики'
@@ -156,6 +173,25 @@ class Tariff(models.Model):
         )
 
 
+class ClientSubscriptionQuerySet(models.QuerySet):
+    def with_status(self):
+        """Подписки с тарифом, датой окончания и остатком заявок — одним запросом"""
+        return self.select_related('tariff').annotate(
+            expires_at=models.ExpressionWrapper(
+                models.F('started_at') + models.F('tariff__validity'),
+                output_field=models.DateTimeField()
+            ),
+            orders_count=models.Count('orders'),
+            orders_remaining=models.F('tariff__orders_limit') - models.Count('orders'),
+        )
+
+    def last_for_client(self, telegram_id: int):
+        return self.with_status() \
+            .filter(client__person__telegram_id=telegram_id) \
+            .order_by('-id') \
+            .first()
+
+
 class ClientSubscription(models.Model):
     client = models.ForeignKey(
         Client,
@@ -177,24 +213,38 @@ class ClientSubscription(models.Model):
         related_name='subscriptions',
         on_delete=models.PROTECT
     )
-    started_at = models.DateTimeField('Старт подписки', auto_now_add=True)
+    started_at = models.DateTimeField('Старт подписки', auto_now_add=True, db_index=True)
     payment_id = models.CharField(max_length=50, blank=True)
 
+    objects = ClientSubscriptionQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'подписка клиента'
         verbose_name_plural = 'подписки клиентов'
+        constraints = [
+            # По одному платежу создается не больше одной подписки
+            models.UniqueConstraint(
+                fields=['payment_id'],
+                condition=~models.Q(payment_id=''),
+                name='subscription_payment_unique'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.client}, {self.tariff} Остаток заявок: {self.orders_left()}'
 
     def orders_left(self):
-        return self.tariff.orders_limit - len(self.orders.all())
+        if hasattr(self, 'orders_remaining'):
+            return self.orders_remaining
+        return self.tariff.orders_limit - self.orders.count()
 
     def expired_at(self):
+        if hasattr(self, 'expires_at'):
+            return self.expires_at
         return self.started_at + self.tariff.validity
 
     def is_actual(self):
-        return now() <= self.started_at + self.tariff.validity
+        return now() <= self.expired_at()
 
     def info_subscription(self):
         info = dedent(
@@ -249,13 +299,38 @@ class Order(models.Model):
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
         ordering = ['-created_at']
+        indexes = [
+            # Частичные индексы повторяют условия OrderManager.get_availables
+            # и get_current_orders, поэтому содержат только открытые заказы
+            models.Index(
+                fields=['created_at'],
+                name='order_available_idx',
+                condition=models.Q(declined=False, contractor=None, take_at=None)
+            ),
+            models.Index(
+                fields=['subscription', 'created_at'],
+                name='order_client_current_idx',
+                condition=models.Q(declined=False, finished_at=None)
+            ),
+            models.Index(
+                fields=['contractor', 'created_at'],
+                name='order_contractor_current_idx',
+                condition=models.Q(declined=False, finished_at=None)
+            ),
+            # Выполненные заказы подрядчика для отчетов по заработку
+            models.Index(
+                fields=['contractor', 'finished_at'],
+                name='order_contractor_finished_idx',
+                condition=models.Q(finished_at__isnull=False)
+            ),
+        ]
 
     def __str__(self):
         contractor = self.contractor.person.name if self.contractor else ''
         return f'[{self.subscription.client.person.name}] {self.description[:50]} -> {contractor}'
 
     def is_available_order(self):
-        if not self.declined and not self.contractor and not self.take_at:
+        if not self.declined and not self.contractor_id and not self.take_at:
             return True
 
     def is_taken_deadline(self):
@@ -267,12 +342,36 @@ class Order(models.Model):
             {self.created_at.strftime('%Y-%m-%d')}
             {self.description[:50]}...
             Сроки выполнения: {self.estimated_time if self.estimated_time else 'производится оценка...'}
-            Статус заявки: {'в работе' if self.contractor else 'Ожидает распределения'}
+            Статус заявки: {'в работе' if self.contractor_id else 'Ожидает распределения'}
             """
         )
         return message
 
 
+class ContractorMonthlyEarnings(models.Model):
+    """Заработок подрядчика по месяцам, пополняется при закрытии заказа"""
+    contractor = models.ForeignKey(
+        Contractor,
+        verbose_name='подрядчик',
+        related_name='monthly_earnings',
+        on_delete=models.CASCADE
+    )
+    month = models.DateField('Месяц')
+    orders_count = models.PositiveIntegerField('Выполнено заказов', default=0)
+    salary = models.IntegerField('Заработано', default=0)
+
+    class Meta:
+        verbose_name = 'заработок за месяц'
+        verbose_name_plural = 'заработок подрядчиков по месяцам'
+        ordering = ['-month']
+        constraints = [
+            models.UniqueConstraint(fields=['contractor', 'month'], name='contractor_month_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.contractor} {self.month:%Y-%m}: {self.salary}'
+
+
 class OrderComments(models.Model):
     AUTHOR = (
         ('client', 'Клиент'),
@@ -345,6 +444,11 @@ class ServiceCategory(models.Model):
     """Категория услуг"""
     name = models.CharField('Название категории', max_length=100)
     description = models.TextField('Описание категории', blank=True)
+    page_size = models.PositiveSmallIntegerField(
+        'Услуг на странице',
+        default=10,
+        validators=[MinValueValidator(1), MaxValueValidator(50)]
+    )
     
     class Meta:
         verbose_name = 'категория услуг'
@@ -390,6 +494,11 @@ class Service(models.Model):
     class Meta:
         verbose_name = 'услуга'
         verbose_name_plural = 'услуги'
+        indexes = [
+            # Постраничный вывод услуг категории и исполнителя по id
+            models.Index(fields=['category', 'is_active', 'id'], name='service_category_page_idx'),
+            models.Index(fields=['contractor', 'is_active', 'id'], name='service_contractor_page_idx'),
+        ]
         
     def __str__(self):
         return f'{self.title} ({self.contractor.person.name})'
@@ -397,7 +506,7 @@ class Service(models.Model):
     def get_final_price(self):
         """Возвращает цену с учетом скидки"""
         if self.discount > 0:
-            return self.price * (1 - self.discount / 100)
+            return (self.price * (100 - self.discount) / 100).quantize(self.price)
         return self.price
 
 
@@ -424,13 +533,29 @@ class ServiceSet(models.Model):
     def __str__(self):
         return f'Набор услуг для {self.client.person.name}'
     
+    # Скидка на набор от DISCOUNT_MIN_SERVICES услуг, общая для корзины и сохраненных наборов
+    DISCOUNT_MIN_SERVICES = 3
+    DISCOUNT_PERCENT = 10
+
+    @classmethod
+    def get_discount_percent(cls, services_count: int) -> int:
+        return cls.DISCOUNT_PERCENT if services_count >= cls.DISCOUNT_MIN_SERVICES else 0
+
+    @classmethod
+    def apply_discount(cls, subtotal: Decimal, services_count: int) -> Decimal:
+        """Сумма набора после скидки за количество услуг"""
+        percent = cls.get_discount_percent(services_count)
+        if not percent:
+            return subtotal
+        return (subtotal * (100 - percent) / 100).quantize(Decimal('0.01'))
+
     def get_total_price(self):
-        """Возвращает общую стоимость набора услуг с учетом скидки"""
-        total = sum(service.get_final_price() for service in self.services.all())
-        # Если выбрано более 3 услуг, применяем скидку 10%
-        if self.services.count() >= 3:
-            total = total * 0.9
-        return total
+        """Возвращает общую стоимость набора услуг с учетом скидки.
+
+        Услуги читаются одним запросом, а при prefetch_related('services') — без запросов.
+        """
+        prices = [service.get_final_price() for service in self.services.all()]
+        return self.apply_discount(sum(prices, Decimal(0)), len(prices))
 
 
 class ContractorSubscription(models.Model):
@@ -452,3 +577,124 @@ class ContractorSubscription(models.Model):
         
     def __str__(self):
         return f'Подписка {self.contractor.person.name}'
+
+
+class TelegramFile(models.Model):
+    """file_id файла, уже загруженного в Telegram"""
+    key = models.CharField('Файл', max_length=255, unique=True)
+    file_id = models.CharField('Telegram file_id', max_length=255)
+    updated_at = models.DateTimeField('Загружен', auto_now=True)
+
+    class Meta:
+        verbose_name = 'файл в Telegram'
+        verbose_name_plural = 'файлы в Telegram'
+
+    def __str__(self):
+        return self.key
+
+
+class ReportJob(models.Model):
+    """Отчет из админки, который собирается и рассылается менеджерам в фоне"""
+    ORDERS_COUNT = 'orders_count'
+    SALARY = 'salary'
+    CLIENT_ORDERS = 'client_orders'
+    REPORTS = (
+        (ORDERS_COUNT, 'Число заказов'),
+        (SALARY, 'Зарплаты подрядчиков'),
+        (CLIENT_ORDERS, 'Заказы клиентов'),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готов'),
+        (FAILED, 'Ошибка'),
+    )
+
+    report = models.CharField('Отчет', max_length=20, choices=REPORTS)
+    object_ids = models.JSONField('Выбранные записи', default=list)
+    status = models.CharField('Статус', max_length=10, choices=STATUSES, default=PENDING, db_index=True)
+    progress = models.PositiveSmallIntegerField('Готово, %', default=0)
+    messages_sent = models.PositiveIntegerField('Отправлено сообщений', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    created_at = models.DateTimeField('Создан', auto_now_add=True)
+    started_at = models.DateTimeField('Запущен', null=True, blank=True)
+    finished_at = models.DateTimeField('Завершен', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'отчет'
+        verbose_name_plural = 'отчеты'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.get_report_display()} от {self.created_at:%Y-%m-%d %H:%M}'
+
+
+class DataExport(models.Model):
+    """Выгрузка данных командой export_data, конец ее периода — начало следующей инкрементальной"""
+    dataset = models.CharField('Данные', max_length=20)
+    format = models.CharField('Формат', max_length=10)
+    date_from = models.DateTimeField('С', null=True, blank=True)
+    date_to = models.DateTimeField('По')
+    rows = models.PositiveIntegerField('Строк', default=0)
+    created_at = models.DateTimeField('Выгружено', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'выгрузка данных'
+        verbose_name_plural = 'выгрузки данных'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['dataset', 'date_to'], name='data_export_dataset_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.dataset} по {self.date_to:%Y-%m-%d %H:%M}'
+
+
+class PaymentEvent(models.Model):
+    """Уведомление YooKassa. Сохраняется вебхуком и обрабатывается воркером ровно один раз"""
+    RECEIVED = 'received'
+    PROCESSING = 'processing'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    STATES = (
+        (RECEIVED, 'Получено'),
+        (PROCESSING, 'Обрабатывается'),
+        (PROCESSED, 'Обработано'),
+        (FAILED, 'Ошибка'),
+    )
+
+    payment_id = models.CharField('Платеж', max_length=50)
+    event = models.CharField('Событие', max_length=50)
+    status = models.CharField('Статус платежа', max_length=30)
+    payload = models.JSONField('Уведомление', default=dict)
+    state = models.CharField('Состояние', max_length=10, choices=STATES, default=RECEIVED, db_index=True)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    subscription = models.ForeignKey(
+        ClientSubscription,
+        verbose_name='Подписка',
+        related_name='payment_events',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+    received_at = models.DateTimeField('Получено', auto_now_add=True)
+    started_at = models.DateTimeField('Начата обработка', null=True, blank=True)
+    processed_at = models.DateTimeField('Обработано', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'уведомление о платеже'
+        verbose_name_plural = 'уведомления о платежах'
+        ordering = ['-received_at']
+        constraints = [
+            # Повторная доставка того же уведомления не создает новое событие
+            models.UniqueConstraint(fields=['payment_id', 'event'], name='payment_event_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.event} {self.payment_id}'
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from main.management.commands.catalog import get_catalog
+from main.management.commands.search import get_search_backend
+from main.models import Service, ServiceCategory
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=ServiceCategory)
+@receiver(post_delete, sender=ServiceCategory)
+def invalidate_catalog(sender, **kwargs):
+    """Сбрасывает кэш каталога при любом изменении услуг и категорий"""
+    get_catalog().invalidate()
+
+
+@receiver(post_save, sender=Service)
+def index_service(sender, instance, **kwargs):
+    """Обновляет услугу в поисковом индексе, неактивные услуги из него убираются"""
+    get_search_backend().index(instance)
+
+
+@receiver(post_delete, sender=Service)
+def unindex_service(sender, instance, **kwargs):
+    get_search_backend().remove(instance.id)
@@ -1,3 +1,1601 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
 
-# Create your tests here.
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import defaultdict
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from functools import partial
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from queue import Queue
+from threading import Barrier, Event, Lock
+from time import sleep
+from unittest.mock import ANY, MagicMock, patch
+from uuid import uuid4
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from telegram import Update
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.ext import TypeHandler
+
+import main.management.commands.buttons as buttons
+import main.management.commands.callback_bench as callback_bench
+import main.management.commands.callback_router as callback_router
+import main.management.commands.callbacks as callbacks
+import main.management.commands.cart as cart
+import main.management.commands.catalog as catalog
+import main.management.commands.chat_executor as chat_executor
+import main.management.commands.db_processing as db
+import main.management.commands.explain_queries as explain_queries
+import main.management.commands.exports as exports
+import main.management.commands.keyboards as keyboards
+import main.management.commands.messages as messages
+import main.management.commands.notifications as notifications
+import main.management.commands.outbox as outbox
+import main.management.commands.persistence as persistence
+import main.management.commands.payment_reconciler as payment_reconciler
+import main.management.commands.redis_pool as redis_pool
+import main.management.commands.reports as reports
+import main.management.commands.runbot as runbot
+import main.management.commands.scratch as scratch
+import main.management.commands.search as search
+import main.management.commands.telegram_files as telegram_files
+import main.management.commands.yookassa_webhook as yookassa_webhook
+
+from main import admin as admin_module
+from main import views
+from main import models as main_models
+
+
+class QueryBudgetMixin:
+    """Проверка, что код укладывается в заданное число SQL запросов"""
+
+    @contextmanager
+    def assertMaxQueries(self, budget: int):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertLessEqual(
+            len(context),
+            budget,
+            f'{len(context)} запросов при бюджете {budget}:\n{queries}'
+        )
+
+
+class LocalCatalogMixin:
+    """Кэш каталога только в памяти процесса, чтобы тесты не зависели от локального Redis.
+
+    Нужен вместе с override_settings(CATALOG_CACHE_REDIS=False): сигналы из setUpTestData
+    создают общий кэш заново уже без Redis, а каждый тест получает пустой кэш.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        patcher = patch.object(catalog, 'catalog', None)
+        patcher.start()
+        cls.addClassCleanup(patcher.stop)
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(catalog, 'catalog', catalog.CatalogCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+def make_update(chat_id: int, callback_data: str = None) -> MagicMock:
+    update = MagicMock()
+    update.effective_chat.id = chat_id
+    if callback_data:
+        update.callback_query.data = callback_data
+    else:
+        update.callback_query = None
+    return update
+
+
+class OrderQueriesTest(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = main_models.Tariff.objects.create(
+            title='Эконом',
+            orders_limit=5,
+            price=500,
+            answer_delay=timedelta(days=1)
+        )
+        client = main_models.Client.objects.create(
+            person=main_models.Person.objects.create(name='Клиент', phone='+79000000001', telegram_id=101)
+        )
+        cls.contractor = main_models.Contractor.objects.create(
+            person=main_models.Person.objects.create(name='Подрядчик', phone='+79000000002', telegram_id=102),
+            active=True
+        )
+        subscription = main_models.ClientSubscription.objects.create(client=client, tariff=tariff)
+        cls.orders = [
+            main_models.Order.objects.create(
+                subscription=subscription,
+                description=f'Заказ {num}',
+                contractor=cls.contractor if num % 2 else None
+            )
+            for num in range(6)
+        ]
+
+    def test_client_orders_list(self):
+        with self.assertMaxQueries(1):
+            orders = db.get_current_client_orders(telegram_id=101)
+            messages.display_orders(orders=orders)
+            keyboards.client_orders_inline(orders=orders)
+
+    def test_available_orders_list(self):
+        with self.assertMaxQueries(1):
+            orders = db.get_contractor_available_orders(telegram_id=102)
+            messages.display_orders(orders=orders, are_available=True)
+            keyboards.contractor_orders_inline(orders=orders, are_available_orders=True)
+
+    def test_order_card_and_notification(self):
+        with self.assertMaxQueries(1):
+            order = db.get_order(order_id=self.orders[1].id)
+            order.display()
+            messages.contractor_finished_order_notification(order=order)
+            order.subscription.client.person.telegram_id
+
+    def test_display_current_orders_handler(self):
+        context = MagicMock()
+        with self.assertMaxQueries(1):
+            runbot.display_current_orders(make_update(chat_id=101), context)
+        self.assertEqual(context.bot.send_message.call_count, 1)
+
+    def test_contractor_display_orders_handler(self):
+        update = make_update(
+            chat_id=102,
+            callback_data=runbot.buttons.CONTRACTOR_AVAILABLE_ORDERS['callback_data']
+        )
+        with self.assertMaxQueries(2):
+            runbot.contractor_display_orders(update, MagicMock())
+
+    def test_contractor_display_order_handler(self):
+        update = make_update(
+            chat_id=102,
+            callback_data=f'{runbot.buttons.CURRENT_ORDER["callback_data"]}:::{self.orders[1].id}'
+        )
+        with self.assertMaxQueries(1):
+            runbot.contractor_display_order(update, MagicMock())
+
+
+class SubscriptionStatusTest(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = main_models.Tariff.objects.create(
+            title='Стандарт',
+            orders_limit=3,
+            price=1000,
+            answer_delay=timedelta(hours=1)
+        )
+        client = main_models.Client.objects.create(
+            person=main_models.Person.objects.create(name='Клиент', phone='+79000000003', telegram_id=103)
+        )
+        main_models.ClientSubscription.objects.create(client=client, tariff=tariff)
+        cls.subscription = main_models.ClientSubscription.objects.create(client=client, tariff=tariff)
+        for num in range(2):
+            main_models.Order.objects.create(subscription=cls.subscription, description=f'Заказ {num}')
+
+    def test_status_annotations(self):
+        with self.assertMaxQueries(1):
+            subscription = main_models.ClientSubscription.objects.last_for_client(103)
+            self.assertEqual(subscription.id, self.subscription.id)
+            self.assertEqual(subscription.orders_left(), 1)
+            self.assertTrue(subscription.is_actual())
+            self.assertEqual(subscription.expired_at(), self.subscription.started_at + timedelta(days=30))
+
+    def test_guards_use_one_query(self):
+        with self.assertMaxQueries(1):
+            self.assertTrue(db.is_actual_client_subscription(client_telegram_id=103))
+        with self.assertMaxQueries(1):
+            self.assertTrue(db.is_available_client_request(client_telegram_id=103))
+        with self.assertMaxQueries(1):
+            self.assertIn('Доступных заявок: 1', db.get_client_subscription_info(telegram_id=103))
+
+    def test_client_without_subscription(self):
+        self.assertFalse(db.is_actual_client_subscription(client_telegram_id=999))
+        self.assertFalse(db.is_available_client_request(client_telegram_id=999))
+        self.assertIsNone(db.get_client_subscription_info(telegram_id=999))
+
+
+@override_settings(CATALOG_CACHE_REDIS=False)
+class CatalogCacheTest(LocalCatalogMixin, QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = main_models.ServiceCategory.objects.create(name='Дизайн')
+        cls.contractor = main_models.Contractor.objects.create(
+            person=main_models.Person.objects.create(name='Подрядчик', phone='+79000000004', telegram_id=104),
+            active=True
+        )
+        main_models.Service.objects.create(
+            title='Логотип',
+            description='Логотип',
+            price=1500,
+            contractor=cls.contractor,
+            category=cls.category
+        )
+
+    def test_browsing_is_served_from_cache(self):
+        keyboards.get_categories_keyboard()
+        keyboards.get_services_keyboard(self.category.id)
+        with self.assertMaxQueries(0):
+            categories_keyboard = keyboards.get_categories_keyboard()
+            services_keyboard = keyboards.get_services_keyboard(self.category.id)
+            category = catalog.get_catalog().get_category(self.category.id)
+        self.assertEqual(categories_keyboard.inline_keyboard[0][0].text, 'Дизайн')
+        self.assertEqual(services_keyboard.inline_keyboard[0][0].text, 'Логотип - 1500.00 руб.')
+        self.assertEqual(category['name'], 'Дизайн')
+
+    def test_signals_invalidate_cache(self):
+        keyboards.get_services_keyboard(self.category.id)
+        main_models.Service.objects.create(
+            title='Баннер',
+            description='Баннер',
+            price=900,
+            contractor=self.contractor,
+            category=self.category
+        )
+        keyboard = keyboards.get_services_keyboard(self.category.id)
+        self.assertEqual(len(keyboard.inline_keyboard), 3)
+
+
+class TelegramFilesTest(TestCase):
+
+    def setUp(self):
+        telegram_files.file_ids.clear()
+        file = tempfile.NamedTemporaryFile(suffix='.pdf')
+        file.write(b'%PDF')
+        file.flush()
+        self.addCleanup(file.close)
+        self.path = file.name
+
+    def make_send(self, rejected: tuple = ()):
+        def send(document, **kwargs):
+            if isinstance(document, str) and document in rejected:
+                raise BadRequest('Wrong file identifier')
+            message = MagicMock()
+            message.document.file_id = f'file-{send.call_count}'
+            send.call_count += 1
+            send.documents.append(document)
+            return message
+        send.call_count = 0
+        send.documents = []
+        return send
+
+    def test_file_is_uploaded_once(self):
+        send = self.make_send()
+        telegram_files.send_file(send, self.path, media='document', chat_id=1)
+        telegram_files.send_file(send, self.path, media='document', chat_id=2)
+        self.assertNotIsInstance(send.documents[0], str)
+        self.assertEqual(send.documents[1], 'file-0')
+
+    def test_rejected_file_id_is_uploaded_again(self):
+        telegram_files.save_file_id(telegram_files.get_file_key(self.path), 'stale')
+        send = self.make_send(rejected=('stale',))
+        telegram_files.send_file(send, self.path, media='document', chat_id=1)
+        self.assertNotIsInstance(send.documents[0], str)
+        self.assertEqual(
+            main_models.TelegramFile.objects.get().file_id,
+            'file-0'
+        )
+
+    def test_other_bad_request_keeps_file_id(self):
+        key = telegram_files.get_file_key(self.path)
+        telegram_files.save_file_id(key, 'valid')
+        send = MagicMock(side_effect=BadRequest('Chat not found'))
+        with self.assertRaises(BadRequest):
+            telegram_files.send_file(send, self.path, media='document', chat_id=1)
+        self.assertEqual(send.call_count, 1)
+        telegram_files.file_ids.clear()
+        self.assertEqual(telegram_files.get_file_id(key), 'valid')
+
+
+@override_settings(CATALOG_CACHE_REDIS=False)
+class ServicesPaginationTest(LocalCatalogMixin, QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = main_models.ServiceCategory.objects.create(name='Тексты', page_size=2)
+        contractor = main_models.Contractor.objects.create(
+            person=main_models.Person.objects.create(name='Подрядчик', phone='+79000000005', telegram_id=105),
+            active=True
+        )
+        cls.services = [
+            main_models.Service.objects.create(
+                title=f'Статья {num}',
+                description='Статья',
+                price=100,
+                contractor=contractor,
+                category=cls.category
+            )
+            for num in range(5)
+        ]
+
+    def page_texts(self, keyboard) -> list[str]:
+        return [row[0].text for row in keyboard.inline_keyboard[:-2]]
+
+    def test_pages_follow_keyset(self):
+        first = keyboards.get_services_keyboard(self.category.id)
+        self.assertEqual(self.page_texts(first), ['Статья 0 - 100.00 руб.', 'Статья 1 - 100.00 руб.'])
+        self.assertEqual([button.text for button in first.inline_keyboard[-2]], ['▶️'])
+
+        with self.assertMaxQueries(1):
+            second = keyboards.get_services_keyboard(self.category.id, after_id=self.services[1].id)
+        self.assertEqual(self.page_texts(second), ['Статья 2 - 100.00 руб.', 'Статья 3 - 100.00 руб.'])
+        self.assertEqual([button.text for button in second.inline_keyboard[-2]], ['◀️', '▶️'])
+
+        back = keyboards.get_services_keyboard(self.category.id, before_id=self.services[2].id)
+        self.assertEqual(self.page_texts(back), self.page_texts(first))
+
+    def test_contractor_services_page(self):
+        with patch.object(keyboards, 'CONTRACTOR_SERVICES_PAGE_SIZE', 3):
+            keyboard = keyboards.get_contractor_services_keyboard(105, after_id=self.services[2].id)
+        self.assertEqual(
+            [row[0].text for row in keyboard.inline_keyboard[:2]],
+            ['Статья 3 - 100.00 руб.', 'Статья 4 - 100.00 руб.']
+        )
+        self.assertEqual([button.text for button in keyboard.inline_keyboard[2]], ['◀️'])
+
+
+@override_settings(CATALOG_CACHE_REDIS=False)
+class ServiceSearchTest(LocalCatalogMixin, QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = main_models.ServiceCategory.objects.create(name='Дизайн')
+        contractor = main_models.Contractor.objects.create(
+            person=main_models.Person.objects.create(name='Подрядчик', phone='+79000000006', telegram_id=106),
+            active=True
+        )
+
+        def create(title, description):
+            return main_models.Service.objects.create(
+                title=title,
+                description=description,
+                price=1000,
+                contractor=contractor,
+                category=category
+            )
+        cls.banner = create('Баннер для сайта', 'Нарисую баннер, можно с логотипом')
+        cls.logo = create('Логотип компании', 'Разработка фирменного знака')
+        cls.cards = [create(f'Визитка {num}', 'Макет визитки') for num in range(3)]
+
+    def titles(self, services) -> list[str]:
+        return [service.title for service in services]
+
+    def test_title_matches_rank_first(self):
+        services, has_next = search.search_services('логотип')
+        self.assertEqual(self.titles(services), ['Логотип компании', 'Баннер для сайта'])
+        self.assertFalse(has_next)
+
+    def test_like_backend(self):
+        # LIKE в SQLite не сравнивает кириллицу без учета регистра, запрос в регистре названий
+        with patch.object(search, 'search_backend', search.LikeSearchBackend()):
+            services, has_next = search.search_services('Визитка', offset=1, page_size=1)
+        self.assertEqual(self.titles(services), ['Визитка 1'])
+        self.assertTrue(has_next)
+
+    def test_prefix_and_pagination(self):
+        first, has_next = search.search_services('визит', page_size=2)
+        self.assertEqual(len(first), 2)
+        self.assertTrue(has_next)
+        rest, has_next = search.search_services('визит', offset=2, page_size=2)
+        self.assertEqual(len(rest), 1)
+        self.assertFalse(has_next)
+        self.assertEqual(set(self.titles(first + rest)), {'Визитка 0', 'Визитка 1', 'Визитка 2'})
+
+    def test_signals_keep_index_fresh(self):
+        self.logo.title = 'Фирменный стиль'
+        self.logo.save()
+        self.assertEqual(self.titles(search.search_services('стиль')[0]), ['Фирменный стиль'])
+        self.logo.is_active = False
+        self.logo.save()
+        self.assertEqual(search.search_services('стиль')[0], [])
+        self.banner.delete()
+        self.assertEqual(search.search_services('баннер')[0], [])
+
+    def test_inline_query(self):
+        update = MagicMock()
+        update.inline_query.query = 'визитка'
+        update.inline_query.offset = ''
+        with self.assertMaxQueries(2):
+            runbot.inline_search(update, MagicMock())
+        results = update.inline_query.answer.call_args.args[0]
+        self.assertEqual(len(results), 3)
+        self.assertIn('Подрядчик', results[0].input_message_content.message_text)
+
+
+class ExplainQueriesTest(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        call_command('explain_queries', stdout=StringIO())
+
+    def test_full_scan_detection(self):
+        plan = '\n'.join([
+            '4 0 0 SCAN main_order',
+            '6 0 0 SCAN main_order USING INDEX order_available_idx',
+            '8 0 0 SCAN main_service USING COVERING INDEX service_category_page_idx',
+            '9 0 0 SEARCH main_person USING INTEGER PRIMARY KEY (rowid=?)',
+        ])
+        self.assertEqual(explain_queries.get_full_scans(plan, 'sqlite'), ['main_order', 'main_service'])
+        self.assertEqual(
+            explain_queries.get_full_scans('Seq Scan on main_order  (cost=0.00..1.01 rows=1)', 'postgresql'),
+            ['main_order']
+        )
+
+    def test_unknown_query(self):
+        with self.assertRaises(CommandError):
+            call_command('explain_queries', 'orders', stdout=StringIO())
+
+
+class OrderClaimTest(TransactionTestCase):
+    contractors_count = 8
+
+    def setUp(self):
+        tariff = main_models.Tariff.objects.create(
+            title='Эконом',
+            orders_limit=5,
+            price=500,
+            answer_delay=timedelta(days=1)
+        )
+        client = main_models.Client.objects.create(
+            person=main_models.Person.objects.create(name='Клиент', phone='+79000000007', telegram_id=107)
+        )
+        subscription = main_models.ClientSubscription.objects.create(client=client, tariff=tariff)
+        self.order = main_models.Order.objects.create(subscription=subscription, description='Заказ')
+        self.telegram_ids = [200 + num for num in range(self.contractors_count)]
+        for telegram_id in self.telegram_ids:
+            main_models.Contractor.objects.create(
+                person=main_models.Person.objects.create(
+                    name=f'Подрядчик {telegram_id}',
+                    phone=f'+79000000{telegram_id}',
+                    telegram_id=telegram_id
+                ),
+                active=True
+            )
+
+    def test_order_is_claimed_once(self):
+        order = db.claim_order(telegram_id=self.telegram_ids[0], order_id=self.order.id)
+        self.assertEqual(order.contractor.person.telegram_id, self.telegram_ids[0])
+        self.assertIsNotNone(order.take_at)
+        self.assertIsNone(db.claim_order(telegram_id=self.telegram_ids[1], order_id=self.order.id))
+
+    def test_concurrent_claims(self):
+        barrier = Barrier(self.contractors_count)
+
+        def claim(telegram_id):
+            try:
+                barrier.wait()
+                return db.claim_order(telegram_id=telegram_id, order_id=self.order.id)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.contractors_count) as executor:
+            orders = list(executor.map(claim, self.telegram_ids))
+
+        winners = [order for order in orders if order]
+        self.assertEqual(len(winners), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.contractor_id, winners[0].contractor_id)
+
+
+class ContractorEarningsTest(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = main_models.Tariff.objects.create(
+            title='Эконом',
+            orders_limit=10,
+            price=500,
+            answer_delay=timedelta(days=1)
+        )
+        client = main_models.Client.objects.create(
+            person=main_models.Person.objects.create(name='Клиент', phone='+79000000008', telegram_id=108)
+        )
+        cls.contractor = main_models.Contractor.objects.create(
+            person=main_models.Person.objects.create(name='Подрядчик', phone='+79000000009', telegram_id=109),
+            active=True
+        )
+        subscription = main_models.ClientSubscription.objects.create(client=client, tariff=tariff)
+        cls.orders = [
+            main_models.Order.objects.create(
+                subscription=subscription,
+                description=f'Заказ {num}',
+                contractor=cls.contractor,
+                salary=100 * (num + 1)
+            )
+            for num in range(3)
+        ]
+
+    def test_close_order_updates_rollup_once(self):
+        db.close_order(self.orders[0].id)
+        db.close_order(self.orders[1].id)
+        db.close_order(self.orders[1].id)
+        earnings = main_models.ContractorMonthlyEarnings.objects.get(contractor=self.contractor)
+        self.assertEqual((earnings.orders_count, earnings.salary), (2, 300))
+
+        db.rebuild_contractor_earnings()
+        earnings = main_models.ContractorMonthlyEarnings.objects.get(contractor=self.contractor)
+        self.assertEqual((earnings.orders_count, earnings.salary), (2, 300))
+
+    def test_salary_report(self):
+        for order in self.orders:
+            db.close_order(order.id)
+        with self.assertMaxQueries(3):
+            message = db.get_contractor_salary(telegram_id=109)
+        self.assertIn('Общая сумма заработка: 600 руб.', message)
+        self.assertIn('Выполнено заказов: 3', message)
+
+    def test_earnings_in_one_query(self):
+        db.close_order(self.orders[2].id)
+        with self.assertMaxQueries(1):
+            contractor = main_models.Contractor.objects.with_earnings().get(id=self.contractor.id)
+            str(contractor)
+        self.assertEqual((contractor.finished_orders_count, contractor.earned), (1, 300))
+
+
+class ReportJobsTest(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        main_models.Manager.objects.create(
+            person=main_models.Person.objects.create(name='Менеджер', phone='+79000000010', telegram_id=110),
+            active=True
+        )
+        main_models.Contractor.objects.bulk_create([
+            main_models.Contractor(
+                person=main_models.Person.objects.create(
+                    name=f'Подрядчик с длинным именем {num}',
+                    phone=f'+7900100{num:04}',
+                    telegram_id=1000 + num
+                ),
+                active=True
+            )
+            for num in range(150)
+        ])
+
+    def test_report_is_chunked_and_tracked(self):
+        job = reports.enqueue_report(main_models.ReportJob.SALARY, main_models.Contractor.objects.all())
+        bot = MagicMock()
+        bot.send_message.side_effect = lambda chat_id, text, priority: completed_future()
+        # Захват задачи и менеджеры, по два запроса на каждую из 4 пачек, завершение и пустая очередь
+        with patch.object(reports, 'REPORT_BATCH_SIZE', 40), self.assertMaxQueries(14):
+            self.assertEqual(reports.run_pending_jobs(bot=bot), 1)
+
+        texts = [call.args[1] for call in bot.send_message.call_args_list]
+        self.assertGreater(len(texts), 1)
+        self.assertTrue(all(len(text) <= messages.MAX_MESSAGE_LENGTH for text in texts))
+        self.assertEqual(sum(text.count('Исполнитель:') for text in texts), 150)
+        self.assertEqual({call.args[0] for call in bot.send_message.call_args_list}, {110})
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, main_models.ReportJob.DONE)
+        self.assertEqual(job.progress, 100)
+        self.assertEqual(job.messages_sent, len(texts))
+
+    def test_failed_job_keeps_error(self):
+        job = reports.enqueue_report(main_models.ReportJob.ORDERS_COUNT, main_models.Order.objects.all())
+        bot = MagicMock()
+        # Как QueuedBot: отправка не падает сразу, ошибка приходит в Future
+        bot.send_message.side_effect = lambda chat_id, text, priority: completed_future(
+            error=RuntimeError('Telegram недоступен')
+        )
+        reports.run_pending_jobs(bot=bot)
+        job.refresh_from_db()
+        self.assertEqual(job.status, main_models.ReportJob.FAILED)
+        self.assertIn('Telegram недоступен', job.error)
+        self.assertEqual(job.messages_sent, 0)
+
+    def test_only_delivered_messages_are_counted(self):
+        job = reports.enqueue_report(main_models.ReportJob.SALARY, main_models.Contractor.objects.all())
+        results = iter([completed_future(), completed_future(error=RuntimeError('Flood control'))])
+        bot = MagicMock()
+        bot.send_message.side_effect = lambda chat_id, text, priority: next(results, completed_future())
+        reports.run_pending_jobs(bot=bot)
+        job.refresh_from_db()
+        self.assertEqual(job.status, main_models.ReportJob.FAILED)
+        self.assertEqual(job.messages_sent, 1)
+
+    def test_job_without_managers_is_not_counted(self):
+        main_models.Manager.objects.update(active=False)
+        job = reports.enqueue_report(main_models.ReportJob.ORDERS_COUNT, main_models.Order.objects.all())
+        bot = MagicMock()
+        reports.run_pending_jobs(bot=bot)
+        bot.send_message.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, main_models.ReportJob.FAILED)
+        self.assertEqual(job.error, reports.NO_MANAGERS_ERROR)
+        self.assertEqual(job.messages_sent, 0)
+
+        sender = reports.ReportSender(bot, ())
+        sender.add('Строка')
+        sender.flush()
+        sender.collect(wait=True)
+        self.assertEqual(sender.sent, 0)
+
+    def test_job_is_claimed_once(self):
+        job = reports.enqueue_report(main_models.ReportJob.ORDERS_COUNT, main_models.Order.objects.all())
+        self.assertEqual(reports.claim_next_job().id, job.id)
+        self.assertIsNone(reports.claim_next_job())
+        main_models.ReportJob.objects.filter(id=job.id).update(
+            started_at=job.created_at - reports.STALE_JOB_TIMEOUT * 2
+        )
+        self.assertEqual(reports.claim_next_job().id, job.id)
+
+
+class ExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        tariff = main_models.Tariff.objects.create(
+            title='Эконом',
+            orders_limit=10,
+            price=500,
+            answer_delay=timedelta(days=1)
+        )
+        client = main_models.Client.objects.create(
+            person=main_models.Person.objects.create(name='Клиент, "ООО"', phone='+79000000011', telegram_id=111)
+        )
+        subscription = main_models.ClientSubscription.objects.create(client=client, tariff=tariff)
+        cls.orders = [
+            main_models.Order.objects.create(subscription=subscription, description=f'Заказ\n{num}')
+            for num in range(3)
+        ]
+
+    def export(self, *args) -> str:
+        with tempfile.NamedTemporaryFile(suffix='.export') as file:
+            call_command('export_data', *args, '--output', file.name, stderr=StringIO())
+            return open(file.name, encoding='utf-8').read()
+
+    def test_csv_export(self):
+        rows = list(csv.DictReader(StringIO(self.export('orders'))))
+        self.assertEqual([row['id'] for row in rows], [str(order.id) for order in self.orders])
+        self.assertEqual(rows[0]['client_name'], 'Клиент, "ООО"')
+        self.assertEqual(rows[0]['description'], 'Заказ\n0')
+
+    def test_incremental_export(self):
+        self.assertEqual(len(self.export('subscriptions', '--format', 'jsonl').splitlines()), 1)
+        self.assertEqual(self.export('subscriptions', '--format', 'jsonl', '--since-last'), '')
+        export = main_models.DataExport.objects.filter(dataset='subscriptions').first()
+        self.assertEqual(export.rows, 0)
+        self.assertIsNotNone(export.date_from)
+
+    def test_date_range(self):
+        main_models.Order.objects.filter(id=self.orders[0].id).update(
+            created_at=self.orders[0].created_at - timedelta(days=10)
+        )
+        day = (self.orders[0].created_at - timedelta(days=1)).date().isoformat()
+        records = [json.loads(line) for line in self.export('orders', '--format', 'jsonl', '--from', day).splitlines()]
+        self.assertEqual([record['id'] for record in records], [order.id for order in self.orders[1:]])
+
+    def test_admin_action_streams_selection(self):
+        action = admin_module.make_export_action('orders', 'csv')
+        response = action(None, None, main_models.Order.objects.filter(id=self.orders[1].id))
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual([row['id'] for row in csv.DictReader(StringIO(content))], [str(self.orders[1].id)])
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='100000:webhook')
+class TelegramWebhookTest(TestCase):
+
+    def setUp(self):
+        self.dispatcher = MagicMock(update_queue=Queue(), bot=None)
+        patcher = patch.object(views, 'get_telegram_dispatcher', return_value=self.dispatcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, token: str, body: str) -> int:
+        return self.client.post(
+            f'/webhook/telegram/{token}/',
+            data=body,
+            content_type='application/json'
+        ).status_code
+
+    def test_wrong_token_is_forbidden(self):
+        self.assertEqual(self.post('100000:wrong', '{}'), 403)
+        self.assertTrue(self.dispatcher.update_queue.empty())
+
+    def test_invalid_body_is_rejected(self):
+        self.assertEqual(self.post('100000:webhook', '{'), 400)
+        self.assertEqual(self.post('100000:webhook', '[]'), 400)
+        self.assertTrue(self.dispatcher.update_queue.empty())
+
+    def test_update_is_queued(self):
+        body = json.dumps({
+            'update_id': 7,
+            'message': {
+                'message_id': 1,
+                'date': 0,
+                'chat': {'id': 113, 'type': 'private'},
+                'text': '/start',
+            }
+        })
+        self.assertEqual(self.post('100000:webhook', body), 200)
+        update = self.dispatcher.update_queue.get_nowait()
+        self.assertIsInstance(update, Update)
+        self.assertEqual((update.update_id, update.effective_chat.id), (7, 113))
+
+
+@override_settings(YOOKASSA_VERIFY_PAYMENTS=False)
+class PaymentEventsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tariff = main_models.Tariff.objects.create(
+            title='Базовый',
+            orders_limit=5,
+            price=300,
+            answer_delay=timedelta(days=1)
+        )
+        cls.client_person = main_models.Person.objects.create(name='Плательщик', phone='+79000000012', telegram_id=112)
+        main_models.Client.objects.create(person=cls.client_person)
+
+    def setUp(self):
+        self.redis = MagicMock()
+        self.redis.get.return_value = None
+
+    def notification(self, payment_id: str, metadata: dict) -> dict:
+        return {
+            'type': 'notification',
+            'event': 'payment.succeeded',
+            'object': {
+                'id': payment_id,
+                'status': 'succeeded',
+                'paid': True,
+                'amount': {'value': '300.00', 'currency': 'RUB'},
+                'metadata': metadata,
+            }
+        }
+
+    def post(self, data) -> int:
+        return self.client.post(
+            '/webhook/yookassa/',
+            data=json.dumps(data),
+            content_type='application/json'
+        ).status_code
+
+    def test_duplicate_delivery_is_stored_once(self):
+        notification = self.notification('pay-1', {'user_id': 112, 'tariff_id': self.tariff.id})
+        self.assertEqual(self.post(notification), 200)
+        self.assertEqual(self.post(notification), 200)
+        self.assertEqual(main_models.PaymentEvent.objects.filter(payment_id='pay-1').count(), 1)
+
+    def test_invalid_notification_is_rejected(self):
+        self.assertEqual(self.post({'type': 'notification', 'event': 'payment.succeeded', 'object': {}}), 400)
+        self.assertEqual(self.client.post('/webhook/yookassa/', data='{', content_type='application/json').status_code, 400)
+        self.assertFalse(main_models.PaymentEvent.objects.exists())
+
+    def test_worker_creates_one_subscription(self):
+        for event in ('payment.succeeded', 'payment.waiting_for_capture'):
+            notification = self.notification('pay-2', {'user_id': '112', 'tariff_id': str(self.tariff.id)})
+            notification['event'] = event
+            yookassa_webhook.record_notification(notification)
+        bot = MagicMock()
+        self.assertEqual(yookassa_webhook.process_pending_events(bot=bot, redis=self.redis), 2)
+        self.assertEqual(yookassa_webhook.process_pending_events(bot=bot, redis=self.redis), 0)
+
+        subscription = main_models.ClientSubscription.objects.get(payment_id='pay-2')
+        self.assertEqual(subscription.client.person, self.client_person)
+        self.assertEqual(bot.send_message.call_count, 1)
+        self.assertEqual(
+            set(main_models.PaymentEvent.objects.values_list('state', flat=True)),
+            {main_models.PaymentEvent.PROCESSED}
+        )
+
+    def test_unknown_payment_is_retried_then_failed(self):
+        yookassa_webhook.record_notification(self.notification('pay-3', {}))
+        yookassa_webhook.process_pending_events(bot=MagicMock(), redis=self.redis)
+        event = main_models.PaymentEvent.objects.get(payment_id='pay-3')
+        self.assertEqual(event.state, main_models.PaymentEvent.RECEIVED)
+        self.assertIn('pay-3', event.error)
+
+        main_models.PaymentEvent.objects.filter(id=event.id).update(attempts=yookassa_webhook.MAX_ATTEMPTS)
+        with patch.object(yookassa_webhook, 'RETRY_DELAY', timedelta(0)):
+            yookassa_webhook.process_pending_events(bot=MagicMock(), redis=self.redis)
+        event.refresh_from_db()
+        self.assertEqual(event.state, main_models.PaymentEvent.FAILED)
+        self.assertFalse(main_models.ClientSubscription.objects.filter(payment_id='pay-3').exists())
+
+    def test_failed_notification_does_not_retry_payment(self):
+        failing_bots = {
+            'pay-5': MagicMock(**{'send_message.side_effect': TelegramError('Timed out')}),
+            'pay-6': MagicMock(**{'send_message.return_value': completed_future(error=TelegramError('Timed out'))}),
+        }
+        for payment_id, bot in failing_bots.items():
+            yookassa_webhook.record_notification(self.notification(payment_id, {'user_id': 112, 'tariff_id': self.tariff.id}))
+            with self.assertLogs(yookassa_webhook.logger, level='ERROR'):
+                yookassa_webhook.process_pending_events(bot=bot, redis=self.redis)
+            self.assertEqual(bot.send_message.call_args.kwargs['priority'], outbox.NOTIFICATION)
+            event = main_models.PaymentEvent.objects.get(payment_id=payment_id)
+            self.assertEqual(event.state, main_models.PaymentEvent.PROCESSED)
+            self.assertEqual(event.attempts, 1)
+
+    def test_activate_payment_is_idempotent(self):
+        first, created = db.activate_payment(112, self.tariff.id, 'pay-4')
+        self.assertTrue(created)
+        second, created = db.activate_payment(112, self.tariff.id, 'pay-4')
+        self.assertFalse(created)
+        self.assertEqual(first.id, second.id)
+
+
+class PaymentReconciliationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tariff = main_models.Tariff.objects.create(
+            title='Базовый',
+            orders_limit=5,
+            price=300,
+            answer_delay=timedelta(days=1)
+        )
+        main_models.Client.objects.create(
+            person=main_models.Person.objects.create(name='Плательщик', phone='+79000000013', telegram_id=113)
+        )
+
+    def make_redis(self, payments: dict, claimed: list[bool] = None) -> MagicMock:
+        """Redis с платежами {payment_id: возраст}"""
+        moment = datetime.now()
+        values = {
+            f'payment_{payment_id}': json.dumps({
+                'tariff_id': self.tariff.id,
+                'user_id': 113,
+                'created_at': (moment - age).isoformat()
+            })
+            for payment_id, age in payments.items()
+        }
+        redis = MagicMock()
+        redis.scan_iter.return_value = iter(values)
+        redis.mget.side_effect = lambda keys: [values[key] for key in keys]
+        pipe = redis.pipeline.return_value.__enter__.return_value
+        pipe.execute.side_effect = lambda: claimed if claimed is not None else [True] * len(pipe.set.call_args_list)
+        return redis
+
+    def find_one(self, payment_id: str) -> MagicMock:
+        payment = MagicMock()
+        payment.status = {'pay-paid': 'succeeded', 'pay-canceled': 'canceled'}.get(payment_id, 'pending')
+        payment.metadata = {'tariff_id': self.tariff.id, 'user_id': 113}
+        return payment
+
+    def reconcile(self, redis: MagicMock, bot: MagicMock = None) -> dict:
+        with patch.object(payment_reconciler.Payment, 'find_one', side_effect=self.find_one) as find_one:
+            result = payment_reconciler.reconcile_payments(bot=bot or MagicMock(), redis=redis)
+        self.checked = sorted(call.args[0] for call in find_one.call_args_list)
+        return result
+
+    def test_lost_webhook_is_reconciled(self):
+        redis = self.make_redis({
+            'pay-paid': timedelta(minutes=10),
+            'pay-canceled': timedelta(minutes=5),
+            'pay-pending': timedelta(hours=2),
+            'pay-fresh': timedelta(seconds=10),
+        })
+        bot = MagicMock()
+        result = self.reconcile(redis, bot)
+
+        self.assertEqual(self.checked, ['pay-canceled', 'pay-paid', 'pay-pending'])
+        self.assertEqual(result, {'checked': 3, 'activated': 1, 'canceled': 1, 'pending': 1, 'errors': 0})
+        self.assertTrue(main_models.ClientSubscription.objects.filter(payment_id='pay-paid').exists())
+        self.assertEqual(bot.send_message.call_count, 1)
+        self.assertEqual(payment_reconciler.get_stats()['lag_seconds'], 2 * 60 * 60)
+
+        # Платеж в ожидании проверяется тем реже, чем он старше
+        pipe = redis.pipeline.return_value.__enter__.return_value
+        intervals = {call.args[0]: call.kwargs['ex'] for call in pipe.set.call_args_list}
+        self.assertEqual(intervals['reconcile_payment_pay-pending'], 30 * 60)
+        self.assertEqual(intervals['reconcile_payment_pay-canceled'], 150)
+
+    def test_recently_checked_payment_is_skipped(self):
+        result = self.reconcile(self.make_redis({'pay-paid': timedelta(minutes=10)}, claimed=[False]))
+        self.assertEqual(self.checked, [])
+        self.assertEqual(result['checked'], 0)
+
+    def test_webhook_activation_is_not_repeated(self):
+        db.activate_payment(113, self.tariff.id, 'pay-paid')
+        bot = MagicMock()
+        result = self.reconcile(self.make_redis({'pay-paid': timedelta(minutes=10)}), bot)
+        self.assertEqual(result['activated'], 0)
+        self.assertEqual(main_models.ClientSubscription.objects.filter(payment_id='pay-paid').count(), 1)
+        bot.send_message.assert_not_called()
+
+
+class CallbackRouterTest(TestCase):
+
+    def test_dispatch_by_action(self):
+        show_category, cancel = MagicMock(return_value='CATEGORY'), MagicMock(return_value='CLIENT')
+        router = callback_router.CallbackRouter('CLIENT_SELECT_CATEGORY', [
+            (buttons.CATEGORY_CALLBACK, show_category),
+            (buttons.CANCEL['callback_data'], cancel),
+        ])
+        update = callback_bench.build_callback_update(callbacks.encode(buttons.CATEGORY_CALLBACK, 7))
+        context = MagicMock()
+        check_result = router.check_update(update)
+        self.assertEqual(router.handle_update(update, None, check_result, context), 'CATEGORY')
+        self.assertEqual(context.args, [7])
+        cancel.assert_not_called()
+
+        # Действие чужого состояния, кнопка с похожим префиксом и неизвестная версия формата не перехватываются
+        for data in ('cancel_edit_service', callbacks.encode('categories', 1), 'category.9AgU'):
+            self.assertIsNone(router.check_update(callback_bench.build_callback_update(data)))
+
+    def test_collision_fails_at_startup(self):
+        with self.assertRaises(ValueError):
+            callback_router.CallbackRouter('CLIENT', [
+                (buttons.EDIT_SERVICE['callback_data'], MagicMock()),
+                (buttons.EDIT_SERVICE_CALLBACK, MagicMock()),
+            ])
+        conversation = runbot.create_conversation_handler(redis=MagicMock())
+        self.assertIn('CLIENT', conversation.states)
+
+
+class CallbackCodecTest(TestCase):
+
+    def test_round_trip(self):
+        payment_id = uuid4()
+        for action, args in (
+            ('cancel', ()),
+            ('show_order', (15,)),
+            ('services_page', (3, 'next', 40)),
+            ('check_payment', (payment_id,)),
+            ('filter', (-7, True, False, None, 'Дизайн')),
+        ):
+            data = callbacks.encode(action, *args)
+            self.assertLessEqual(len(data.encode()), callbacks.MAX_CALLBACK_DATA)
+            self.assertEqual(callbacks.decode(data), (action, args))
+        self.assertEqual(callbacks.encode('cancel'), 'cancel')
+
+    def test_legacy_callback_data(self):
+        self.assertEqual(callbacks.decode('show_order:::15'), ('show_order', (15,)))
+        self.assertEqual(callbacks.decode('check_access:::client'), ('check_access', ('client',)))
+        self.assertEqual(callbacks.decode('services_page:3:next:40'), ('services_page', (3, 'next', 40)))
+
+    def test_invalid_callback_data(self):
+        for data in ('', 'Cancel', 'category.2AgU', 'category.1AgUA', 'category.1!!', 'category.1cw'):
+            with self.assertRaises(callbacks.CallbackDataError, msg=data):
+                callbacks.decode(data)
+
+    def test_large_payload_goes_to_redis(self):
+        redis = MagicMock()
+        stored = {}
+        redis.set.side_effect = lambda key, value, ex: stored.__setitem__(key, value)
+        redis.get.side_effect = stored.get
+        args = ('категория ' * 10, 5, 'next')
+        with patch.object(callbacks.redis_pool, 'get_redis', return_value=redis):
+            data = callbacks.encode('services_filter', *args)
+            self.assertLessEqual(len(data.encode()), callbacks.MAX_CALLBACK_DATA)
+            self.assertEqual(callbacks.decode(data), ('services_filter', args))
+            stored.clear()
+            callbacks.decode.cache_clear()
+            with self.assertRaises(callbacks.CallbackDataError):
+                callbacks.decode(data)
+
+
+class FakeHashRedis:
+    """Минимальный Redis для корзины: hash-команды и pipeline"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.expires = {}
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[str(field)] = str(value)
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hdel(self, key, *fields):
+        values = self.hashes.get(key, {})
+        return sum(values.pop(str(field), None) is not None for field in fields)
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+
+    def expire(self, key, seconds):
+        self.expires[key] = seconds
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+@override_settings(CATALOG_CACHE_REDIS=False)
+class RedisCartTest(LocalCatalogMixin, QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_person = main_models.Person.objects.create(name='Клиент', phone='+79000000114', telegram_id=114)
+        main_models.Client.objects.create(person=cls.client_person)
+        contractor = main_models.Contractor.objects.create(
+            person=main_models.Person.objects.create(name='Подрядчик', phone='+79000000115', telegram_id=115),
+            active=True
+        )
+        cls.services = [
+            main_models.Service.objects.create(
+                title=f'Услуга {number}',
+                description='Услуга',
+                price=1000,
+                discount=discount,
+                contractor=contractor
+            )
+            for number, discount in enumerate((0, 10, 0), start=1)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.redis = FakeHashRedis()
+
+    def test_cart_is_served_from_redis(self):
+        for service in self.services:
+            cart.get_catalog().get_service(service.id)
+        with self.assertMaxQueries(0):
+            for service in self.services[:2]:
+                self.assertTrue(cart.add_service(114, service.id, self.redis))
+            summary = cart.get_summary(114, self.redis)
+            keyboard = keyboards.get_cart_keyboard(summary)
+            self.assertTrue(cart.remove_service(114, self.services[0].id, self.redis))
+        self.assertEqual([item['title'] for item in summary.items], ['Услуга 1', 'Услуга 2'])
+        self.assertEqual(summary.items[1]['price'], Decimal('900.00'))
+        self.assertEqual((summary.total, summary.has_discount), (Decimal('1900.00'), False))
+        self.assertEqual(keyboard.inline_keyboard[1][0].text, '❌ Услуга 2 - 900.00 руб.')
+        self.assertEqual(self.redis.expires[cart.CART_KEY.format(114)], cart.CART_TTL)
+
+    def test_inactive_services_are_dropped(self):
+        cart.add_service(114, self.services[0].id, self.redis)
+        main_models.Service.objects.filter(id=self.services[0].id).update(is_active=False)
+        catalog.get_catalog().invalidate()
+        self.assertFalse(cart.add_service(114, self.services[0].id, self.redis))
+        self.assertEqual(cart.get_items(114, self.redis), [])
+        self.assertEqual(self.redis.hgetall(cart.CART_KEY.format(114)), {})
+
+    def test_checkout_persists_cart(self):
+        for service in self.services:
+            cart.add_service(114, service.id, self.redis)
+        service_set, summary = cart.checkout(114, self.redis)
+        self.assertEqual(summary.subtotal, Decimal('2900.00'))
+        self.assertEqual((summary.total, summary.discount_percent), (Decimal('2610.00'), 10))
+        self.assertIsNotNone(service_set.paid_at)
+        self.assertEqual(
+            sorted(service_set.services.values_list('id', flat=True)),
+            [service.id for service in self.services]
+        )
+        self.assertEqual(cart.get_items(114, self.redis), [])
+        self.assertIsNone(cart.checkout(114, self.redis))
+
+    def test_saved_set_uses_same_discount_rule(self):
+        for service in self.services:
+            cart.add_service(114, service.id, self.redis)
+        service_set, cart_summary = cart.checkout(114, self.redis)
+        with self.assertMaxQueries(2):
+            service_set = main_models.ServiceSet.objects.prefetch_related('services').get(id=service_set.id)
+        with self.assertMaxQueries(0):
+            summary = cart.CartSummary.from_service_set(service_set)
+            total_price = service_set.get_total_price()
+        self.assertEqual(summary.items, cart_summary.items)
+        self.assertEqual(summary.total, total_price)
+        self.assertEqual(total_price, Decimal('2610.00'))
+
+
+def completed_future(result=None, error: Exception = None) -> Future:
+    """Future, какой возвращает QueuedBot после отправки сообщения"""
+    future = Future()
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+    return future
+
+
+class ManagerNotifierTest(TestCase):
+
+    def setUp(self):
+        self.clock = [0.0]
+        for target, value in (
+            ('monotonic', lambda: self.clock[0]),
+            ('Thread', MagicMock()),
+        ):
+            patcher = patch.object(notifications, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.bot = MagicMock()
+        self.bot.send_message.side_effect = lambda chat_id, text, priority: completed_future()
+        self.notifier = notifications.ManagerNotifier(self.bot, rate=1, window=10)
+        self.notifier._get_managers = lambda: (1,)
+
+    def dispatch(self, at: float, message: str) -> None:
+        self.clock[0] = at
+        self.notifier._dispatch(at, message)
+
+    def flush(self, at: float) -> None:
+        self.clock[0] = at
+        self.notifier._flush_digests()
+
+    def sent(self) -> list[str]:
+        return [call.args[1] for call in self.bot.send_message.call_args_list]
+
+    def test_new_event_does_not_overtake_digest(self):
+        self.dispatch(0, 'A')
+        self.dispatch(1, 'B')
+        self.dispatch(2, 'C')
+        self.flush(5)
+        self.assertEqual(self.sent(), ['A'])
+
+        self.dispatch(11, 'D')
+        self.flush(12)
+        self.assertEqual(self.sent(), ['A', messages.manager_digest(['B', 'C', 'D'])])
+
+        self.dispatch(13, 'E')
+        self.flush(20)
+        self.flush(21)
+        self.assertEqual(self.sent()[2:], [messages.manager_digest(['E'])])
+        stats = self.notifier.stats()[1]
+        self.assertEqual((stats['delivered'], stats['pending']), (5, 0))
+        self.assertEqual(stats['max_latency_ms'], 10000)
+
+    def test_quiet_window_sends_immediately(self):
+        self.dispatch(0, 'A')
+        self.dispatch(15, 'B')
+        self.assertEqual(self.sent(), ['A', 'B'])
+
+
+class FakeRedis:
+    """Redis в памяти для строковых ключей: TTL запоминается, но не истекает"""
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = str(value)
+        self.ttls[key] = ex or -1
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def delete(self, *keys):
+        deleted = [key for key in keys if key in self.values]
+        for key in deleted:
+            del self.values[key], self.ttls[key]
+        return len(deleted)
+
+    def ttl(self, key):
+        return self.ttls.get(key, -2)
+
+    def expire(self, key, seconds):
+        if key not in self.values:
+            return False
+        self.ttls[key] = seconds
+        return True
+
+    def scan_iter(self, match='*', count=None):
+        return iter([key for key in list(self.values) if fnmatchcase(key, match)])
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Копит команды и выполняет их на FakeRedis по execute()"""
+
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append(partial(method, *args, **kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [command() for command in commands]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class ScratchTest(TestCase):
+
+    def test_expired_dialog_returns_to_main_screen(self):
+        for handler, text, state in (
+            (runbot.client_comment_description, 'Комментарий', 'CLIENT'),
+            (runbot.client_complaint_description, 'Претензия', 'CLIENT'),
+            (runbot.contractor_enter_estimate_datetime, '01.02.2030 10:00', 'CONTRACTOR'),
+        ):
+            update = make_update(chat_id=116)
+            update.message.text = text
+            context = MagicMock()
+            with patch.object(scratch, 'pop_value', return_value=None):
+                self.assertEqual(handler(MagicMock(), update, context), state)
+            self.assertEqual(context.bot.send_message.call_args_list[0].kwargs['text'], messages.DIALOG_EXPIRED)
+
+    def test_scratch_outlives_conversation(self):
+        self.assertGreaterEqual(scratch.SCRATCH_TTL, persistence.CONVERSATION_TTL)
+
+    def test_set_value_requires_ttl(self):
+        redis = FakeRedis()
+        for ttl in (None, 0, -5):
+            with self.assertRaises(ValueError):
+                scratch.set_value(redis, scratch.ORDER_ID, 116, '15', ttl=ttl)
+        self.assertEqual(redis.values, {})
+
+    def test_pop_value_reads_and_deletes(self):
+        redis = FakeRedis()
+        scratch.set_value(redis, scratch.ORDER_ID, 116, '15')
+        key = scratch.get_key(scratch.ORDER_ID, 116)
+        self.assertEqual(redis.ttl(key), scratch.SCRATCH_TTL)
+        with patch.object(redis, 'pipeline', wraps=redis.pipeline) as pipeline:
+            self.assertEqual(scratch.pop_value(redis, scratch.ORDER_ID, 116), '15')
+        # GET и DEL уходят одной транзакцией MULTI/EXEC
+        pipeline.assert_called_once_with()
+        self.assertNotIn(key, redis.values)
+        self.assertIsNone(scratch.pop_value(redis, scratch.ORDER_ID, 116))
+
+    def test_sweep_fixes_ttl_and_removes_only_legacy_keys(self):
+        redis = FakeRedis()
+        redis.set(scratch.get_key(scratch.ORDER_ID, 116), '1')
+        scratch.set_value(redis, scratch.CONTRACTOR_ORDER_ID, 117, '2')
+        legacy = ['116_order_id', '-100117_contractor_order_id']
+        unrelated = ['payment_order_id', 'user:116_order_id', '116_client_order_id', 'abc_order_id']
+        for key in legacy + unrelated:
+            redis.set(key, '3')
+
+        stats = scratch.get_stats(redis)
+        self.assertEqual((stats['total'], stats['without_ttl'], stats['legacy']), (2, 1, 2))
+        self.assertEqual(scratch.sweep(redis, ttl=60), (1, 2))
+        self.assertEqual(redis.ttl(scratch.get_key(scratch.ORDER_ID, 116)), 60)
+        self.assertEqual(redis.ttl(scratch.get_key(scratch.CONTRACTOR_ORDER_ID, 117)), scratch.SCRATCH_TTL)
+        self.assertEqual(sorted(key for key in redis.values if not key.startswith('scratch:')), sorted(unrelated))
+
+
+class OutboundQueueTest(TestCase):
+    """Очередь исходящих на поддельных часах: отправитель синхронный, поток очереди не запускается"""
+
+    def setUp(self):
+        self.clock = 0.0
+        self.sent = []
+        for target, value in (
+            ('monotonic', lambda: self.clock),
+            ('sleep', self.advance),
+            ('Thread', MagicMock()),
+        ):
+            patcher = patch.object(outbox, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def advance(self, seconds: float) -> None:
+        self.clock += seconds
+
+    def make_queue(self, **kwargs) -> outbox.OutboundQueue:
+        queue = outbox.OutboundQueue(**kwargs)
+        queue._senders.shutdown()
+        queue._senders = MagicMock()
+        queue._senders.submit.side_effect = lambda func, *args: func(*args)
+        return queue
+
+    def send(self, name: str):
+        def func():
+            self.sent.append((name, round(self.clock, 3)))
+            return name
+        return func
+
+    def drain(self, queue: outbox.OutboundQueue) -> None:
+        """Крутит цикл очереди, перематывая часы к ближайшему таймеру вместо ожидания"""
+        while queue._ready or queue._timers:
+            if not queue._ready and queue._timers[0][0] > self.clock:
+                self.clock = queue._timers[0][0]
+            queue._step()
+
+    def test_chat_order_and_priority(self):
+        queue = self.make_queue()
+        for number in range(3):
+            queue.submit(self.send(f'report-{number}'), chat_id=1, priority=outbox.REPORT)
+        queue.submit(self.send('notification'), chat_id=2, priority=outbox.NOTIFICATION)
+        future = queue.submit(self.send('reply'), chat_id=3, priority=outbox.INTERACTIVE)
+        self.drain(queue)
+        self.assertEqual(
+            [name for name, _ in self.sent],
+            ['reply', 'notification', 'report-0', 'report-1', 'report-2']
+        )
+        self.assertEqual(future.result(timeout=0), 'reply')
+        self.assertEqual(queue.stats()['sent'], 5)
+
+    def test_chat_rate_limit(self):
+        queue = self.make_queue(chat_rate=1, chat_burst=3)
+        for number in range(6):
+            queue.submit(self.send(str(number)), chat_id=1)
+        self.drain(queue)
+        self.assertEqual([moment for _, moment in self.sent], [0, 0, 0, 1, 2, 3])
+
+    def test_global_rate_limit(self):
+        queue = self.make_queue(global_rate=2)
+        for chat_id in range(5):
+            queue.submit(self.send(str(chat_id)), chat_id=chat_id)
+        self.drain(queue)
+        self.assertEqual(self.sent, [('0', 0), ('1', 0), ('2', 0.5), ('3', 1.0), ('4', 1.5)])
+
+    def test_retry_after_requeues_at_chat_head(self):
+        queue = self.make_queue()
+        attempts = []
+
+        def flooded():
+            attempts.append(self.clock)
+            if len(attempts) == 1:
+                raise RetryAfter(5)
+            return 'ok'
+
+        first = queue.submit(flooded, chat_id=1)
+        queue.submit(self.send('second'), chat_id=1)
+        self.drain(queue)
+        self.assertEqual(first.result(timeout=0), 'ok')
+        self.assertEqual(attempts, [0, 5])
+        self.assertEqual(self.sent, [('second', 5)])
+        self.assertEqual(queue.stats()['retried'], 1)
+
+    def test_retry_after_gives_up_after_max_retries(self):
+        queue = self.make_queue()
+        attempts = []
+
+        def flooded():
+            attempts.append(self.clock)
+            raise RetryAfter(1)
+
+        future = queue.submit(flooded, chat_id=1)
+        self.drain(queue)
+        self.assertIsInstance(future.exception(timeout=0), RetryAfter)
+        self.assertEqual(len(attempts), outbox.MAX_RETRIES + 1)
+        stats = queue.stats()
+        self.assertEqual((stats['retried'], stats['failed'], stats['chats']), (outbox.MAX_RETRIES, 1, 0))
+
+
+class ChatOrderedExecutorTest(TestCase):
+    chats_count = 4
+    updates_per_chat = 20
+
+    def make_update(self, chat_id: int, seq: int) -> MagicMock:
+        update = MagicMock(spec=Update)
+        update.effective_chat.id = chat_id
+        update.update_id = seq
+        return update
+
+    def test_chats_run_in_parallel_and_in_order(self):
+        # Первое обновление каждого чата ждет остальные чаты: пройти барьер можно, только если чаты обрабатываются параллельно
+        barrier = Barrier(self.chats_count, timeout=5)
+        lock = Lock()
+        handled = defaultdict(list)
+        running = set()
+        overlaps = []
+
+        def handle(update, context):
+            chat_id = update.effective_chat.id
+            with lock:
+                if chat_id in running:
+                    overlaps.append(chat_id)
+                running.add(chat_id)
+            if update.update_id == 0:
+                barrier.wait()
+            sleep(0.001)
+            with lock:
+                running.discard(chat_id)
+                handled[chat_id].append(update.update_id)
+
+        executor = chat_executor.ChatOrderedExecutor(workers=self.chats_count)
+        # defaults=None, иначе MagicMock включает run_async у всех обработчиков
+        dispatcher = chat_executor.ChatOrderedDispatcher(
+            MagicMock(defaults=None),
+            Queue(),
+            use_context=True,
+            executor=executor
+        )
+        dispatcher.add_handler(TypeHandler(Update, handle))
+        chat_ids = [3000 + num for num in range(self.chats_count)]
+        for seq in range(self.updates_per_chat):
+            for chat_id in chat_ids:
+                dispatcher.process_update(self.make_update(chat_id, seq))
+        executor.shutdown()
+
+        self.assertFalse(barrier.broken)
+        self.assertEqual(overlaps, [])
+        self.assertEqual(dict(handled), {chat_id: list(range(self.updates_per_chat)) for chat_id in chat_ids})
+        stats = executor.stats()
+        self.assertEqual((stats['processed'], stats['queue_depth'], stats['active_chats']), (80, 0, 0))
+
+    def test_busy_chat_yields_after_batch(self):
+        executor = chat_executor.ChatOrderedExecutor(workers=1)
+        released = Event()
+        order = []
+        executor.submit(1, lambda: released.wait(5) and order.append(('busy', 0)))
+        for seq in range(1, chat_executor.CHAT_BATCH_SIZE * 2):
+            executor.submit(1, order.append, ('busy', seq))
+        executor.submit(2, order.append, ('other', 0))
+        released.set()
+        # Ждем, пока пул сам обработает все, иначе после shutdown очередь чата дорабатывается без передышек
+        for _ in range(500):
+            if executor.stats()['processed'] == chat_executor.CHAT_BATCH_SIZE * 2 + 1:
+                break
+            sleep(0.01)
+        executor.shutdown()
+
+        # Единственный поток отдает другому чату управление после CHAT_BATCH_SIZE обновлений подряд
+        self.assertEqual(order.index(('other', 0)), chat_executor.CHAT_BATCH_SIZE)
+        self.assertEqual(
+            [seq for name, seq in order if name == 'busy'],
+            list(range(chat_executor.CHAT_BATCH_SIZE * 2))
+        )
+
+
+class SendFollowupTest(TestCase):
+
+    def setUp(self):
+        patcher = patch.dict(runbot.last_update_ids, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.callback = MagicMock(return_value='NEXT')
+        self.context = MagicMock()
+
+    def make_update(self, update_id: int) -> MagicMock:
+        update = make_update(chat_id=3010)
+        update.update_id = update_id
+        runbot.track_last_update(update, self.context)
+        return update
+
+    def schedule(self, update: MagicMock):
+        state = runbot.send_followup(self.callback, 'CLIENT', update=update, context=self.context)
+        self.assertEqual(state, 'CLIENT')
+        self.context.job_queue.run_once.assert_called_once_with(ANY, runbot.FOLLOWUP_DELAY)
+        return self.context.job_queue.run_once.call_args.args[0]
+
+    def test_followup_runs_after_delay(self):
+        update = self.make_update(1)
+        run_followup = self.schedule(update)
+        self.callback.assert_not_called()
+        run_followup(self.context)
+        self.callback.assert_called_once_with(update=update, context=self.context)
+
+    def test_without_job_queue_runs_immediately(self):
+        self.context.job_queue = None
+        state = runbot.send_followup(self.callback, 'CLIENT', update=self.make_update(1), context=self.context)
+        self.assertEqual(state, 'NEXT')
+        self.callback.assert_called_once()
+
+    def test_followup_goes_through_chat_executor(self):
+        self.context.dispatcher = MagicMock(spec=chat_executor.ChatOrderedDispatcher, executor=MagicMock())
+        run_followup = self.schedule(self.make_update(1))
+        run_followup(self.context)
+        self.callback.assert_not_called()
+        chat_id, followup = self.context.dispatcher.executor.submit.call_args.args
+        self.assertEqual(chat_id, 3010)
+        followup()
+        self.callback.assert_called_once()
+
+    def test_stale_followup_is_skipped(self):
+        run_followup = self.schedule(self.make_update(1))
+        self.make_update(2)
+        run_followup(self.context)
+        self.callback.assert_not_called()
+
+
+class RedisPoolTest(TestCase):
+
+    def setUp(self):
+        for name in ('pool', 'client'):
+            patcher = patch.object(redis_pool, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @override_settings(REDIS_MAX_CONNECTIONS=7)
+    def test_clients_share_one_pool(self):
+        self.assertEqual(redis_pool.pool_stats(), {})
+        client = redis_pool.get_redis()
+        self.assertIs(redis_pool.get_redis(), client)
+        self.assertIs(client.connection_pool, redis_pool.get_pool())
+        self.assertEqual(
+            redis_pool.pool_stats(),
+            {'max_connections': 7, 'created': 0, 'in_use': 0, 'idle': 0}
+        )
+
+    def test_stats_without_private_counters(self):
+        redis_pool.pool = MagicMock(spec=['max_connections'], max_connections=7)
+        self.assertEqual(redis_pool.pool_stats(), {'max_connections': 7})
+
+
+class RedisPersistenceTest(TestCase):
+
+    def setUp(self):
+        patcher = patch.object(persistence, 'Thread', MagicMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.redis = FakeRedis()
+
+    def make_persistence(self) -> persistence.RedisPersistence:
+        return persistence.RedisPersistence(self.redis, conversation_ttl=60, user_data_ttl=120, chat_data_ttl=180)
+
+    def test_round_trip_between_replicas(self):
+        writer = self.make_persistence()
+        writer.update_conversation('main', (118, 118), 'CLIENT')
+        writer.update_user_data(118, {'role': 'client'})
+        writer.update_chat_data(118, {'page': 2})
+
+        # Write-behind: до flush изменения видны только этой реплике
+        self.assertEqual(self.redis.values, {})
+        self.assertEqual(writer.get_conversations('main').get((118, 118)), 'CLIENT')
+        writer.flush()
+
+        conversation_key = writer.conversation_key('main', (118, 118))
+        self.assertEqual(json.loads(self.redis.get(conversation_key)), 'CLIENT')
+        self.assertEqual(self.redis.ttl(conversation_key), 60)
+        self.assertEqual(self.redis.ttl(writer.user_data_key(118)), 120)
+        self.assertEqual(self.redis.ttl(writer.chat_data_key(118)), 180)
+
+        reader = self.make_persistence()
+        conversations = reader.get_conversations('main')
+        self.assertEqual(conversations.get((118, 118)), 'CLIENT')
+        user_data = {'stale': True}
+        reader.refresh_user_data(118, user_data)
+        self.assertEqual(user_data, {'role': 'client'})
+        chat_data = {}
+        reader.refresh_chat_data(118, chat_data)
+        self.assertEqual(chat_data, {'page': 2})
+
+        writer.update_conversation('main', (118, 118), None)
+        writer.update_user_data(118, {})
+        writer.flush()
+        self.assertEqual(set(self.redis.values), {writer.chat_data_key(118)})
+        self.assertIsNone(conversations.get((118, 118)))
+        self.assertNotIn((118, 118), conversations)
+
+    def test_failed_flush_is_retried(self):
+        writer = self.make_persistence()
+        writer.update_conversation('main', (118, 118), 'CLIENT')
+        with patch.object(FakePipeline, 'execute', side_effect=ConnectionError('Redis недоступен')):
+            with self.assertRaises(ConnectionError):
+                writer.flush()
+        writer.update_user_data(118, {'role': 'client'})
+        writer.flush()
+        self.assertEqual(json.loads(self.redis.get(writer.conversation_key('main', (118, 118)))), 'CLIENT')
+        self.assertEqual(json.loads(self.redis.get(writer.user_data_key(118))), {'role': 'client'})
+
+
+class BackgroundJobsTest(TestCase):
+
+    def create_webhook_dispatcher(self, **kwargs) -> MagicMock:
+        with patch.object(runbot, 'create_dispatcher') as create_dispatcher, \
+                patch.object(runbot, 'setup_dispatcher'), \
+                patch.object(runbot, 'Thread'), \
+                patch.object(runbot, 'schedule_jobs') as schedule_jobs:
+            dispatcher = runbot.create_webhook_dispatcher(token='100000:test', redis=MagicMock(), **kwargs)
+        self.assertIs(dispatcher, create_dispatcher.return_value)
+        dispatcher.job_queue.start.assert_called_once_with()
+        return schedule_jobs
+
+    def test_django_processes_skip_jobs_by_default(self):
+        self.create_webhook_dispatcher().assert_not_called()
+        self.create_webhook_dispatcher(run_jobs=True).assert_called_once()
@@ -1,31 +1,72 @@
 from django.shortcuts import render
+import hmac
 import json
 import logging
+from threading import Lock
+from django.conf import settings
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
-from redis import Redis
-from main.management.commands.yookassa_webhook import handle_payment_notification
+from telegram import Update
+from main.management.commands.redis_pool import get_redis
+from main.management.commands.yookassa_webhook import record_notification
 
 logger = logging.getLogger(__name__)
-redis_client = Redis(host='localhost', port=6379, db=0)
+
+telegram_dispatcher = None
+telegram_dispatcher_lock = Lock()
 
 # Create your views here.
 
+
+def get_telegram_dispatcher():
+    """Лениво создает диспетчер бота, один на процесс Django"""
+    global telegram_dispatcher
+    from main.management.commands.runbot import create_webhook_dispatcher
+
+    with telegram_dispatcher_lock:
+        if telegram_dispatcher is None:
+            telegram_dispatcher = create_webhook_dispatcher(
+                token=settings.TELEGRAM_BOT_TOKEN,
+                redis=get_redis(),
+                workers=settings.TELEGRAM_WORKERS,
+                run_jobs=settings.TELEGRAM_WEBHOOK_JOBS
+            )
+    return telegram_dispatcher
+
+
+@csrf_exempt
+@require_POST
+def telegram_webhook(request, token):
+    """Принимает обновления Telegram и передает их в очередь диспетчера"""
+    if not settings.TELEGRAM_BOT_TOKEN or not hmac.compare_digest(token, settings.TELEGRAM_BOT_TOKEN):
+        return HttpResponse(status=403)
+    try:
+        update_data = json.loads(request.body.decode())
+    except ValueError:
+        return HttpResponse(status=400)
+    if not isinstance(update_data, dict):
+        return HttpResponse(status=400)
+
+    dispatcher = get_telegram_dispatcher()
+    dispatcher.update_queue.put(Update.de_json(update_data, dispatcher.bot))
+    return HttpResponse(status=200)
+
+
 @csrf_exempt
 @require_POST
 def yookassa_webhook(request):
-    """Обработчик вебхуков от YooKassa"""
+    """Сохраняет уведомление YooKassa и сразу отвечает 200, обработка идет в воркере"""
     try:
-        # Получаем данные уведомления
         notification_data = json.loads(request.body.decode())
-        logger.debug(f'Received YooKassa webhook: {notification_data}')
-        
-        # Обрабатываем уведомление
-        handle_payment_notification(notification_data, redis_client)
-        
-        return HttpResponse(status=200)
-        
+        event, created = record_notification(notification_data)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning(f'Invalid YooKassa notification: {e}')
+        return HttpResponse(status=400)
     except Exception as e:
-        logger.error(f'Error processing YooKassa webhook: {e}')
+        logger.error(f'Error storing YooKassa notification: {e}')
         return HttpResponse(status=500)
+
+    if not created:
+        logger.debug(f'Duplicate YooKassa notification: {event}')
+    return HttpResponse(status=200)
@@ -131,6 +131,41 @@ STATIC_ROOT = 'static'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Telegram
+TELEGRAM_BOT_TOKEN = env.str('TELEGRAM_BOT_TOKEN', '')
+TELEGRAM_WEBHOOK_URL = env.str('TELEGRAM_WEBHOOK_URL', '')
+# Размер пула обработчиков обновлений, 0 — последовательная обработка
+TELEGRAM_WORKERS = env.int('TELEGRAM_WORKERS', 0)
+# Запускать фоновые задачи бота в процессе Django, принимающем webhook.
+# Включайте, только если Django работает в одном процессе, иначе запустите runbot --jobs-only
+TELEGRAM_WEBHOOK_JOBS = env.bool('TELEGRAM_WEBHOOK_JOBS', False)
+# Сколько уведомлений менеджер получает по одному за окно, остальные собираются в дайджест
+MANAGER_NOTIFY_RATE = env.int('MANAGER_NOTIFY_RATE', 5)
+MANAGER_NOTIFY_WINDOW = env.int('MANAGER_NOTIFY_WINDOW', 60)
+
+# Redis
+REDIS_HOST = env.str('REDIS_HOST', 'localhost')
+REDIS_PORT = env.int('REDIS_PORT', 6379)
+REDIS_DB = env.int('REDIS_DB', 0)
+REDIS_PASSWORD = env.str('REDIS_PASSWORD', '')
+# Максимум соединений в общем пуле на процесс
+REDIS_MAX_CONNECTIONS = env.int('REDIS_MAX_CONNECTIONS', 50)
+
+# Кэш каталога услуг: второй уровень в Redis и время жизни записей, секунд
+CATALOG_CACHE_REDIS = env.bool('CATALOG_CACHE_REDIS', True)
+CATALOG_CACHE_TTL = env.int('CATALOG_CACHE_TTL', 300)
+
+# Поиск услуг: путь к классу бэкенда, по умолчанию FTS5 на SQLite и LIKE на других БД
+SERVICE_SEARCH_BACKEND = env.str('SERVICE_SEARCH_BACKEND', '')
+
+# Учет заработка подрядчиков по месяцам при закрытии заказов
+CONTRACTOR_EARNINGS_ROLLUP = env.bool('CONTRACTOR_EARNINGS_ROLLUP', True)
+
+# Перед активацией подписки сверять статус платежа с API YooKassa
+YOOKASSA_VERIFY_PAYMENTS = env.bool('YOOKASSA_VERIFY_PAYMENTS', True)
+# Сколько платежей сверка проверяет в API одновременно
+PAYMENT_RECONCILE_CONCURRENCY = env.int('PAYMENT_RECONCILE_CONCURRENCY', 8)
+
 # Media files (Uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -2,7 +2,7 @@ from django.http import HttpResponseRedirect
 from django.contrib import admin
 from django.urls import path
 from django.urls import reverse
-from main.views import yookassa_webhook
+from main.views import telegram_webhook, yookassa_webhook
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -13,6 +13,7 @@ def redirect2admin(request):
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('webhook/yookassa/', yookassa_webhook, name='yookassa_webhook'),
+    path('webhook/telegram/<str:token>/', telegram_webhook, name='telegram_webhook'),
 ]
 
 # Добавляем обработку медиа-файлов в режиме разработки